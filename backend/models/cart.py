@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 class CartItem(BaseModel):
@@ -8,6 +8,15 @@ class CartItem(BaseModel):
     quantity: int
     added_at: Optional[str] = None
 
+class CartOperation(BaseModel):
+    op: Literal["add", "set", "remove"]
+    variant_id: str
+    product_id: Optional[str] = None  # defaults to the variant's product
+    quantity: Optional[int] = None    # required for add / set
+
+class CartBulkRequest(BaseModel):
+    operations: List[CartOperation] = Field(min_length=1, max_length=100)
+
 class Cart(BaseModel):
     user_id: str
     items: List[CartItem] = Field(default_factory=list)
@@ -1,10 +1,9 @@
 from pydantic import BaseModel, Field, validator
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime, timezone
 import re
 
-class CouponBase(BaseModel):
-    code: str
+class CouponTerms(BaseModel):
     type: str  # percentage or flat
     value: float = Field(gt=0)
     min_order_amount: float = Field(default=0, ge=0)
@@ -15,15 +14,6 @@ class CouponBase(BaseModel):
     active: bool = True
     description: Optional[str] = None
     
-    @validator('code')
-    def validate_code(cls, v):
-        if not v or not v.strip():
-            raise ValueError('Coupon code is required')
-        # Only allow alphanumeric and underscore
-        if not re.match(r'^[A-Z0-9_]+$', v.upper()):
-            raise ValueError('Coupon code must contain only letters, numbers and underscore')
-        return v.upper()
-    
     @validator('type')
     def validate_type(cls, v):
         if v not in ['percentage', 'flat']:
@@ -41,6 +31,18 @@ class CouponBase(BaseModel):
         except Exception:
             raise ValueError('Invalid expiry date format. Use ISO format (YYYY-MM-DDTHH:MM:SSZ)')
 
+class CouponBase(CouponTerms):
+    code: str
+    
+    @validator('code')
+    def validate_code(cls, v):
+        if not v or not v.strip():
+            raise ValueError('Coupon code is required')
+        # Only allow alphanumeric and underscore
+        if not re.match(r'^[A-Z0-9_]+$', v.upper()):
+            raise ValueError('Coupon code must contain only letters, numbers and underscore')
+        return v.upper()
+
 class CouponCreate(CouponBase):
     pass
 
@@ -71,4 +73,45 @@ class ValidateCouponResponse(BaseModel):
     valid: bool
     discount: float = 0
     message: str
-    coupon_code: Optional[str] = None
\ No newline at end of file
+    coupon_code: Optional[str] = None
+
+class BestCouponRequest(BaseModel):
+    cart_subtotal: Optional[float] = Field(default=None, ge=0)  # omitted: the caller's cart is priced
+    user_id: Optional[str] = None  # For per-user limits when not signed in
+    limit: int = Field(default=5, ge=1, le=20)
+
+class BestCouponOffer(BaseModel):
+    code: str
+    type: str
+    value: float
+    discount: float
+    min_order_amount: float = 0
+    max_discount: Optional[float] = None
+    description: Optional[str] = None
+    expiry_date: str
+
+class BestCouponResponse(BaseModel):
+    cart_subtotal: float
+    coupons: List[BestCouponOffer]
+
+class BulkCouponCreate(CouponTerms):
+    """N coupons sharing the same terms, each with a random code."""
+    count: int = Field(gt=0, le=100000)
+    prefix: str = ""
+    length: int = Field(default=10, ge=4, le=32)  # random part, excluding prefix
+    alphabet: str = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # no 0/O, 1/I
+    usage_limit: Optional[int] = Field(default=1, gt=0)
+    per_user_limit: Optional[int] = Field(default=1, gt=0)
+    
+    @validator('prefix')
+    def validate_prefix(cls, v):
+        if v and not re.match(r'^[A-Z0-9_]+$', v.upper()):
+            raise ValueError('Prefix must contain only letters, numbers and underscore')
+        return v.upper()
+    
+    @validator('alphabet')
+    def validate_alphabet(cls, v):
+        v = "".join(dict.fromkeys(v.upper()))
+        if len(v) < 2 or not re.match(r'^[A-Z0-9_]+$', v):
+            raise ValueError('Alphabet needs at least two distinct letters, numbers or underscores')
+        return v
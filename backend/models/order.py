@@ -40,6 +40,7 @@ class CreateOrderRequest(BaseModel):
     address_id: str
     coupon_code: Optional[str] = None
     payment_method: str = "razorpay"
+    quote: Optional[str] = None  # signed token from /checkout/preview
 
 class VerifyPaymentRequest(BaseModel):
     order_id: str
@@ -99,6 +100,7 @@ class OrderResponse(BaseModel):
 class InitiateOrderRequest(BaseModel):
     payment_method: str = "PREPAID"
     coupon_code: Optional[str] = None
+    quote: Optional[str] = None  # signed token from /checkout/preview
 
 
 class InitiateOrderResponse(BaseModel):
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional, Dict
+from pydantic import AliasChoices, BaseModel, Field, field_validator
+from typing import Optional, Dict, List
 from datetime import datetime
 
 class Settings(BaseModel):
@@ -26,12 +26,45 @@ class UpdateSettingsRequest(BaseModel):
 
 
 class GlobalSettings(BaseModel):
-    shipping_threshold: int = 599
+    # Older settings documents use free_shipping_threshold / prepaid_discount
+    shipping_threshold: int = Field(
+        default=599,
+        validation_alias=AliasChoices("shipping_threshold", "free_shipping_threshold"),
+    )
     shipping_fee: int = 129
     cod_fee: int = 149
 
-    prepaid_discount_1: int = 5
+    prepaid_discount_1: int = Field(
+        default=5,
+        validation_alias=AliasChoices("prepaid_discount_1", "prepaid_discount"),
+    )
     prepaid_discount_2: int = 5
     prepaid_threshold_2: int = 1199
 
-    enabled_states: Dict[str, bool]  # 🔥 NEW
+    enabled_states: Dict[str, bool] = Field(default_factory=dict)  # 🔥 NEW
+
+    @field_validator("enabled_states", mode="before")
+    @classmethod
+    def states_from_list(cls, value):
+        # /admin/settings/states stores a plain list of enabled state names
+        if isinstance(value, list):
+            return {state: True for state in value}
+        return value or {}
+
+
+# ======================================================
+# WHAT-IF PRICING SIMULATION (ADMIN)
+# ======================================================
+
+class PricingSimulationRequest(BaseModel):
+    days: int = Field(default=365, ge=1, le=1095)
+    top: int = Field(default=50, ge=1, le=1000)
+
+    # Candidate values per setting; omitted fields keep their current value
+    shipping_threshold: Optional[List[float]] = None
+    shipping_fee: Optional[List[float]] = None
+    cod_fee: Optional[List[float]] = None
+    prepaid_discount_1: Optional[List[float]] = None
+    prepaid_discount_2: Optional[List[float]] = None
+    prepaid_threshold_2: Optional[List[float]] = None
+    coupon_value_scale: Optional[List[float]] = None  # 1.0 = coupons as defined
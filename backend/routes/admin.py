@@ -6,6 +6,7 @@ import uuid
 from pymongo.errors import DuplicateKeyError
 
 from middleware.auth_middleware import require_admin_user
+from services.catalog import bump_catalog_version
 
 from models.product import (
     ProductCreate,
@@ -59,6 +60,7 @@ async def create_product(
     }
 
     await db.products.insert_one(product_doc)
+    await bump_catalog_version(db)
     return ProductResponse(**product_doc)
 
 @router.get("/products")
@@ -102,6 +104,7 @@ async def update_product(
     if result.matched_count == 0:
         raise HTTPException(404, "Product not found")
 
+    await bump_catalog_version(db)
     updated = await db.products.find_one({"id": product_id}, {"_id": 0})
     return ProductResponse(**updated)
 
@@ -124,6 +127,7 @@ async def toggle_product_status(
         {"id": product_id},
         {"$set": {"is_active": new_status}}
     )
+    await bump_catalog_version(db)
 
     return {"is_active": new_status}
 
@@ -143,6 +147,7 @@ async def force_delete_product(
 
     await db.variants.delete_many({"product_id": product_id})
     await db.products.delete_one({"id": product_id})
+    await bump_catalog_version(db)
 
     return {
         "success": True,
@@ -172,6 +177,7 @@ async def create_variant(
     }
 
     await db.variants.insert_one(variant_doc)
+    await bump_catalog_version(db)
 
     return VariantResponse(**variant_doc)
 
@@ -216,6 +222,7 @@ async def update_variant(
     if result.matched_count == 0:
         raise HTTPException(404, "Variant not found")
 
+    await bump_catalog_version(db)
     updated = await db.variants.find_one({"id": variant_id}, {"_id": 0})
     return VariantResponse(**updated)
 
@@ -238,6 +245,7 @@ async def toggle_variant_status(
         {"id": variant_id},
         {"$set": {"is_active": new_status}}
     )
+    await bump_catalog_version(db)
 
     return {"is_active": new_status}
 
@@ -264,6 +272,7 @@ async def update_variant_stock(
     if result.matched_count == 0:
         raise HTTPException(404, "Variant not found")
 
+    await bump_catalog_version(db)
     return {"in_stock": in_stock}
 
 
@@ -10,6 +10,7 @@ from models.product import (
     VariantResponse,
 )
 from middleware.auth_middleware import require_admin_user
+from services.catalog import bump_catalog_version
 
 router = APIRouter(prefix="/admin/products", tags=["Admin Products"])
 
@@ -60,6 +61,7 @@ async def update_product(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
 
+    await bump_catalog_version(db)
     updated = await db.products.find_one({"id": product_id}, {"_id": 0})
     return updated
 
@@ -82,6 +84,7 @@ async def toggle_product(
         {"id": product_id},
         {"$set": {"is_active": new_status}},
     )
+    await bump_catalog_version(db)
 
     return {"is_active": new_status}
 
@@ -138,6 +141,7 @@ async def update_variant(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Variant not found")
 
+    await bump_catalog_version(db)
     updated = await db.variants.find_one({"id": variant_id}, {"_id": 0})
     return updated
 
@@ -160,6 +164,7 @@ async def toggle_variant_stock(
         {"id": variant_id},
         {"$set": {"in_stock": new_stock}},
     )
+    await bump_catalog_version(db)
 
     return {"in_stock": new_stock}
 
@@ -182,5 +187,6 @@ async def toggle_variant_status(
         {"id": variant_id},
         {"$set": {"is_active": new_status}},
     )
+    await bump_catalog_version(db)
 
     return {"is_active": new_status}
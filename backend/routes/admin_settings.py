@@ -1,16 +1,31 @@
-from fastapi import APIRouter
-from middleware.admin_middleware import admin_required
-from db import db
+from fastapi import APIRouter, Depends, Header, HTTPException
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from datetime import datetime
+import asyncio
+
+from middleware.auth_middleware import require_admin_user
+from models.settings import PricingSimulationRequest
+from services.pricing_simulator import SCENARIO_FIELDS, build_scenarios, load_order_columns, simulate
+from services.settings_provider import GLOBAL_SETTINGS_ID, get_global_settings, invalidate_settings
 
 router = APIRouter(prefix="/admin/settings", tags=["Admin Settings"])
 
 
+async def get_db():
+    from db import db
+    return db
+
+
 @router.post("/states")
-@admin_required
-def update_states(states: list[str]):
-    db.settings.update_one(
-        {"_id": "GLOBAL"},
+async def update_states(
+    states: list[str],
+    authorization: str = Header(None),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    await require_admin_user(authorization, db)
+
+    await db.settings.update_one(
+        {"_id": GLOBAL_SETTINGS_ID},
         {
             "$set": {
                 "enabled_states": states,
@@ -19,5 +34,30 @@ def update_states(states: list[str]):
         },
         upsert=True
     )
+    invalidate_settings()
 
     return {"success": True}
+
+
+@router.post("/simulate")
+async def simulate_pricing(
+    request: PricingSimulationRequest,
+    authorization: str = Header(None),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    What-if revenue impact of candidate shipping / prepaid / COD / coupon
+    settings, re-priced over paid and COD orders from the last `days` days.
+    """
+    await require_admin_user(authorization, db)
+
+    base = await get_global_settings(db)
+    grid = {field: getattr(request, field) for field in SCENARIO_FIELDS}
+
+    try:
+        build_scenarios(base, grid)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    columns = await load_order_columns(db, request.days)
+    return await asyncio.to_thread(simulate, columns, base, grid, request.top)
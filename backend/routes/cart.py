@@ -1,10 +1,12 @@
-from datetime import datetime
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from pydantic import BaseModel
 
 from middleware.auth_middleware import get_current_user
-from models.cart import CartItem
+from models.cart import CartItem, CartBulkRequest, CartOperation
+from services.cart_store import CartNotFound, CartStoreError, CartVersionConflict, get_cart_store
+from services.variant_resolver import VariantResolver, is_available
 
 router = APIRouter(prefix="/cart", tags=["Cart"])
 
@@ -19,6 +21,15 @@ async def get_db():
     return db
 
 
+async def get_store(db=Depends(get_db)):
+    return await get_cart_store(db)
+
+
+async def get_resolver(db=Depends(get_db)) -> VariantResolver:
+    """Request-scoped resolver (FastAPI caches a dependency per request)."""
+    return VariantResolver(db)
+
+
 def _require_user_id(user: dict) -> str:
     user_id = user.get("id") if user else None
     if not user_id:
@@ -29,32 +40,112 @@ def _require_user_id(user: dict) -> str:
     return user_id
 
 
-async def _calculate_cart_total(db, items: list[dict]) -> float:
+def _parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Cart version a mutation is conditional on (If-Match: 3, "3" or W/"3")."""
+    if if_match is None:
+        return None
+
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+
+    if not value.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "If-Match must be a cart version number.", "code": "INVALID_IF_MATCH", "if_match": if_match},
+        )
+    return int(value)
+
+
+def _cart_error(exc: CartStoreError, user_id: str, variant_id: Optional[str] = None) -> HTTPException:
+    if isinstance(exc, CartVersionConflict):
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "Cart was modified by another request.",
+                "code": "CART_VERSION_CONFLICT",
+                "expected_version": exc.expected_version,
+                "current_version": exc.current_version,
+                "user_id": user_id,
+            },
+        )
+
+    if isinstance(exc, CartNotFound):
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"message": "Cart was not found for the authenticated user.", "code": "CART_NOT_FOUND", "user_id": user_id},
+        )
+
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail={
+            "message": "Variant not found in the authenticated user's cart.",
+            "code": "CART_ITEM_NOT_FOUND",
+            "variant_id": variant_id,
+            "user_id": user_id,
+        },
+    )
+
+
+async def _price_cart_lines(resolver: VariantResolver, items: list[dict]) -> tuple[list[dict], float]:
+    """
+    Enrich cart lines with product name, size, unit price and line total
+    from a single bulk variant fetch. Lines whose variant no longer exists
+    are returned unpriced and excluded from the total.
+    """
+    variants = await resolver.resolve(item.get("variant_id") for item in items)
+
+    lines = []
     total = 0.0
     for item in items:
-        variant = await db.variants.find_one({"id": item["variant_id"]}, {"_id": 0, "selling_price": 1})
+        variant = variants.get(item.get("variant_id"))
         if not variant:
+            lines.append({**item, "available": False})
             continue
-        total += float(variant.get("selling_price", 0)) * int(item.get("quantity", 0))
-    return round(total, 2)
+
+        unit_price = float(variant.get("selling_price", 0))
+        line_total = round(unit_price * int(item.get("quantity", 0)), 2)
+        total += line_total
+
+        lines.append({
+            **item,
+            "product_name": (variant.get("product") or {}).get("name", "Product"),
+            "size": variant.get("size", ""),
+            "unit_price": unit_price,
+            "line_total": line_total,
+            "available": is_available(variant),
+        })
+
+    return lines, round(total, 2)
 
 
 @router.get("/")
-async def get_cart(user: dict = Depends(get_current_user), db=Depends(get_db)):
+async def get_cart(
+    user: dict = Depends(get_current_user),
+    store=Depends(get_store),
+    resolver: VariantResolver = Depends(get_resolver),
+):
     user_id = _require_user_id(user)
-    cart = await db.carts.find_one({"user_id": user_id}, {"_id": 0})
+    cart = await store.get(user_id)
 
     if not cart:
-        return {"items": [], "total": 0.0, "coupon_code": None}
+        return {"items": [], "total": 0.0, "coupon_code": None, "version": 0}
 
-    items = cart.get("items", [])
-    total = await _calculate_cart_total(db, items)
-    return {"items": items, "total": total, "coupon_code": cart.get("coupon_code")}
+    items, total = await _price_cart_lines(resolver, cart.get("items", []))
+    return {"items": items, "total": total, "coupon_code": cart.get("coupon_code"), "version": cart.get("version", 0)}
 
 
 @router.post("/add")
-async def add_to_cart(item: CartItem, user: dict = Depends(get_current_user), db=Depends(get_db)):
+async def add_to_cart(
+    item: CartItem,
+    user: dict = Depends(get_current_user),
+    db=Depends(get_db),
+    store=Depends(get_store),
+    if_match: Optional[str] = Header(None),
+):
     user_id = _require_user_id(user)
+    expected_version = _parse_if_match(if_match)
 
     if item.quantity <= 0:
         raise HTTPException(
@@ -73,34 +164,24 @@ async def add_to_cart(item: CartItem, user: dict = Depends(get_current_user), db
             },
         )
 
-    cart = await db.carts.find_one({"user_id": user_id}, {"_id": 0}) or {"user_id": user_id, "items": [], "coupon_code": None}
-    items = cart.get("items", [])
-
-    existing = next((i for i in items if i["variant_id"] == item.variant_id), None)
-    if existing:
-        existing["quantity"] += item.quantity
-    else:
-        items.append(
-            {
-                "variant_id": item.variant_id,
-                "product_id": item.product_id,
-                "quantity": item.quantity,
-                "added_at": datetime.utcnow().isoformat(),
-            }
-        )
-
-    await db.carts.update_one(
-        {"user_id": user_id},
-        {"$set": {"items": items, "coupon_code": cart.get("coupon_code"), "updated_at": datetime.utcnow().isoformat()}},
-        upsert=True,
-    )
+    operation = CartOperation(op="add", variant_id=item.variant_id, product_id=item.product_id, quantity=item.quantity)
+    try:
+        version = await store.apply(user_id, [operation], expected_version)
+    except CartStoreError as exc:
+        raise _cart_error(exc, user_id, item.variant_id)
 
-    return {"success": True}
+    return {"success": True, "version": version}
 
 
 @router.put("/update")
-async def update_quantity(item: CartItem, user: dict = Depends(get_current_user), db=Depends(get_db)):
+async def update_quantity(
+    item: CartItem,
+    user: dict = Depends(get_current_user),
+    store=Depends(get_store),
+    if_match: Optional[str] = Header(None),
+):
     user_id = _require_user_id(user)
+    expected_version = _parse_if_match(if_match)
 
     if item.quantity <= 0:
         raise HTTPException(
@@ -108,88 +189,113 @@ async def update_quantity(item: CartItem, user: dict = Depends(get_current_user)
             detail={"message": "Quantity must be at least 1.", "code": "INVALID_QUANTITY", "quantity": item.quantity},
         )
 
-    cart = await db.carts.find_one({"user_id": user_id}, {"_id": 0})
-    if not cart:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail={"message": "Cart was not found for the authenticated user.", "code": "CART_NOT_FOUND", "user_id": user_id},
-        )
-
-    items = cart.get("items", [])
-    updated = False
-    for cart_item in items:
-        if cart_item["variant_id"] == item.variant_id:
-            cart_item["quantity"] = item.quantity
-            updated = True
-            break
+    try:
+        version = await store.set_quantity(user_id, item.variant_id, item.quantity, expected_version)
+    except CartStoreError as exc:
+        raise _cart_error(exc, user_id, item.variant_id)
 
-    if not updated:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail={
-                "message": "Variant not found in the authenticated user's cart.",
-                "code": "CART_ITEM_NOT_FOUND",
-                "variant_id": item.variant_id,
-                "user_id": user_id,
-            },
-        )
-
-    await db.carts.update_one(
-        {"user_id": user_id},
-        {"$set": {"items": items, "updated_at": datetime.utcnow().isoformat()}},
-    )
-    return {"success": True}
+    return {"success": True, "version": version}
 
 
 @router.delete("/remove/{variant_id}")
-async def remove_item(variant_id: str, user: dict = Depends(get_current_user), db=Depends(get_db)):
+async def remove_item(
+    variant_id: str,
+    user: dict = Depends(get_current_user),
+    store=Depends(get_store),
+    if_match: Optional[str] = Header(None),
+):
+    user_id = _require_user_id(user)
+    expected_version = _parse_if_match(if_match)
+
+    try:
+        version = await store.remove_line(user_id, variant_id, expected_version)
+    except CartStoreError as exc:
+        raise _cart_error(exc, user_id, variant_id)
+
+    return {"success": True, "version": version}
+
+
+@router.post("/bulk")
+async def bulk_update_cart(
+    request: CartBulkRequest,
+    user: dict = Depends(get_current_user),
+    store=Depends(get_store),
+    resolver: VariantResolver = Depends(get_resolver),
+    if_match: Optional[str] = Header(None),
+):
+    """
+    Apply a batch of add / set / remove operations (guest-cart merge,
+    re-order) as one validated, atomic cart update.
+    """
     user_id = _require_user_id(user)
-    cart = await db.carts.find_one({"user_id": user_id}, {"_id": 0})
+    expected_version = _parse_if_match(if_match)
 
-    if not cart:
+    upserts = [op for op in request.operations if op.op in ("add", "set")]
+
+    invalid_quantities = [op.variant_id for op in upserts if not op.quantity or op.quantity <= 0]
+    if invalid_quantities:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail={"message": "Cart was not found for the authenticated user.", "code": "CART_NOT_FOUND", "user_id": user_id},
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Quantity must be at least 1.", "code": "INVALID_QUANTITY", "variant_ids": invalid_quantities},
         )
 
-    original_items = cart.get("items", [])
-    items = [i for i in original_items if i["variant_id"] != variant_id]
-    if len(items) == len(original_items):
+    available = await resolver.resolve_available(op.variant_id for op in upserts)
+    unavailable = [op.variant_id for op in upserts if op.variant_id not in available]
+    if unavailable:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
+            status_code=status.HTTP_400_BAD_REQUEST,
             detail={
-                "message": "Variant not found in the authenticated user's cart.",
-                "code": "CART_ITEM_NOT_FOUND",
-                "variant_id": variant_id,
-                "user_id": user_id,
+                "message": "Variant is unavailable or out of stock.",
+                "code": "VARIANT_UNAVAILABLE",
+                "variant_ids": unavailable,
             },
         )
 
-    await db.carts.update_one(
-        {"user_id": user_id},
-        {"$set": {"items": items, "updated_at": datetime.utcnow().isoformat()}},
-    )
-    return {"success": True}
+    operations = [
+        op if op.op == "remove" or op.product_id
+        else op.model_copy(update={"product_id": available[op.variant_id].get("product_id")})
+        for op in request.operations
+    ]
+
+    try:
+        version = await store.apply(user_id, operations, expected_version)
+    except CartStoreError as exc:
+        raise _cart_error(exc, user_id)
+
+    return {"success": True, "applied": len(operations), "version": version}
 
 
 @router.delete("/")
-async def clear_cart(user: dict = Depends(get_current_user), db=Depends(get_db)):
+async def clear_cart(
+    user: dict = Depends(get_current_user),
+    store=Depends(get_store),
+    if_match: Optional[str] = Header(None),
+):
     user_id = _require_user_id(user)
-    await db.carts.delete_one({"user_id": user_id})
-    return {"success": True}
+    expected_version = _parse_if_match(if_match)
+
+    try:
+        version = await store.clear(user_id, expected_version)
+    except CartStoreError as exc:
+        raise _cart_error(exc, user_id)
+
+    return {"success": True, "version": version}
 
 
 @router.post("/validate")
-async def validate_cart(request: CartValidateRequest, user: dict = Depends(get_current_user), db=Depends(get_db)):
+async def validate_cart(
+    request: CartValidateRequest,
+    user: dict = Depends(get_current_user),
+    resolver: VariantResolver = Depends(get_resolver),
+):
     _require_user_id(user)
 
-    invalid_items = []
-    for item in request.items:
-        variant = await db.variants.find_one(
-            {"id": item.get("variant_id"), "is_active": True, "in_stock": True},
-            {"_id": 0, "id": 1},
-        )
-        if not variant:
-            invalid_items.append({"variant_id": item.get("variant_id"), "reason": "unavailable"})
+    available = await resolver.resolve_available(item.get("variant_id") for item in request.items)
+
+    invalid_items = [
+        {"variant_id": item.get("variant_id"), "reason": "unavailable"}
+        for item in request.items
+        if item.get("variant_id") not in available
+    ]
 
     return {"invalid_items": invalid_items}
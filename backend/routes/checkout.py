@@ -2,10 +2,14 @@ from fastapi import APIRouter, HTTPException, Depends
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel
 from typing import Optional
-from datetime import datetime, timezone
+import asyncio
 import logging
 
 from middleware.auth_middleware import get_current_user
+from services.cart_store import get_cart_store
+from services.checkout_quote import issue_quote
+from services.pricing_engine import CouponRejected, PricingError, get_pricing_rules, load_coupon_rule
+from services.variant_resolver import VariantResolver
 
 router = APIRouter(prefix="/checkout", tags=["Checkout"])
 logger = logging.getLogger(__name__)
@@ -28,7 +32,7 @@ class CheckoutPreviewRequest(BaseModel):
 
 
 # ==============================
-# CHECKOUT PREVIEW (BUSINESS LOGIC PRESERVED)
+# CHECKOUT PREVIEW
 # ==============================
 @router.post("/preview")
 async def preview_checkout(
@@ -38,7 +42,8 @@ async def preview_checkout(
 ):
     """
     Production-grade checkout preview.
-    Business rules preserved exactly as original.
+    Pricing rules are shared with order creation and coupon validation
+    (services.pricing_engine).
     Cart is read from DB (source of truth).
     """
 
@@ -46,7 +51,9 @@ async def preview_checkout(
         # =====================================
         # 1️⃣ FETCH CART FROM DATABASE
         # =====================================
-        cart = await db.carts.find_one({"user_id": user["id"]})
+        cart_store = await get_cart_store()
+        await cart_store.flush(user["id"])
+        cart = await cart_store.get(user["id"])
 
         if not cart or not cart.get("items"):
             raise HTTPException(status_code=400, detail="Cart is empty")
@@ -54,23 +61,23 @@ async def preview_checkout(
         cart_items = cart["items"]
 
         # =====================================
-        # 2️⃣ FETCH VALID VARIANTS
+        # 2️⃣ FETCH VARIANTS + PRODUCTS, SETTINGS, COUPON (CONCURRENTLY)
         # =====================================
         variant_ids = [item["variant_id"] for item in cart_items]
+        coupon_code = (request.coupon_code or "").strip().upper()
 
-        variants = await db.variants.find({
-            "id": {"$in": variant_ids},
-            "is_active": True,
-            "in_stock": True
-        }).to_list(length=len(variant_ids))
-
-        variant_map = {v["id"]: v for v in variants}
+        variant_map, rules, coupon = await asyncio.gather(
+            VariantResolver(db).resolve_available(variant_ids),
+            get_pricing_rules(db),
+            load_coupon_rule(db, coupon_code),
+        )
 
         # =====================================
         # 3️⃣ CALCULATE SUBTOTAL
         # =====================================
         subtotal = 0
         detailed_items = []
+        quote_lines = []
 
         for item in cart_items:
             variant = variant_map.get(item["variant_id"])
@@ -81,15 +88,9 @@ async def preview_checkout(
                     detail=f"Item {item['variant_id']} is unavailable"
                 )
 
-            product = await db.products.find_one(
-                {
-                    "id": variant.get("product_id"),
-                    "is_active": True
-                },
-                {"_id": 0, "name": 1, "image_urls": 1}
-            )
+            product = variant.get("product")
 
-            if not product:
+            if not product or product.get("is_active") is not True:
                 raise HTTPException(
                     status_code=400,
                     detail="Product unavailable"
@@ -111,120 +112,71 @@ async def preview_checkout(
                 "variant_size": variant.get("size", ""),
                 "variant_unit": variant.get("unit", "g")
             })
+            quote_lines.append({
+                **detailed_items[-1],
+                "product_id": variant.get("product_id")
+            })
 
         subtotal = round(subtotal, 2)
 
         # =====================================
-        # 4️⃣ FETCH GLOBAL SETTINGS
+        # 4️⃣ SHIPPING, COUPON, PAYMENT METHOD (SHARED PRICING RULES)
         # =====================================
-        settings = await db.settings.find_one({"_id": "GLOBAL"}) or {}
+        try:
+            if coupon_code and coupon is None:
+                raise CouponRejected("Invalid coupon code", "COUPON_INVALID")
 
-        free_shipping_threshold = settings.get("free_shipping_threshold", 599)
-        shipping_fee = settings.get("shipping_fee", 129)
-        cod_fee = settings.get("cod_fee", 149)
-        prepaid_discount_percent = settings.get("prepaid_discount", 5)
+            pricing = rules.price(subtotal, request.payment_method, coupon)
+        except PricingError as exc:
+            raise HTTPException(status_code=400, detail=exc.message)
 
-        # =====================================
-        # 5️⃣ SHIPPING CALCULATION
-        # =====================================
-        delivery_fee = 0 if subtotal >= free_shipping_threshold else shipping_fee
+        discount = pricing["coupon_discount"]
+        coupon_data = pricing["coupon"]
 
         # =====================================
-        # 6️⃣ COUPON LOGIC (NO MINIMUM ORDER FOR SYSTEM)
+        # 5️⃣ SIGNED QUOTE (REUSED BY ORDER CREATION)
         # =====================================
-        discount = 0
-        coupon_data = None
-
-        if request.coupon_code and request.coupon_code.strip():
-            coupon_code = request.coupon_code.strip().upper()
-
-            coupon = await db.coupons.find_one({
-                "code": coupon_code,
-                "active": True
-            })
-
-            if not coupon:
-                raise HTTPException(status_code=400, detail="Invalid coupon code")
-
-            # Expiry check
-            try:
-                expiry = datetime.fromisoformat(
-                    coupon["expiry_date"].replace("Z", "+00:00")
+        quote = issue_quote(
+            user_id=user["id"],
+            cart_version=cart.get("version", 0),
+            lines=quote_lines,
+            totals={
+                key: pricing[key]
+                for key in (
+                    "subtotal", "coupon_discount", "prepaid_discount", "high_value_discount",
+                    "total_discount", "shipping", "cod_fee", "grand_total"
                 )
-                if expiry <= datetime.now(timezone.utc):
-                    raise HTTPException(status_code=400, detail="Coupon expired")
-            except Exception:
-                raise HTTPException(status_code=400, detail="Invalid coupon expiry date")
-
-            # Usage limit
-            if coupon.get("usage_limit"):
-                if coupon.get("used_count", 0) >= coupon["usage_limit"]:
-                    raise HTTPException(status_code=400, detail="Coupon usage limit exceeded")
-
-            # Discount calculation
-            if coupon["type"] == "percentage":
-                discount = subtotal * (coupon["value"] / 100)
-                if coupon.get("max_discount"):
-                    discount = min(discount, coupon["max_discount"])
-            else:
-                discount = min(coupon["value"], subtotal)
-
-            discount = round(discount, 2)
-
-            coupon_data = {
-                "code": coupon["code"],
-                "discount": discount,
-                "type": coupon["type"],
-                "value": coupon["value"]
-            }
-
-        # =====================================
-        # 7️⃣ PAYMENT METHOD CALCULATIONS
-        # =====================================
-        prepaid_discount = 0
-        cod_charge = 0
-
-        if request.payment_method == "PREPAID":
-            prepaid_discount = round(
-                subtotal * (prepaid_discount_percent / 100),
-                2
-            )
-        elif request.payment_method == "COD":
-            cod_charge = cod_fee
-
-        # =====================================
-        # 8️⃣ FINAL CALCULATION
-        # =====================================
-        total_discount = discount + prepaid_discount
-        grand_total = round(
-            subtotal - total_discount + delivery_fee + cod_charge,
-            2
+            },
+            payment_method=request.payment_method,
+            coupon=coupon_data
         )
 
-        remaining_for_free_shipping = max(0, free_shipping_threshold - subtotal)
-
         # =====================================
-        # 9️⃣ RESPONSE
+        # 6️⃣ RESPONSE
         # =====================================
         return {
             "items": detailed_items,
-            "subtotal": subtotal,
+            "subtotal": pricing["subtotal"],
             "discount": discount,
             "coupon": coupon_data,
             "charges": {
-                "shipping": delivery_fee,
-                "cod_fee": cod_charge
+                "shipping": pricing["shipping"],
+                "cod_fee": pricing["cod_fee"]
             },
             "discounts": {
                 "coupon_discount": discount,
-                "prepaid_discount": prepaid_discount,
-                "total_discount": total_discount
+                "prepaid_discount": pricing["prepaid_discount"],
+                "high_value_discount": pricing["high_value_discount"],
+                "total_discount": pricing["total_discount"]
             },
-            "grand_total": grand_total,
+            "grand_total": pricing["grand_total"],
             "progress": {
-                "remaining_for_free_shipping": round(remaining_for_free_shipping, 2)
+                "remaining_for_free_shipping": pricing["remaining_for_free_shipping"],
+                "remaining_for_high_value_discount": pricing["remaining_for_high_value_discount"]
             },
             "payment_method": request.payment_method,
+            "quote": quote["token"] if quote else None,
+            "quote_expires_at": quote["expires_at"] if quote else None,
             "message": "Pricing calculated successfully"
         }
 
@@ -1,13 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from datetime import datetime, timezone
 from uuid import uuid4
 from typing import Optional, List
+import logging
 
-from middleware.auth_middleware import require_admin_user
-from models.coupon import CouponBase, CouponCreate, CouponUpdate, CouponResponse, ValidateCouponRequest, ValidateCouponResponse
+from middleware.auth_middleware import get_current_user, require_admin_user
+from utils.http_cache import payload_etag, etag_matches, not_modified
+from services.pricing_engine import CouponRejected, check_user_limit, invalidate_coupon_cache, load_coupon_rule
+from models.coupon import BestCouponOffer, BestCouponRequest, BestCouponResponse, BulkCouponCreate, CouponBase, CouponCreate, CouponUpdate, CouponResponse, ValidateCouponRequest, ValidateCouponResponse
+from services.cart_store import get_cart_store
+from services.coupon_codes import CouponGenerationError, check_code_space, ensure_code_index, generate_coupons
+from services.coupon_finder import best_coupons
+from services.variant_resolver import VariantResolver
 
 router = APIRouter(prefix="/coupons", tags=["Coupons"])
+logger = logging.getLogger(__name__)
 
 # =========================
 # DB DEPENDENCY
@@ -72,12 +81,46 @@ async def create_coupon(
     })
     
     await db.coupons.insert_one(coupon_data)
+    invalidate_coupon_cache()
     
     # Remove _id for response
     coupon_data.pop("_id", None)
     
     return coupon_data
 
+@router.post("/admin/bulk")
+async def bulk_create_coupons(
+    payload: BulkCouponCreate,
+    admin_user: dict = Depends(require_admin_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Generate many coupons with random codes (admin only); streams `code,id` CSV rows batch by batch"""
+    
+    try:
+        check_code_space(payload)
+        await ensure_code_index(db)
+    except CouponGenerationError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    async def rows():
+        # The status is already sent once rows flow, so a failure ends the CSV with an error row
+        yield "code,id\n"
+        created = 0
+        try:
+            async for batch in generate_coupons(db, payload):
+                invalidate_coupon_cache()
+                created += len(batch)
+                yield "".join(f"{coupon['code']},{coupon['id']}\n" for coupon in batch)
+        except Exception as exc:
+            logger.exception("Bulk coupon generation failed after %d of %d coupons", created, payload.count)
+            yield f"# error: generation stopped after {created} of {payload.count} coupons: {exc}\n"
+    
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="coupons.csv"'}
+    )
+
 @router.get("/admin/{coupon_id}", response_model=CouponResponse)
 async def get_coupon(
     coupon_id: str,
@@ -129,6 +172,7 @@ async def update_coupon(
         {"id": coupon_id},
         {"$set": update_data}
     )
+    invalidate_coupon_cache()
     
     updated = await db.coupons.find_one({"id": coupon_id}, {"_id": 0})
     return updated
@@ -145,6 +189,7 @@ async def delete_coupon(
     
     if permanent:
         result = await db.coupons.delete_one({"id": coupon_id})
+        invalidate_coupon_cache()
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Coupon not found")
         return {"success": True, "message": "Coupon permanently deleted"}
@@ -153,6 +198,7 @@ async def delete_coupon(
             {"id": coupon_id},
             {"$set": {"active": False, "updated_at": datetime.now(timezone.utc).isoformat()}}
         )
+        invalidate_coupon_cache()
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Coupon not found")
         return {"success": True, "message": "Coupon deactivated"}
@@ -179,6 +225,7 @@ async def toggle_coupon(
             "updated_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    invalidate_coupon_cache()
     
     return {"active": new_status}
 
@@ -188,6 +235,8 @@ async def toggle_coupon(
 
 @router.get("/active")
 async def get_active_coupons(
+    request: Request,
+    response: Response,
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
     """Get all active and valid coupons for customers"""
@@ -210,8 +259,64 @@ async def get_active_coupons(
         }
     ).sort("created_at", -1).to_list(50)
     
+    etag = payload_etag(coupons)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    response.headers["ETag"] = etag
     return coupons
 
+async def _cart_subtotal(db: AsyncIOMotorDatabase, user_id: str) -> float:
+    """Subtotal of the user's cart at current prices; unavailable lines are left out."""
+    cart_store = await get_cart_store()
+    await cart_store.flush(user_id)
+    cart = await cart_store.get(user_id)
+    items = (cart or {}).get("items") or []
+    
+    variants = await VariantResolver(db).resolve_available(item["variant_id"] for item in items)
+    subtotal = sum(
+        variants[item["variant_id"]].get("selling_price", 0) * max(1, item["quantity"])
+        for item in items
+        if item["variant_id"] in variants
+    )
+    return round(subtotal, 2)
+
+@router.post("/best", response_model=BestCouponResponse)
+async def find_best_coupons(
+    request: BestCouponRequest,
+    authorization: str = Header(None),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Rank the coupons that apply to a subtotal (or the signed-in user's cart), best discount first"""
+    
+    user = None
+    if authorization or request.cart_subtotal is None:
+        user = await get_current_user(authorization=authorization, db=db)
+    user_id = user["id"] if user else request.user_id
+    
+    subtotal = request.cart_subtotal
+    if subtotal is None:
+        subtotal = await _cart_subtotal(db, user_id)
+    
+    index, ranked = await best_coupons(db, subtotal, user_id, request.limit)
+    
+    return BestCouponResponse(
+        cart_subtotal=subtotal,
+        coupons=[
+            BestCouponOffer(
+                code=rule.code,
+                type=rule.type,
+                value=rule.value,
+                discount=discount,
+                min_order_amount=rule.min_order_amount,
+                max_discount=rule.max_discount,
+                description=index.descriptions.get(rule.id),
+                expiry_date=rule.expires_at.isoformat(),
+            )
+            for rule, discount in ranked
+        ]
+    )
+
 @router.post("/validate", response_model=ValidateCouponResponse)
 async def validate_coupon(
     request: ValidateCouponRequest,
@@ -219,10 +324,7 @@ async def validate_coupon(
 ):
     """Validate a coupon and calculate discount"""
     
-    # Find coupon
-    coupon = await db.coupons.find_one(
-        {"code": request.code.upper(), "active": True}
-    )
+    coupon = await load_coupon_rule(db, request.code)
     
     if not coupon:
         return ValidateCouponResponse(
@@ -231,59 +333,22 @@ async def validate_coupon(
             message="Invalid coupon code"
         )
     
-    # Check expiry
-    expiry = datetime.fromisoformat(coupon["expiry_date"].replace("Z", "+00:00"))
-    if expiry <= datetime.now(timezone.utc):
+    # Expiry, minimum order and usage limits (shared pricing rules)
+    try:
+        coupon.check(request.cart_subtotal)
+        await check_user_limit(db, coupon, request.user_id)
+    except CouponRejected as exc:
         return ValidateCouponResponse(
             valid=False,
             discount=0,
-            message="Coupon has expired"
+            message=exc.message
         )
     
-    # Check minimum order
-    if request.cart_subtotal < coupon.get("min_order_amount", 0):
-        return ValidateCouponResponse(
-            valid=False,
-            discount=0,
-            message=f"Minimum order amount ₹{coupon['min_order_amount']} required"
-        )
-    
-    # Check global usage limit
-    if coupon.get("usage_limit") and coupon["used_count"] >= coupon["usage_limit"]:
-        return ValidateCouponResponse(
-            valid=False,
-            discount=0,
-            message="Coupon usage limit exceeded"
-        )
-    
-    # Check per-user limit
-    if request.user_id and coupon.get("per_user_limit"):
-        user_usage = await db.coupon_usage.count_documents({
-            "coupon_id": coupon["id"],
-            "user_id": request.user_id
-        })
-        if user_usage >= coupon["per_user_limit"]:
-            return ValidateCouponResponse(
-                valid=False,
-                discount=0,
-                message="You have already used this coupon"
-            )
-    
-    # Calculate discount
-    if coupon["type"] == "percentage":
-        discount = request.cart_subtotal * (coupon["value"] / 100)
-        if coupon.get("max_discount"):
-            discount = min(discount, coupon["max_discount"])
-    else:
-        discount = min(coupon["value"], request.cart_subtotal)  # Can't discount more than subtotal
-    
-    discount = round(discount, 2)
-    
     return ValidateCouponResponse(
         valid=True,
-        discount=discount,
+        discount=coupon.discount(request.cart_subtotal),
         message="Coupon applied successfully",
-        coupon_code=coupon["code"]
+        coupon_code=coupon.code
     )
 
 @router.post("/apply")
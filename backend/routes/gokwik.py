@@ -1,12 +1,12 @@
 from fastapi import APIRouter, HTTPException, Request, Depends, Header
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from datetime import datetime, timezone
-import uuid
 import logging
 from typing import Dict, Any
 from utils.gokwik_client import verify_gokwik_payment, create_gokwik_order
 from utils.email_service import send_order_confirmation
 from utils.invoice_generator import generate_invoice
+from services.coupon_redemption import record_redemption, release_reservation
 
 router = APIRouter(prefix="/gokwik", tags=["Gokwik"])
 logger = logging.getLogger(__name__)
@@ -77,24 +77,7 @@ async def gokwik_webhook(
                 )
             
             # Track coupon usage
-            if order.get("coupon_applied"):
-                coupon = order["coupon_applied"]
-                await db.coupons.update_one(
-                    {"id": coupon["coupon_id"]},
-                    {"$inc": {"used_count": 1}}
-                )
-                await db.coupon_usage.insert_one({
-                    "id": str(uuid.uuid4()),
-                    "coupon_id": coupon["coupon_id"],
-                    "coupon_code": coupon["code"],
-                    "user_id": order["user_id"],
-                    "user_email": order.get("user_email", ""),
-                    "order_id": merchant_order_id,
-                    "order_number": order["order_number"],
-                    "order_amount": order["subtotal"],
-                    "discount_amount": coupon["discount"],
-                    "used_at": datetime.now(timezone.utc).isoformat()
-                })
+            await record_redemption(db, order, order["user_id"])
             
             # Generate invoice
             try:
@@ -138,6 +121,7 @@ async def gokwik_webhook(
                     }
                 }
             )
+            await release_reservation(db, merchant_order_id)
             return {"status": "success", "message": "Payment failure recorded"}
         
         return {"status": "success"}
@@ -4,6 +4,11 @@ from models.order import CreateOrderRequest, OrderResponse, VerifyPaymentRequest
 from utils.gokwik_client import create_gokwik_order
 from utils.email_service import send_order_confirmation, send_order_status_update, send_admin_order_notification
 from utils.invoice_generator import generate_invoice
+from services.cart_store import get_cart_store
+from services.coupon_redemption import record_redemption, release_reservation, reserve_coupon
+from services.checkout_quote import QuoteError, quoted_quantities, revalidate_quote, verify_quote
+from services.pricing_engine import CouponRejected, PricingError, check_user_limit, get_pricing_rules, load_coupon_rule
+import asyncio
 import uuid
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional
@@ -68,6 +73,25 @@ async def _calculate_order_total_from_cart(db, cart_items: list[dict]) -> tuple[
     return order_items, round(total, 2)
 
 
+async def _verified_quote(db, token: str, user_id: str, payment_method: str, check_stock_levels: bool = False) -> dict:
+    """
+    Accept a /checkout/preview quote after re-checking stock and coupon limits.
+    The quote must have been priced for the payment method the order is
+    priced under, so a quote never changes the amount charged.
+    """
+    try:
+        quote = verify_quote(token, user_id)
+        if (quote.get("pm") or "").upper() != payment_method:
+            raise QuoteError("Checkout quote was priced for a different payment method.", "QUOTE_MISMATCH")
+        await revalidate_quote(db, quote, check_stock_levels)
+    except QuoteError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT if exc.code.startswith("QUOTE_") else status.HTTP_400_BAD_REQUEST,
+            detail={"message": exc.message, "code": exc.code},
+        )
+    return quote
+
+
 @router.post("/initiate")
 async def initiate_order(
     request: InitiateOrderRequest,
@@ -76,18 +100,63 @@ async def initiate_order(
 ):
     """Initiate order from authenticated user's cart and optionally create GoKwik checkout session."""
 
-    cart = await db.carts.find_one({"user_id": user["id"]}, {"_id": 0})
+    cart_store = await get_cart_store()
+    cart = await cart_store.get(user["id"])
     if not cart or not cart.get("items"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail={"message": "Cart is empty.", "code": "CART_EMPTY"},
         )
 
-    order_items, total_amount = await _calculate_order_total_from_cart(db, cart.get("items", []))
     payment_method = (request.payment_method or "PREPAID").upper()
     if payment_method not in {"PREPAID", "COD"}:
         raise HTTPException(status_code=400, detail={"message": "Invalid payment method.", "code": "INVALID_PAYMENT_METHOD"})
 
+    coupon_code = request.coupon_code
+    coupon_applied = None
+    if request.quote:
+        quote = await _verified_quote(db, request.quote, user["id"], payment_method)
+        if quote["cv"] != cart.get("version", 0):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={"message": "Cart changed since the quote was issued.", "code": "QUOTE_STALE"},
+            )
+        order_items = [
+            {
+                "variant_id": line["variant_id"],
+                "product_id": line.get("product_id"),
+                "quantity": line["quantity"],
+                "price": float(line["price"]),
+                "total": round(float(line["price"]) * line["quantity"], 2),
+            }
+            for line in quote["lines"]
+        ]
+        total_amount = quote["totals"]["grand_total"]
+        coupon_applied = quote.get("coupon")
+        coupon_code = coupon_applied["code"] if coupon_applied else None
+    else:
+        order_items, subtotal = await _calculate_order_total_from_cart(db, cart.get("items", []))
+        rules, coupon = await asyncio.gather(
+            get_pricing_rules(db),
+            load_coupon_rule(db, coupon_code),
+        )
+
+        # Same rules and payment method a quote would have been priced with
+        try:
+            if coupon_code and coupon_code.strip() and coupon is None:
+                raise CouponRejected("Invalid coupon code", "COUPON_INVALID")
+
+            pricing = rules.price(subtotal, payment_method, coupon)
+
+            if coupon is not None:
+                await check_user_limit(db, coupon, user["id"])
+        except PricingError as exc:
+            raise HTTPException(status_code=400, detail={"message": exc.message, "code": exc.code})
+
+        total_amount = pricing["grand_total"]
+        coupon_applied = pricing["coupon"]
+        coupon_code = coupon_applied["code"] if coupon_applied else None
+
     now = datetime.now(timezone.utc).isoformat()
     order_id = str(uuid.uuid4())
 
@@ -96,7 +165,8 @@ async def initiate_order(
         "user_id": user["id"],
         "items": order_items,
         "total_amount": total_amount,
-        "coupon_code": request.coupon_code,
+        "coupon_code": coupon_code,
+        "coupon_applied": coupon_applied,
         "payment_method": payment_method,
         "payment_status": "PENDING",
         "order_status": "CREATED",
@@ -105,6 +175,12 @@ async def initiate_order(
         "gokwik_order_id": None,
     }
 
+    if coupon_applied and not await reserve_coupon(db, coupon_applied["coupon_id"], order_id, user["id"]):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "This coupon has reached its usage limit", "code": "COUPON_LIMIT_REACHED"},
+        )
+
     checkout_url = None
     if payment_method == "PREPAID":
         customer = {
@@ -123,6 +199,7 @@ async def initiate_order(
             cart_items=order_items,
         )
         if not gokwik_response.get("success"):
+            await release_reservation(db, order_id)
             raise HTTPException(
                 status_code=status.HTTP_502_BAD_GATEWAY,
                 detail={"message": gokwik_response.get("error", "Unable to create GoKwik order."), "code": "GOKWIK_CREATE_FAILED"},
@@ -131,7 +208,11 @@ async def initiate_order(
         checkout_url = gokwik_response.get("checkout_url")
 
     await db.orders.insert_one(order_doc)
-    await db.carts.delete_one({"user_id": user["id"]})
+    if payment_method == "COD":
+        # No payment callback for COD; the order itself redeems the coupon
+        await record_redemption(db, order_doc, user["id"])
+    await cart_store.clear(user["id"])
+    await cart_store.flush(user["id"])
 
     return {"order_id": order_id, "total_amount": total_amount, "checkout_url": checkout_url}
 # ============================
@@ -147,113 +228,106 @@ async def create_order(
 ):
     """Create order and Gokwik payment order"""
     
-    # 1. Get settings
-    settings = await db.settings.find_one({"_id": "GLOBAL"}) or {}
-    free_shipping_threshold = settings.get("free_shipping_threshold", 999)
-    shipping_fee = settings.get("shipping_fee", 129)
-    
-    # 2. Validate cart items
-    validated_items = []
-    subtotal = 0
-    
-    for item in request.items:
-        variant = await db.variants.find_one(
-            {"id": item.variant_id, "is_active": True},
-            {"_id": 0}
-        )
-        
-        if not variant:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Variant {item.variant_id} not available"
-            )
-        
-        if variant.get("stock", 0) < item.quantity:
+    if request.quote:
+        # Priced by /checkout/preview; only stock and coupon limits are re-checked.
+        quote = await _verified_quote(db, request.quote, user["id"], "PREPAID", check_stock_levels=True)
+        requested = {item.get("variant_id"): item.get("quantity") for item in request.items}
+        if requested != quoted_quantities(quote):
             raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient stock for {variant.get('size', '')}"
+                status_code=status.HTTP_409_CONFLICT,
+                detail={"message": "Items do not match the checkout quote.", "code": "QUOTE_MISMATCH"},
             )
-        
-        product = await db.products.find_one(
-            {"id": variant["product_id"]},
-            {"_id": 0, "name": 1, "images": 1}
+
+        validated_items = [
+            {
+                "product_id": line.get("product_id"),
+                "variant_id": line["variant_id"],
+                "product_name": line.get("product_name", "Product"),
+                "product_image": line.get("image", ""),
+                "variant_size": line.get("variant_size", ""),
+                "variant_unit": line.get("variant_unit", "g"),
+                "mrp": line["mrp"],
+                "price": line["price"],
+                "quantity": line["quantity"],
+                "total": round(line["price"] * line["quantity"], 2)
+            }
+            for line in quote["lines"]
+        ]
+        totals = quote["totals"]
+        subtotal = totals["subtotal"]
+        discount = totals["total_discount"]
+        coupon_applied = quote.get("coupon")
+        shipping_fee_actual = totals["shipping"]
+        total = totals["grand_total"]
+    else:
+        # 1. Get pricing rules and coupon
+        rules, coupon = await asyncio.gather(
+            get_pricing_rules(db),
+            load_coupon_rule(db, request.coupon_code),
         )
-        
-        item_total = variant["selling_price"] * item.quantity
-        subtotal += item_total
-        
-        validated_items.append({
-            "product_id": variant["product_id"],
-            "variant_id": item.variant_id,
-            "product_name": product["name"] if product else "Product",
-            "product_image": product.get("images", [{}])[0].get("url", "") if product else "",
-            "variant_size": variant.get("size", ""),
-            "variant_unit": variant.get("unit", "g"),
-            "mrp": variant["mrp"],
-            "price": variant["selling_price"],
-            "quantity": item.quantity,
-            "total": item_total
-        })
     
-    # 3. COUPON VALIDATION
-    discount = 0
-    coupon_applied = None
+        # 2. Validate cart items
+        validated_items = []
+        subtotal = 0
     
-    if request.coupon_code:
-        code = request.coupon_code.upper().strip()
-        coupon = await db.coupons.find_one(
-            {"code": code, "active": True},
-            {"_id": 0}
-        )
+        for item in request.items:
+            variant = await db.variants.find_one(
+                {"id": item.variant_id, "is_active": True},
+                {"_id": 0}
+            )
         
-        if not coupon:
-            raise HTTPException(status_code=400, detail="Invalid coupon code")
+            if not variant:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Variant {item.variant_id} not available"
+                )
         
-        expiry = datetime.fromisoformat(coupon["expiry_date"].replace("Z", "+00:00"))
-        if expiry <= datetime.now(timezone.utc):
-            raise HTTPException(status_code=400, detail="Coupon has expired")
+            if variant.get("stock", 0) < item.quantity:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Insufficient stock for {variant.get('size', '')}"
+                )
         
-        if subtotal < coupon.get("min_order_amount", 0):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Add items worth ₹{coupon['min_order_amount'] - subtotal} more to use this coupon"
+            product = await db.products.find_one(
+                {"id": variant["product_id"]},
+                {"_id": 0, "name": 1, "images": 1}
             )
         
-        if coupon.get("usage_limit"):
-            if coupon.get("used_count", 0) >= coupon["usage_limit"]:
-                raise HTTPException(status_code=400, detail="This coupon has reached its usage limit")
+            item_total = variant["selling_price"] * item.quantity
+            subtotal += item_total
         
-        if coupon.get("per_user_limit"):
-            user_usage = await db.coupon_usage.count_documents({
-                "coupon_id": coupon["id"],
-                "user_id": user["id"]
+            validated_items.append({
+                "product_id": variant["product_id"],
+                "variant_id": item.variant_id,
+                "product_name": product["name"] if product else "Product",
+                "product_image": product.get("images", [{}])[0].get("url", "") if product else "",
+                "variant_size": variant.get("size", ""),
+                "variant_unit": variant.get("unit", "g"),
+                "mrp": variant["mrp"],
+                "price": variant["selling_price"],
+                "quantity": item.quantity,
+                "total": item_total
             })
-            if user_usage >= coupon["per_user_limit"]:
-                raise HTTPException(status_code=400, detail="You have already used this coupon")
-        
-        if coupon["type"] == "percentage":
-            discount = subtotal * (coupon["value"] / 100)
-            if coupon.get("max_discount"):
-                discount = min(discount, coupon["max_discount"])
-        else:
-            discount = min(coupon["value"], subtotal)
-        
-        discount = round(discount, 2)
-        
-        coupon_applied = {
-            "coupon_id": coupon["id"],
-            "code": coupon["code"],
-            "type": coupon["type"],
-            "value": coupon["value"],
-            "discount": discount
-        }
-    
-    # 4. Calculate shipping
-    shipping_fee_actual = 0 if subtotal >= free_shipping_threshold else shipping_fee
-    
-    # 5. Calculate total
-    total = round(subtotal - discount + shipping_fee_actual, 2)
     
+        # 3. Coupon, shipping and total (shared pricing rules)
+        try:
+            if request.coupon_code and request.coupon_code.strip() and coupon is None:
+                raise CouponRejected("Invalid coupon code", "COUPON_INVALID")
+
+            # Always an online payment, so priced as PREPAID (as its quotes must be)
+            pricing = rules.price(subtotal, "PREPAID", coupon)
+
+            if coupon is not None:
+                await check_user_limit(db, coupon, user["id"])
+        except PricingError as exc:
+            raise HTTPException(status_code=400, detail=exc.message)
+
+        subtotal = pricing["subtotal"]
+        discount = pricing["total_discount"]
+        coupon_applied = pricing["coupon"]
+        shipping_fee_actual = pricing["shipping"]
+        total = pricing["grand_total"]
+
     # 6. Get user address
     user_doc = await db.users.find_one({"id": user["id"]}, {"_id": 0, "addresses": 1, "email": 1, "name": 1})
     
@@ -310,6 +384,9 @@ async def create_order(
         ]
     }
     
+    if coupon_applied and not await reserve_coupon(db, coupon_applied["coupon_id"], order_id, user["id"]):
+        raise HTTPException(status_code=400, detail="This coupon has reached its usage limit")
+    
     await db.orders.insert_one(order_doc)
     
     # 9. Create Gokwik order
@@ -333,8 +410,9 @@ async def create_order(
     )
     
     if not gokwik_response.get("success"):
-        # Delete order if Gokwik fails
+        # Delete order (and free its coupon slot) if Gokwik fails
         await db.orders.delete_one({"id": order_id})
+        await release_reservation(db, order_id)
         raise HTTPException(
             status_code=500,
             detail=gokwik_response.get("error", "Failed to create payment order")
@@ -401,6 +479,7 @@ async def verify_payment(
                 }
             }
         )
+        await release_reservation(db, request.order_id)
         raise HTTPException(status_code=400, detail="Payment verification failed")
     
     # 3. Update order with payment details
@@ -432,26 +511,7 @@ async def verify_payment(
         )
     
     # 5. COUPON USAGE TRACKING - ONLY HERE (when payment is successful)
-    if order.get("coupon_applied"):
-        coupon = order["coupon_applied"]
-        
-        await db.coupons.update_one(
-            {"id": coupon["coupon_id"]},
-            {"$inc": {"used_count": 1}}
-        )
-        
-        await db.coupon_usage.insert_one({
-            "id": str(uuid.uuid4()),
-            "coupon_id": coupon["coupon_id"],
-            "coupon_code": coupon["code"],
-            "user_id": user["id"],
-            "user_email": order.get("user_email", ""),
-            "order_id": request.order_id,
-            "order_number": order["order_number"],
-            "order_amount": order["subtotal"],
-            "discount_amount": coupon["discount"],
-            "used_at": datetime.now(timezone.utc).isoformat()
-        })
+    await record_redemption(db, order, user["id"])
     
     # 6. Generate invoice
     try:
@@ -3,6 +3,7 @@ from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from services.coupon_redemption import record_redemption, release_reservation
 from utils.gokwik_client import verify_gokwik_payment
 
 router = APIRouter(prefix='/payment', tags=['Payment'])
@@ -41,4 +42,10 @@ async def payment_webhook(
     update['gokwik_order_id'] = payload.get('order_id') or order.get('gokwik_order_id')
 
     await db.orders.update_one({'id': order_id}, {'$set': update})
+
+    if payment_status == 'success' and order.get('payment_status') != 'SUCCESS':
+        await record_redemption(db, order, order['user_id'])
+    elif payment_status == 'failed':
+        await release_reservation(db, order_id)
+
     return {'success': True, 'order_id': order_id, 'payment_status': update['payment_status']}
@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models.product import ProductWithVariants
+from services.catalog import get_catalog, get_facets, LISTING_LIMIT
+from utils.http_cache import weak_etag, etag_matches, not_modified, encoded_response
 from typing import List, Optional
 
 router = APIRouter(prefix="/products", tags=["Products"])
@@ -10,56 +13,126 @@ async def get_db():
     return db
 
 
+PRODUCT_FIELDS = set(ProductWithVariants.model_fields)
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = sorted(set(requested) - PRODUCT_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Unknown product fields requested.", "code": "INVALID_FIELDS", "fields": unknown},
+        )
+
+    # The id is always returned so sparse results can still be keyed and paged.
+    return ["id"] + [f for f in requested if f != "id"]
+
+
 @router.get("", response_model=List[ProductWithVariants])
 async def get_products(
+    request: Request,
+    response: Response,
     category: Optional[str] = None,
     search: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous X-Next-Cursor header"),
+    limit: Optional[int] = Query(None, ge=1, le=LISTING_LIMIT),
+    fields: Optional[str] = Query(None, description="Comma-separated product fields to return"),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    query = {"is_active": True}
+    """
+    Product listing. Pages are ordered by a stable key; when more products
+    remain, the X-Next-Cursor response header carries the cursor for the
+    next page. `fields` trims each product to the named top-level fields.
+    """
+    projection = _parse_fields(fields)
+    catalog = await get_catalog(db)
 
-    if category:
-        query["category"] = category
+    etag = weak_etag("products", catalog.fingerprint, category, search, cursor, limit, fields)
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-    if search:
-        query["name"] = {"$regex": search, "$options": "i"}
+    # Common shapes (everything / one category) skip validation and encoding.
+    if not (search or cursor or limit or projection) and (category is None or category in catalog.by_category):
+        payload, next_cursor = catalog.encoded_listing(category)
+        encoded = encoded_response(request, payload, etag)
+        if next_cursor:
+            encoded.headers["X-Next-Cursor"] = next_cursor
+        return encoded
 
-    products = await db.products.find(query, {"_id": 0}).to_list(100)
+    try:
+        products, next_cursor = catalog.page(
+            category=category,
+            search=search,
+            cursor=cursor,
+            limit=limit or LISTING_LIMIT,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail={"message": "Invalid cursor.", "code": "INVALID_CURSOR"})
 
-    for product in products:
-        variants = await db.variants.find(
-            {
-                "product_id": product["id"],
-                "is_active": True
-            },
-            {"_id": 0}
-        ).to_list(50)
+    headers = {"ETag": etag}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
 
-        product["variants"] = variants
+    if projection:
+        # Dump through the response model first, so nested documents are filtered too
+        include = set(projection)
+        sparse = [ProductWithVariants.model_validate(p).model_dump(mode="json", include=include) for p in products]
+        return JSONResponse(content=sparse, headers=headers)
 
+    response.headers.update(headers)
     return products
 
 
+@router.get("/facets")
+async def get_product_facets(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Per-category counts, price histogram and in-stock count for a listing."""
+    catalog = await get_catalog(db)
+
+    etag = weak_etag("facets", catalog.fingerprint, category, search)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    response.headers["ETag"] = etag
+    return await get_facets(db, catalog, category=category, search=search)
+
+
+@router.get("/suggest")
+async def suggest_products(
+    q: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(8, ge=1, le=20),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    """Typeahead suggestions for the storefront search box."""
+    catalog = await get_catalog(db)
+    return {"query": q, "suggestions": catalog.suggest_index.suggest(q, limit=limit)}
+
+
 @router.get("/{slug}", response_model=ProductWithVariants)
 async def get_product_by_slug(
     slug: str,
+    request: Request,
+    response: Response,
     db: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    product = await db.products.find_one(
-        {"slug": slug, "is_active": True},
-        {"_id": 0}
-    )
+    catalog = await get_catalog(db)
+    product = catalog.get_by_slug(slug)
 
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    variants = await db.variants.find(
-        {
-            "product_id": product["id"],
-            "is_active": True
-        },
-        {"_id": 0}
-    ).to_list(50)
+    etag = weak_etag("product", catalog.fingerprint, slug)
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-    product["variants"] = variants
+    response.headers["ETag"] = etag
     return product
@@ -0,0 +1,18 @@
+import argparse
+import asyncio
+
+from db import db
+from services.coupon_redemption import BACKFILL_BATCH_SIZE, backfill_user_counters
+
+
+async def main(batch_size: int):
+    written = await backfill_user_counters(db, batch_size=batch_size, report=print)
+    print(f"Done: {written} counters written; limit checks no longer fall back to the usage log")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild coupon_user_counters from the coupon_usage log.')
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.batch_size))
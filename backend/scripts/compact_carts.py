@@ -0,0 +1,21 @@
+import argparse
+import asyncio
+
+from db import db
+from services.cart_maintenance import DEFAULT_BATCH_SIZE, DEFAULT_MAX_AGE_DAYS, compact_carts
+
+
+async def main(max_age_days: int, batch_size: int):
+    stats = await compact_carts(db, max_age_days=max_age_days, batch_size=batch_size, report=print)
+    print(f"Done: {stats}")
+
+
+if __name__ == '__main__':
+    # Run in-process (CART_COMPACTION_INTERVAL_HOURS) instead when CART_STORE=write_behind:
+    # this process cannot see carts cached by the app and may race its flushes.
+    parser = argparse.ArgumentParser(description='Expire abandoned carts and drop lines for inactive variants.')
+    parser.add_argument('--max-age-days', type=int, default=DEFAULT_MAX_AGE_DAYS)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.max_age_days, args.batch_size))
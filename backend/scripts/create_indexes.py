@@ -3,18 +3,21 @@ import asyncio
 from pymongo.errors import OperationFailure
 
 from db import db
+from services.coupon_redemption import RESERVATION_TTL_INDEX_GRACE_SECONDS
 
 
-async def ensure_index(collection, field: str, *, unique: bool, name: str):
+async def ensure_index(collection, field, *, unique: bool, name: str, **options):
+    """`field` is a field name or a list of (field, direction) pairs for a compound index."""
+    keys = [(field, 1)] if isinstance(field, str) else list(field)
     indexes = await collection.index_information()
 
     for _, meta in indexes.items():
-        if meta.get('key') == [(field, 1)]:
+        if meta.get('key') == keys:
             print(f"Index already present on {field}; skipping create.")
             return
 
     try:
-        await collection.create_index(field, unique=unique, name=name)
+        await collection.create_index(keys, unique=unique, name=name, **options)
         print(f"Created index: {name}")
     except OperationFailure as exc:
         if exc.code == 85:
@@ -26,6 +29,29 @@ async def ensure_index(collection, field: str, *, unique: bool, name: str):
 async def main():
     await ensure_index(db.carts, 'user_id', unique=True, name='idx_carts_user_id')
     await ensure_index(db.orders, 'user_id', unique=False, name='idx_orders_user_id')
+    await ensure_index(db.variants, 'product_id', unique=False, name='idx_variants_product_id')
+    await ensure_index(db.carts, 'updated_at', unique=False, name='idx_carts_updated_at')
+    await ensure_index(
+        db.coupon_user_counters,
+        [('coupon_id', 1), ('user_id', 1)],
+        unique=True,
+        name='idx_coupon_user_counters_coupon_user',
+    )
+    await ensure_index(
+        db.coupon_usage,
+        [('coupon_id', 1), ('user_id', 1)],
+        unique=False,
+        name='idx_coupon_usage_coupon_user',
+    )
+    await ensure_index(db.coupons, 'code', unique=True, name='idx_coupons_code')
+    await ensure_index(db.coupon_reservations, 'order_id', unique=True, name='idx_coupon_reservations_order_id')
+    await ensure_index(
+        db.coupon_reservations,
+        'expires_at',
+        unique=False,
+        name='idx_coupon_reservations_expires_at_ttl',
+        expireAfterSeconds=RESERVATION_TTL_INDEX_GRACE_SECONDS,
+    )
     print('Index setup completed.')
 
 
@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import sys
+import time
+
+from db import db
+from models.coupon import BulkCouponCreate
+from services.coupon_codes import DEFAULT_BATCH_SIZE, generate_coupons
+
+
+async def main(request: BulkCouponCreate, output, batch_size: int):
+    started = time.perf_counter()
+    created = 0
+
+    output.write("code,id\n")
+    try:
+        async for batch in generate_coupons(db, request, batch_size=batch_size):
+            output.writelines(f"{coupon['code']},{coupon['id']}\n" for coupon in batch)
+            created += len(batch)
+            elapsed = time.perf_counter() - started
+            print(f"Created {created}/{request.count} coupons ({created / elapsed:.0f}/s)", file=sys.stderr)
+    except Exception as exc:
+        output.write(f"# error: generation stopped after {created} of {request.count} coupons: {exc}\n")
+        print(f"Generation failed after {created}/{request.count} coupons: {exc}", file=sys.stderr)
+        raise SystemExit(1)
+    finally:
+        output.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk-generate coupons with random unique codes; writes code,id CSV.')
+    parser.add_argument('--count', type=int, required=True)
+    parser.add_argument('--type', choices=['percentage', 'flat'], required=True)
+    parser.add_argument('--value', type=float, required=True)
+    parser.add_argument('--expiry-date', required=True, help='ISO format, e.g. 2026-12-31T23:59:59Z')
+    parser.add_argument('--prefix', default='')
+    parser.add_argument('--length', type=int, default=10)
+    parser.add_argument('--alphabet', default=None)
+    parser.add_argument('--min-order-amount', type=float, default=0)
+    parser.add_argument('--max-discount', type=float, default=None)
+    parser.add_argument('--usage-limit', type=int, default=1)
+    parser.add_argument('--per-user-limit', type=int, default=1)
+    parser.add_argument('--description', default=None)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--output', default='-', help='CSV file path, or - for stdout')
+    args = parser.parse_args()
+
+    fields = {
+        'count': args.count,
+        'type': args.type,
+        'value': args.value,
+        'expiry_date': args.expiry_date,
+        'prefix': args.prefix,
+        'length': args.length,
+        'min_order_amount': args.min_order_amount,
+        'max_discount': args.max_discount,
+        'usage_limit': args.usage_limit,
+        'per_user_limit': args.per_user_limit,
+        'description': args.description,
+    }
+    if args.alphabet:
+        fields['alphabet'] = args.alphabet
+    request = BulkCouponCreate(**fields)
+
+    if args.output == '-':
+        asyncio.run(main(request, sys.stdout, args.batch_size))
+    else:
+        with open(args.output, 'w', newline='') as output:
+            asyncio.run(main(request, output, args.batch_size))
@@ -9,6 +9,8 @@ from dotenv import load_dotenv
 import uuid
 from datetime import datetime, timezone
 
+from services.catalog import bump_catalog_version
+
 load_dotenv()
 
 mongo_url = os.environ['MONGO_URL']
@@ -149,6 +151,7 @@ async def seed_products():
             await db.variants.insert_one(variant_doc)
             print(f"  ✓ Created variant: {variant_data['size']} - ₹{variant_data['selling_price']}")
     
+    await bump_catalog_version(db)
     print(f"\n✅ Successfully seeded {len(products_data)} products!")
     client.close()
 
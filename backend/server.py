@@ -2,20 +2,23 @@ from fastapi import FastAPI, APIRouter
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-from routes.checkout import router as checkout_router
 from pymongo.errors import OperationFailure
 
 import os
+import asyncio
 import logging
 from pathlib import Path
-from db import client
-
-# ROUTES
-from routes import auth, products, coupons, orders, admin, admin_products, contact, gokwik, cart, payment
 
+# Before any app import: services read their settings from the environment at import time
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / ".env")
 
+from db import client
+
+# ROUTES
+from routes import auth, products, coupons, orders, admin, admin_products, admin_settings, contact, gokwik, cart, payment
+from routes.checkout import router as checkout_router
+
 # MongoDB
 
 app = FastAPI(title="GWAL Spices API", version="1.0.0")
@@ -42,6 +45,7 @@ api_router.include_router(payment.router)
 # ADMIN
 api_router.include_router(admin_products.router)
 api_router.include_router(admin.router)
+api_router.include_router(admin_settings.router)
 api_router.include_router(checkout_router)
 
 app.include_router(api_router)
@@ -54,14 +58,23 @@ app.add_middleware(
     allow_origins=os.environ.get("CORS_ORIGINS", "*").split(","),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+_background_tasks = []
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    from services.cart_store import close_cart_store
+
+    for task in _background_tasks:
+        task.cancel()
+    await close_cart_store()
     client.close()
 
 
@@ -92,3 +105,25 @@ async def startup_indexes():
     from db import db
 
     await _ensure_cart_user_index(db)
+
+
+@app.on_event("startup")
+async def startup_cart_compaction():
+    """Opt-in in-process cart compaction (CART_COMPACTION_INTERVAL_HOURS)."""
+    from db import db
+    from services.cart_maintenance import run_periodic_compaction
+
+    interval_hours = float(os.environ.get("CART_COMPACTION_INTERVAL_HOURS", "0") or 0)
+    if interval_hours > 0:
+        _background_tasks.append(asyncio.create_task(run_periodic_compaction(db, interval_hours)))
+
+
+@app.on_event("startup")
+async def startup_coupon_reservation_sweeper():
+    """Releases coupon slots held by unpaid orders (COUPON_RESERVATION_SWEEP_SECONDS, 0 disables)."""
+    from db import db
+    from services.coupon_redemption import run_reservation_sweeper
+
+    interval_seconds = float(os.environ.get("COUPON_RESERVATION_SWEEP_SECONDS", "60") or 0)
+    if interval_seconds > 0:
+        _background_tasks.append(asyncio.create_task(run_reservation_sweeper(db, interval_seconds)))
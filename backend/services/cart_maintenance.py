@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Collection, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from services.cart_store import get_cart_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE_DAYS = int(os.getenv("CART_MAX_AGE_DAYS", "30"))
+DEFAULT_BATCH_SIZE = 500
+
+
+def _rate(count: int, started: float) -> float:
+    elapsed = time.perf_counter() - started
+    return count / elapsed if elapsed > 0 else 0.0
+
+
+def _not_held(query: dict, held_user_ids: Collection[str]) -> dict:
+    """Leave carts the write-behind store holds in memory alone; its next flush would overwrite our write."""
+    if held_user_ids:
+        return {**query, "user_id": {"$nin": list(held_user_ids)}}
+    return query
+
+
+async def expire_stale_carts(
+    db: AsyncIOMotorDatabase,
+    max_age_days: int = DEFAULT_MAX_AGE_DAYS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    report: Callable[[str], None] = logger.info,
+    held_user_ids: Collection[str] = (),
+) -> int:
+    """
+    Delete carts whose `updated_at` is older than `max_age_days`, empty or
+    not, in batches so no single write holds the collection for long.
+
+    A cart created again later starts from a time-based version
+    (cart_store._initial_version), so (user_id, version) still never
+    repeats for quotes and caches keyed on it.
+
+    `updated_at` is stored as an ISO string (not a BSON date), which rules
+    out a TTL index; ISO strings of the same format compare correctly.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=max_age_days)).isoformat()
+    query = _not_held({"updated_at": {"$lt": cutoff}}, held_user_ids)
+
+    started = time.perf_counter()
+    expired = 0
+
+    while True:
+        ids = [doc["_id"] async for doc in db.carts.find(query, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            break
+
+        result = await db.carts.delete_many({"_id": {"$in": ids}, **query})
+        expired += result.deleted_count
+        report(f"Expired {expired} carts older than {max_age_days}d ({_rate(expired, started):.0f} carts/s)")
+
+    return expired
+
+
+async def prune_inactive_lines(
+    db: AsyncIOMotorDatabase,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    report: Callable[[str], None] = logger.info,
+    held_user_ids: Collection[str] = (),
+) -> dict:
+    """
+    Remove cart lines whose variant no longer exists or is inactive.
+
+    Carts are walked in `_id` order; each batch costs one variant query
+    and one unordered bulk write for the carts that changed.
+    """
+    started = time.perf_counter()
+    scanned = 0
+    carts_updated = 0
+    lines_removed = 0
+    last_id = None
+
+    while True:
+        query = _not_held({"items.0": {"$exists": True}}, held_user_ids)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+
+        carts = await db.carts.find(query, {"_id": 1, "items.variant_id": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not carts:
+            break
+
+        last_id = carts[-1]["_id"]
+        scanned += len(carts)
+
+        variant_ids = {item.get("variant_id") for cart in carts for item in cart.get("items", [])}
+        active = set(await db.variants.distinct("id", {"id": {"$in": list(variant_ids)}, "is_active": True}))
+
+        updates = []
+        for cart in carts:
+            dead = sorted({item.get("variant_id") for item in cart.get("items", [])} - active)
+            if dead:
+                lines_removed += sum(1 for item in cart.get("items", []) if item.get("variant_id") in dead)
+                updates.append(UpdateOne(
+                    {"_id": cart["_id"]},
+                    {"$pull": {"items": {"variant_id": {"$in": dead}}}, "$inc": {"version": 1}},
+                ))
+
+        if updates:
+            await db.carts.bulk_write(updates, ordered=False)
+            carts_updated += len(updates)
+
+        report(
+            f"Scanned {scanned} carts, pruned {lines_removed} lines from {carts_updated} carts "
+            f"({_rate(scanned, started):.0f} carts/s)"
+        )
+
+    return {"scanned": scanned, "carts_updated": carts_updated, "lines_removed": lines_removed}
+
+
+async def compact_carts(
+    db: AsyncIOMotorDatabase,
+    max_age_days: int = DEFAULT_MAX_AGE_DAYS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    report: Callable[[str], None] = logger.info,
+    held_user_ids: Collection[str] = (),
+) -> dict:
+    """
+    Expire abandoned carts, then prune dead lines from the rest.
+
+    `held_user_ids` are carts cached by a write-behind store in this
+    process; they are skipped (a cached cart is in use, not abandoned).
+    Run from another process, compaction cannot see that cache: with
+    CART_STORE=write_behind a cart loaded while the job runs may have its
+    expiry or pruning undone by the store's next flush.
+    """
+    started = time.perf_counter()
+
+    expired = await expire_stale_carts(db, max_age_days, batch_size, report, held_user_ids)
+    pruned = await prune_inactive_lines(db, batch_size, report, held_user_ids)
+
+    stats = {"expired": expired, **pruned, "seconds": round(time.perf_counter() - started, 2)}
+    report(f"Cart compaction finished: {stats}")
+    return stats
+
+
+async def run_periodic_compaction(db: AsyncIOMotorDatabase, interval_hours: float, max_age_days: Optional[int] = None):
+    """Background loop for in-process compaction; cancel the task to stop it."""
+    while True:
+        try:
+            store = await get_cart_store(db)
+            await compact_carts(
+                db,
+                max_age_days=max_age_days or DEFAULT_MAX_AGE_DAYS,
+                held_user_ids=store.held_user_ids(),
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.exception("Cart compaction failed: %s", exc)
+
+        await asyncio.sleep(interval_hours * 3600)
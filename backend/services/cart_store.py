@@ -0,0 +1,542 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from models.cart import CartOperation
+
+logger = logging.getLogger(__name__)
+
+# "mongo" writes every mutation through; "write_behind" keeps hot carts in
+# process memory and coalesces mutations into delayed flushes.
+CART_STORE_BACKEND = os.getenv("CART_STORE", "mongo").lower()
+CART_STORE_CAPACITY = int(os.getenv("CART_STORE_CAPACITY", "10000"))
+CART_FLUSH_DELAY_SECONDS = float(os.getenv("CART_FLUSH_DELAY_SECONDS", "2"))
+
+
+class CartStoreError(Exception):
+    pass
+
+
+class CartNotFound(CartStoreError):
+    pass
+
+
+class CartItemNotFound(CartStoreError):
+    pass
+
+
+class CartVersionConflict(CartStoreError):
+    def __init__(self, expected_version: int, current_version: Optional[int]):
+        super().__init__("Cart was modified by another request")
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _check_version(expected_version: Optional[int], current_version: Optional[int]):
+    """Raise unless the cart is at the expected version (a missing cart is version 0)."""
+    if expected_version is not None and (current_version or 0) != expected_version:
+        raise CartVersionConflict(expected_version, current_version)
+
+
+# =========================
+# MONGO UPDATE PIPELINES
+# =========================
+
+def _cart_filter(user_id: str, expected_version: Optional[int] = None, **extra) -> dict:
+    query = {"user_id": user_id, **extra}
+    if expected_version is not None:
+        # Carts written before versioning have no field and count as version 0.
+        query["version"] = expected_version if expected_version else {"$in": [0, None]}
+    return query
+
+
+def _initial_version() -> int:
+    """
+    Version a newly created cart counts up from: the current epoch
+    milliseconds. A cart that compaction deleted and the user created again
+    does not repeat a (user_id, version) pair unless the old cart took more
+    writes than the milliseconds it lived.
+    """
+    return int(time.time() * 1000)
+
+
+def _bump_version_stage() -> dict:
+    """Final stage of every cart update pipeline."""
+    return {"$set": {"version": {"$add": [{"$ifNull": ["$version", _initial_version()]}, 1]}}}
+
+_VERSION_PROJECTION = {"_id": 0, "version": 1}
+
+
+def _cart_items_expr() -> dict:
+    return {"$ifNull": ["$items", []]}
+
+
+def _upsert_line_stage(variant_id: str, product_id: str, quantity: int, now: str, *, increment: bool) -> dict:
+    """
+    Update-pipeline stage that changes the quantity of an existing line
+    (adding to it, or replacing it) or appends a new line, so the change is
+    a single atomic, upsertable write.
+    """
+    items = _cart_items_expr()
+    new_item = {
+        "variant_id": variant_id,
+        "product_id": product_id,
+        "quantity": quantity,
+        "added_at": now,
+    }
+    new_quantity = {"$add": ["$$item.quantity", quantity]} if increment else {"$literal": quantity}
+
+    return {
+        "$set": {
+            "items": {
+                "$cond": [
+                    {"$in": [{"$literal": variant_id}, {"$ifNull": ["$items.variant_id", []]}]},
+                    {
+                        "$map": {
+                            "input": items,
+                            "as": "item",
+                            "in": {
+                                "$cond": [
+                                    {"$eq": ["$$item.variant_id", {"$literal": variant_id}]},
+                                    {"$mergeObjects": ["$$item", {"quantity": new_quantity}]},
+                                    "$$item",
+                                ]
+                            },
+                        }
+                    },
+                    {"$concatArrays": [items, [{"$literal": new_item}]]},
+                ]
+            },
+            "coupon_code": {"$ifNull": ["$coupon_code", None]},
+            "updated_at": {"$literal": now},
+        }
+    }
+
+
+def _remove_line_stage(variant_id: str, now: str) -> dict:
+    return {
+        "$set": {
+            "items": {
+                "$filter": {
+                    "input": _cart_items_expr(),
+                    "as": "item",
+                    "cond": {"$ne": ["$$item.variant_id", {"$literal": variant_id}]},
+                }
+            },
+            "updated_at": {"$literal": now},
+        }
+    }
+
+
+def operation_stage(operation: CartOperation, now: str) -> dict:
+    if operation.op == "remove":
+        return _remove_line_stage(operation.variant_id, now)
+
+    return _upsert_line_stage(
+        operation.variant_id,
+        operation.product_id,
+        operation.quantity,
+        now,
+        increment=operation.op == "add",
+    )
+
+
+def apply_operations(items: List[dict], operations: List[CartOperation], now: str) -> List[dict]:
+    """In-memory equivalent of the `operation_stage` pipeline stages."""
+    items = [dict(item) for item in items]
+
+    for operation in operations:
+        if operation.op == "remove":
+            items = [item for item in items if item.get("variant_id") != operation.variant_id]
+            continue
+
+        line = next((item for item in items if item.get("variant_id") == operation.variant_id), None)
+        if line is None:
+            items.append({
+                "variant_id": operation.variant_id,
+                "product_id": operation.product_id,
+                "quantity": operation.quantity,
+                "added_at": now,
+            })
+        elif operation.op == "add":
+            line["quantity"] = line.get("quantity", 0) + operation.quantity
+        else:
+            line["quantity"] = operation.quantity
+
+    return items
+
+
+# =========================
+# WRITE-THROUGH STORE
+# =========================
+
+class MongoCartStore:
+    """Every mutation is one atomic, version-bumping Mongo write."""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self._db = db
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        return await self._db.carts.find_one({"user_id": user_id}, {"_id": 0})
+
+    async def _current_version(self, user_id: str) -> Optional[int]:
+        cart = await self._db.carts.find_one({"user_id": user_id}, _VERSION_PROJECTION)
+        return cart.get("version", 0) if cart is not None else None
+
+    async def _missing_line(self, user_id: str, expected_version: Optional[int]) -> CartStoreError:
+        """Explain why a targeted line update matched nothing."""
+        current_version = await self._current_version(user_id)
+
+        if current_version is None:
+            return CartNotFound()
+        if expected_version is not None and current_version != expected_version:
+            return CartVersionConflict(expected_version, current_version)
+        return CartItemNotFound()
+
+    async def apply(
+        self,
+        user_id: str,
+        operations: List[CartOperation],
+        expected_version: Optional[int] = None,
+    ) -> int:
+        """
+        Apply add / set / remove operations as one pipeline update and
+        return the new version. Only adds and sets may create the cart.
+        """
+        now = _now()
+        pipeline = [operation_stage(op, now) for op in operations] + [_bump_version_stage()]
+        # Only an unconditional or version-0 write may create the cart.
+        upsert = any(op.op != "remove" for op in operations) and not expected_version
+
+        try:
+            cart = await self._db.carts.find_one_and_update(
+                _cart_filter(user_id, expected_version),
+                pipeline,
+                projection=_VERSION_PROJECTION,
+                upsert=upsert,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            if expected_version is not None:
+                # The cart exists, just not at the expected version.
+                raise CartVersionConflict(expected_version, await self._current_version(user_id))
+
+            # Another request created the cart between our match and insert; it exists now.
+            cart = await self._db.carts.find_one_and_update(
+                {"user_id": user_id},
+                pipeline,
+                projection=_VERSION_PROJECTION,
+                return_document=ReturnDocument.AFTER,
+            )
+
+        if cart is None:
+            if expected_version is not None:
+                raise CartVersionConflict(expected_version, await self._current_version(user_id))
+            return 0
+
+        return cart["version"]
+
+    async def set_quantity(
+        self,
+        user_id: str,
+        variant_id: str,
+        quantity: int,
+        expected_version: Optional[int] = None,
+    ) -> int:
+        cart = await self._db.carts.find_one_and_update(
+            _cart_filter(user_id, expected_version, **{"items.variant_id": variant_id}),
+            {
+                "$set": {"items.$.quantity": quantity, "updated_at": _now()},
+                "$inc": {"version": 1},
+            },
+            projection=_VERSION_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+        if cart is None:
+            raise await self._missing_line(user_id, expected_version)
+        return cart["version"]
+
+    async def remove_line(self, user_id: str, variant_id: str, expected_version: Optional[int] = None) -> int:
+        cart = await self._db.carts.find_one_and_update(
+            _cart_filter(user_id, expected_version, **{"items.variant_id": variant_id}),
+            {
+                "$pull": {"items": {"variant_id": variant_id}},
+                "$set": {"updated_at": _now()},
+                "$inc": {"version": 1},
+            },
+            projection=_VERSION_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+        if cart is None:
+            raise await self._missing_line(user_id, expected_version)
+        return cart["version"]
+
+    async def clear(self, user_id: str, expected_version: Optional[int] = None) -> int:
+        # Empty the cart rather than deleting it so its version keeps increasing.
+        cart = await self._db.carts.find_one_and_update(
+            _cart_filter(user_id, expected_version),
+            {
+                "$set": {"items": [], "coupon_code": None, "updated_at": _now()},
+                "$inc": {"version": 1},
+            },
+            projection=_VERSION_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+        if cart is None:
+            current_version = await self._current_version(user_id)
+            if current_version is not None:
+                raise CartVersionConflict(expected_version, current_version)
+            return 0
+
+        return cart["version"]
+
+    def held_user_ids(self) -> List[str]:
+        return []
+
+    async def flush(self, user_id: Optional[str] = None):
+        pass
+
+    async def close(self):
+        pass
+
+
+# =========================
+# WRITE-BEHIND STORE
+# =========================
+
+class WriteBehindCartStore:
+    """
+    Hot carts live in an in-process LRU keyed by user_id. Mutations are
+    applied in memory and the cart is written to Mongo once, after
+    CART_FLUSH_DELAY_SECONDS of quiet, so a burst of quantity clicks
+    costs a single write. Checkout paths call `flush` explicitly, and
+    `close` persists everything on shutdown.
+
+    This process must own the carts it caches (single worker or
+    user-sticky routing): Mongo may lag memory by up to the flush delay,
+    and writes from elsewhere are not seen until the cart is evicted.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, capacity: int, flush_delay: float):
+        self._db = db
+        self._capacity = capacity
+        self._flush_delay = flush_delay
+        # user_id -> cart document, or None when known to have no cart.
+        self._carts: "OrderedDict[str, Optional[dict]]" = OrderedDict()
+        self._dirty = set()
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._pending_writes: Dict[str, asyncio.Task] = {}
+
+    async def _load(self, user_id: str) -> Optional[dict]:
+        if user_id in self._carts:
+            self._carts.move_to_end(user_id)
+            return self._carts[user_id]
+
+        # An evicted dirty cart may still be on its way to Mongo.
+        pending = self._pending_writes.get(user_id)
+        if pending:
+            await asyncio.shield(pending)
+
+        cart = await self._db.carts.find_one({"user_id": user_id}, {"_id": 0})
+
+        # Another coroutine may have loaded (and changed) it while we awaited.
+        if user_id not in self._carts:
+            self._carts[user_id] = cart
+            self._evict()
+        return self._carts.get(user_id, cart)
+
+    def _evict(self):
+        while len(self._carts) > self._capacity:
+            user_id, cart = self._carts.popitem(last=False)
+            if user_id in self._dirty:
+                self._dirty.discard(user_id)
+                timer = self._timers.pop(user_id, None)
+                if timer:
+                    timer.cancel()
+                self._start_write(user_id, cart)
+
+    def _start_write(self, user_id: str, cart: dict) -> asyncio.Task:
+        # Every write is tracked here so `close` can wait for it, and
+        # queued behind the user's previous write so they land in order.
+        task = asyncio.create_task(self._write(user_id, cart, after=self._pending_writes.get(user_id)))
+        self._pending_writes[user_id] = task
+        task.add_done_callback(
+            lambda t, uid=user_id: self._pending_writes.pop(uid, None) if self._pending_writes.get(uid) is t else None
+        )
+        return task
+
+    def _store(self, user_id: str, cart: dict):
+        # Carts are replaced, never mutated in place, so a flush in flight
+        # keeps writing the snapshot it started with.
+        self._carts[user_id] = cart
+        self._carts.move_to_end(user_id)
+        self._dirty.add(user_id)
+
+        if user_id not in self._timers:
+            self._timers[user_id] = asyncio.create_task(self._delayed_flush(user_id))
+
+    async def _delayed_flush(self, user_id: str):
+        await asyncio.sleep(self._flush_delay)
+        self._timers.pop(user_id, None)
+        await self._flush_one(user_id)
+
+    async def _flush_one(self, user_id: str):
+        if user_id in self._dirty:
+            self._dirty.discard(user_id)
+            self._start_write(user_id, self._carts[user_id])
+
+        pending = self._pending_writes.get(user_id)
+        if pending:
+            await asyncio.shield(pending)
+
+    async def _write(self, user_id: str, cart: dict, after: Optional[asyncio.Task] = None):
+        if after:
+            await asyncio.wait([after])
+
+        fields = {k: v for k, v in cart.items() if k != "user_id"}
+        try:
+            await self._db.carts.update_one({"user_id": user_id}, {"$set": fields}, upsert=True)
+        except Exception as exc:
+            logger.exception("Cart flush failed for %s: %s", user_id, exc)
+            # Retry later unless a newer version is already queued; an
+            # evicted cart is taken back into memory rather than dropped.
+            if user_id not in self._dirty and self._carts.get(user_id, cart) is cart:
+                self._store(user_id, cart)
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        return await self._load(user_id)
+
+    async def apply(
+        self,
+        user_id: str,
+        operations: List[CartOperation],
+        expected_version: Optional[int] = None,
+    ) -> int:
+        cart = await self._load(user_id)
+        current_version = cart.get("version", 0) if cart is not None else None
+        _check_version(expected_version, current_version)
+
+        if cart is None and all(op.op == "remove" for op in operations):
+            return 0
+
+        now = _now()
+        base = cart or {"user_id": user_id, "items": [], "coupon_code": None}
+        version = base.get("version")
+        updated = {
+            **base,
+            "items": apply_operations(base.get("items", []), operations, now),
+            "updated_at": now,
+            "version": (_initial_version() if version is None else version) + 1,
+        }
+        self._store(user_id, updated)
+        return updated["version"]
+
+    async def _update_line(self, user_id: str, variant_id: str, expected_version: Optional[int], operation: CartOperation) -> int:
+        cart = await self._load(user_id)
+        if cart is None:
+            raise CartNotFound()
+        _check_version(expected_version, cart.get("version", 0))
+        if not any(item.get("variant_id") == variant_id for item in cart.get("items", [])):
+            raise CartItemNotFound()
+
+        now = _now()
+        updated = {
+            **cart,
+            "items": apply_operations(cart.get("items", []), [operation], now),
+            "updated_at": now,
+            "version": cart.get("version", 0) + 1,
+        }
+        self._store(user_id, updated)
+        return updated["version"]
+
+    async def set_quantity(
+        self,
+        user_id: str,
+        variant_id: str,
+        quantity: int,
+        expected_version: Optional[int] = None,
+    ) -> int:
+        operation = CartOperation(op="set", variant_id=variant_id, quantity=quantity)
+        return await self._update_line(user_id, variant_id, expected_version, operation)
+
+    async def remove_line(self, user_id: str, variant_id: str, expected_version: Optional[int] = None) -> int:
+        operation = CartOperation(op="remove", variant_id=variant_id)
+        return await self._update_line(user_id, variant_id, expected_version, operation)
+
+    async def clear(self, user_id: str, expected_version: Optional[int] = None) -> int:
+        cart = await self._load(user_id)
+        if cart is None:
+            return 0
+        _check_version(expected_version, cart.get("version", 0))
+
+        updated = {
+            **cart,
+            "items": [],
+            "coupon_code": None,
+            "updated_at": _now(),
+            "version": cart.get("version", 0) + 1,
+        }
+        self._store(user_id, updated)
+        return updated["version"]
+
+    def held_user_ids(self) -> List[str]:
+        """Users whose cart this process holds; Mongo must not be changed behind their back."""
+        return list(self._carts) + [uid for uid in self._pending_writes if uid not in self._carts]
+
+    async def flush(self, user_id: Optional[str] = None):
+        """Persist one user's cart (or every dirty cart) now."""
+        user_ids = [user_id] if user_id else list(self._dirty)
+
+        for uid in user_ids:
+            timer = self._timers.pop(uid, None)
+            if timer:
+                timer.cancel()
+            await self._flush_one(uid)
+
+    async def close(self):
+        await self.flush()
+        if self._pending_writes:
+            await asyncio.gather(*self._pending_writes.values(), return_exceptions=True)
+
+
+_store = None
+
+
+def create_cart_store(db: AsyncIOMotorDatabase):
+    if CART_STORE_BACKEND == "write_behind":
+        logger.info(
+            "Using write-behind cart store (capacity=%s, flush_delay=%ss)",
+            CART_STORE_CAPACITY,
+            CART_FLUSH_DELAY_SECONDS,
+        )
+        return WriteBehindCartStore(db, CART_STORE_CAPACITY, CART_FLUSH_DELAY_SECONDS)
+    return MongoCartStore(db)
+
+
+async def get_cart_store(db: Optional[AsyncIOMotorDatabase] = None):
+    """Process-wide cart store for `db` (the application database by default)."""
+    global _store
+    if db is None:
+        from db import db
+    if _store is None or _store._db is not db:
+        if _store is not None:
+            await _store.close()
+        _store = create_cart_store(db)
+    return _store
+
+
+async def close_cart_store():
+    if _store is not None:
+        await _store.close()
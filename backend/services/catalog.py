@@ -0,0 +1,341 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models.product import ProductWithVariants
+from services.catalog_search import SearchIndex, SuggestIndex
+from utils.http_cache import EncodedPayload
+
+logger = logging.getLogger(__name__)
+
+# How long a worker trusts its snapshot before re-reading the version document.
+# Writes made through this process invalidate immediately; other workers pick
+# them up within this window.
+VERSION_CHECK_SECONDS = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "5"))
+
+CATALOG_VERSION_ID = "catalog"
+
+# Listings are capped at this many products per response.
+LISTING_LIMIT = 100
+
+# Lower edges of the selling_price histogram; the last bucket is open-ended.
+PRICE_BUCKET_BOUNDARIES = [0, 100, 250, 500, 1000]
+
+# $bucket id for prices at or above the last boundary.
+_OPEN_BUCKET = "open"
+
+# Per-snapshot cap on cached facet results (one per category/search combination).
+FACET_CACHE_SIZE = 256
+
+
+# Stable listing order; also the keyset used by pagination cursors.
+LISTING_SORT = {"created_at": 1, "id": 1}
+
+
+def catalog_pipeline(match: dict, limit: Optional[int] = None, sort: Optional[dict] = None) -> list:
+    """
+    Products matching `match` with their active variants joined in,
+    so a listing is a single round trip regardless of catalog size.
+    """
+    pipeline = [{"$match": match}]
+
+    if sort:
+        pipeline.append({"$sort": sort})
+
+    if limit:
+        pipeline.append({"$limit": limit})
+
+    pipeline += [
+        {
+            "$lookup": {
+                "from": "variants",
+                "localField": "id",
+                "foreignField": "product_id",
+                "pipeline": [
+                    {"$match": {"is_active": True}},
+                    {"$limit": 50},
+                    {"$project": {"_id": 0}},
+                ],
+                "as": "variants",
+            }
+        },
+        {"$project": {"_id": 0}},
+    ]
+    return pipeline
+
+
+def _listing_key(product: dict) -> Tuple[str, str]:
+    return (str(product.get("created_at") or ""), product["id"])
+
+
+def encode_cursor(*key: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[str]:
+    """Raises ValueError for anything that is not a cursor we issued."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as exc:
+        raise ValueError("Malformed cursor") from exc
+
+    if not isinstance(key, list) or not all(isinstance(k, str) for k in key):
+        raise ValueError("Malformed cursor")
+    return key
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of every active product and its active variants.
+
+    Built once per catalog version and swapped in whole, so readers never
+    see a half-built catalog. Callers must treat returned documents as
+    read-only.
+    """
+
+    def __init__(self, version: int, products: List[dict]):
+        self.version = version
+        self.products = products
+        self.by_id: Dict[str, dict] = {}
+        self.by_slug: Dict[str, dict] = {}
+        self.by_category: Dict[str, List[dict]] = {}
+        self.variants_by_id: Dict[str, dict] = {}
+
+        for product in products:
+            self.by_id[product["id"]] = product
+            self.by_slug[product["slug"]] = product
+            self.by_category.setdefault(product.get("category"), []).append(product)
+            for variant in product.get("variants", []):
+                self.variants_by_id[variant["id"]] = variant
+
+        # Content fingerprint: changes whenever any served field changes, even
+        # if the version document was not bumped (e.g. direct DB edits).
+        self.fingerprint = hashlib.sha1(
+            json.dumps(products, sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+
+        self.search_index = SearchIndex(products)
+        self.suggest_index = SuggestIndex(products)
+        self._encoded: Dict[Optional[str], Tuple[EncodedPayload, Optional[str]]] = {}
+        self.facet_cache: Dict[tuple, dict] = {}
+
+    def list_products(self, category: Optional[str] = None, search: Optional[str] = None) -> List[dict]:
+        if search:
+            products = [self.by_id[pid] for pid in self.search_index.search(search)]
+            if category:
+                products = [p for p in products if p.get("category") == category]
+            return products
+
+        return self.by_category.get(category, []) if category else self.products
+
+    def page(
+        self,
+        category: Optional[str] = None,
+        search: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = LISTING_LIMIT,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        One page of a listing plus the cursor for the next page (None on the
+        last page). Browse listings are keyset-paginated on LISTING_SORT;
+        search results keep relevance order and resume after the last id.
+        """
+        products = self.list_products(category=category, search=search)
+
+        start = 0
+        if cursor:
+            key = decode_cursor(cursor)
+            if search:
+                if len(key) != 1:
+                    raise ValueError("Malformed cursor")
+                ids = [p["id"] for p in products]
+                start = ids.index(key[0]) + 1 if key[0] in ids else len(ids)
+            else:
+                if len(key) != 2:
+                    raise ValueError("Malformed cursor")
+                start = bisect_right(products, tuple(key), key=_listing_key)
+
+        page = products[start:start + limit]
+        next_cursor = None
+        if page and start + limit < len(products):
+            last = page[-1]
+            next_cursor = encode_cursor(last["id"]) if search else encode_cursor(*_listing_key(last))
+
+        return page, next_cursor
+
+    def get_by_slug(self, slug: str) -> Optional[dict]:
+        return self.by_slug.get(slug)
+
+    def encoded_listing(self, category: Optional[str] = None) -> Tuple[EncodedPayload, Optional[str]]:
+        """
+        The first page of the unfiltered (or single-category) listing,
+        validated against ProductWithVariants and serialized/compressed
+        once per snapshot, with its next-page cursor.
+        """
+        cached = self._encoded.get(category)
+        if cached is None:
+            products, next_cursor = self.page(category=category)
+            payload = EncodedPayload(
+                [ProductWithVariants.model_validate(p).model_dump(mode="json") for p in products]
+            )
+            cached = self._encoded[category] = (payload, next_cursor)
+        return cached
+
+
+_snapshot: Optional[CatalogSnapshot] = None
+_checked_at = 0.0
+_lock = asyncio.Lock()
+
+
+async def _read_version(db: AsyncIOMotorDatabase) -> int:
+    doc = await db.catalog_meta.find_one({"_id": CATALOG_VERSION_ID}, {"version": 1})
+    return int(doc.get("version", 0)) if doc else 0
+
+
+async def _build_snapshot(db: AsyncIOMotorDatabase, version: int) -> CatalogSnapshot:
+    started = time.perf_counter()
+    products = await db.products.aggregate(
+        catalog_pipeline({"is_active": True}, sort=LISTING_SORT)
+    ).to_list(None)
+    snapshot = CatalogSnapshot(version, products)
+
+    logger.info(
+        "Catalog snapshot v%s built: %s products, %s variants in %.1fms",
+        version,
+        len(snapshot.products),
+        len(snapshot.variants_by_id),
+        (time.perf_counter() - started) * 1000,
+    )
+    return snapshot
+
+
+async def get_catalog(db: AsyncIOMotorDatabase) -> CatalogSnapshot:
+    """Return the current snapshot, rebuilding it if the catalog version moved."""
+    global _snapshot, _checked_at
+
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _checked_at < VERSION_CHECK_SECONDS:
+        return snapshot
+
+    async with _lock:
+        if _snapshot is not None and time.monotonic() - _checked_at < VERSION_CHECK_SECONDS:
+            return _snapshot
+
+        # Read the version before the data so a snapshot is never older than its label.
+        version = await _read_version(db)
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = await _build_snapshot(db, version)
+
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def _facet_pipeline(match: dict) -> list:
+    return catalog_pipeline(match) + [
+        {
+            "$facet": {
+                "categories": [
+                    {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1, "_id": 1}},
+                ],
+                "price_buckets": [
+                    {"$unwind": "$variants"},
+                    {
+                        "$bucket": {
+                            "groupBy": "$variants.selling_price",
+                            "boundaries": PRICE_BUCKET_BOUNDARIES,
+                            "default": _OPEN_BUCKET,
+                            "output": {
+                                "variants": {"$sum": 1},
+                                "products": {"$addToSet": "$id"},
+                            },
+                        }
+                    },
+                ],
+                "in_stock": [
+                    {"$match": {"variants": {"$elemMatch": {"in_stock": True}}}},
+                    {"$count": "count"},
+                ],
+                "total": [{"$count": "count"}],
+            }
+        }
+    ]
+
+
+def _format_facets(result: dict) -> dict:
+    buckets = []
+    for bucket in result.get("price_buckets", []):
+        if bucket["_id"] == _OPEN_BUCKET:
+            low, high = PRICE_BUCKET_BOUNDARIES[-1], None
+        else:
+            index = PRICE_BUCKET_BOUNDARIES.index(bucket["_id"])
+            low, high = bucket["_id"], PRICE_BUCKET_BOUNDARIES[index + 1]
+        buckets.append({
+            "min": low,
+            "max": high,
+            "products": len(bucket["products"]),
+            "variants": bucket["variants"],
+        })
+    buckets.sort(key=lambda b: b["min"])
+
+    in_stock = result.get("in_stock") or [{"count": 0}]
+    total = result.get("total") or [{"count": 0}]
+
+    return {
+        "categories": [{"category": c["_id"], "count": c["count"]} for c in result.get("categories", [])],
+        "price_buckets": buckets,
+        "in_stock": in_stock[0]["count"],
+        "total": total[0]["count"],
+    }
+
+
+async def get_facets(
+    db: AsyncIOMotorDatabase,
+    catalog: CatalogSnapshot,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+) -> dict:
+    """
+    Category counts, selling_price histogram and in-stock count for the
+    products a listing with the same filters would return. Computed with
+    one $facet aggregation and cached on the snapshot it was built for.
+    """
+    key = (category, search)
+    cached = catalog.facet_cache.get(key)
+    if cached is not None:
+        return cached
+
+    match = {"is_active": True}
+    if category:
+        match["category"] = category
+    if search:
+        match["id"] = {"$in": catalog.search_index.search(search)}
+
+    result = await db.products.aggregate(_facet_pipeline(match)).to_list(1)
+    facets = _format_facets(result[0] if result else {})
+
+    if len(catalog.facet_cache) >= FACET_CACHE_SIZE:
+        catalog.facet_cache.clear()
+    catalog.facet_cache[key] = facets
+    return facets
+
+
+async def bump_catalog_version(db: AsyncIOMotorDatabase) -> None:
+    """Record a catalog write so every worker rebuilds its snapshot."""
+    global _checked_at
+
+    await db.catalog_meta.update_one(
+        {"_id": CATALOG_VERSION_ID},
+        {"$inc": {"version": 1}},
+        upsert=True,
+    )
+    _checked_at = 0.0
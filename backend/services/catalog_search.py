@@ -0,0 +1,162 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Relative weight of a term hit in each product field.
+FIELD_WEIGHTS = {
+    "name": 5.0,
+    "category": 3.0,
+    "benefits": 1.5,
+    "description": 1.0,
+}
+
+# A prefix hit ("chil" -> "chilli") scores less than an exact term hit.
+PREFIX_FACTOR = 0.6
+
+# Upper bound on how many index terms one query token may expand to.
+MAX_PREFIX_EXPANSIONS = 64
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _field_text(value) -> str:
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return str(value or "")
+
+
+class SearchIndex:
+    """
+    Inverted index over product name, category, benefits and description.
+
+    Query tokens are matched exactly or as prefixes of indexed terms
+    (via binary search over the sorted term list). All tokens must match;
+    products are ranked by summed field weights.
+    """
+
+    def __init__(self, products: List[dict]):
+        postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._position: Dict[str, int] = {}
+
+        for position, product in enumerate(products):
+            product_id = product["id"]
+            self._position[product_id] = position
+
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(_field_text(product.get(field))):
+                    scores = postings[term]
+                    scores[product_id] = scores.get(product_id, 0.0) + weight
+
+        self._postings = dict(postings)
+        self._terms = sorted(self._postings)
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        terms = self._terms
+        matches = []
+        i = bisect_left(terms, token)
+
+        while i < len(terms) and terms[i].startswith(token) and len(matches) < MAX_PREFIX_EXPANSIONS:
+            term = terms[i]
+            matches.append((term, 1.0 if term == token else PREFIX_FACTOR))
+            i += 1
+
+        return matches
+
+    def search(self, query: str) -> List[str]:
+        """Return matching product ids, best match first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        scores = None
+        for token in tokens:
+            token_scores: Dict[str, float] = {}
+            for term, factor in self._expand(token):
+                for product_id, weight in self._postings[term].items():
+                    token_scores[product_id] = max(token_scores.get(product_id, 0.0), weight * factor)
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {pid: scores[pid] + s for pid, s in token_scores.items() if pid in scores}
+
+            if not scores:
+                return []
+
+        return sorted(scores, key=lambda pid: (-scores[pid], self._position[pid]))
+
+
+def _normalize(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+class SuggestIndex:
+    """
+    Sorted-array prefix index for search-box typeahead.
+
+    Every product contributes its name, each word-suffix of its name
+    ("chilli powder", "powder") and its slug; every category contributes
+    its name. A lookup is a binary search plus a short forward scan.
+    """
+
+    # Lower rank sorts first: name prefix, category, later name word, slug.
+    RANK_NAME = 0
+    RANK_CATEGORY = 1
+    RANK_WORD = 2
+    RANK_SLUG = 3
+
+    MAX_SCAN = 256
+
+    def __init__(self, products: List[dict]):
+        entries = []
+        seen_categories = set()
+
+        for product in products:
+            suggestion = {
+                "type": "product",
+                "text": product.get("name", ""),
+                "slug": product.get("slug"),
+                "category": product.get("category"),
+            }
+
+            words = tokenize(product.get("name", ""))
+            for i in range(len(words)):
+                rank = self.RANK_NAME if i == 0 else self.RANK_WORD
+                entries.append((" ".join(words[i:]), rank, suggestion))
+
+            slug = _normalize(product.get("slug", ""))
+            if slug:
+                entries.append((slug, self.RANK_SLUG, suggestion))
+
+            category = product.get("category")
+            if category and category not in seen_categories:
+                seen_categories.add(category)
+                entries.append((_normalize(category), self.RANK_CATEGORY, {"type": "category", "text": category}))
+
+        entries.sort(key=lambda e: (e[0], e[1]))
+        self._keys = [e[0] for e in entries]
+        self._entries = entries
+
+    def suggest(self, query: str, limit: int = 8) -> List[dict]:
+        prefix = _normalize(query)
+        if not prefix:
+            return []
+
+        candidates = {}
+        i = bisect_left(self._keys, prefix)
+        end = min(len(self._keys), i + self.MAX_SCAN)
+
+        while i < end and self._keys[i].startswith(prefix):
+            key, rank, suggestion = self._entries[i]
+            identity = (suggestion["type"], suggestion.get("slug") or suggestion["text"])
+            if identity not in candidates or rank < candidates[identity][0]:
+                candidates[identity] = (rank, suggestion)
+            i += 1
+
+        ranked = sorted(candidates.values(), key=lambda c: (c[0], c[1]["text"].lower()))
+        return [suggestion for _, suggestion in ranked[:limit]]
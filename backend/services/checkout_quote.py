@@ -0,0 +1,156 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.pricing_engine import CouponRejected, CouponRule, check_user_limit
+
+# A quote is meant to bridge preview -> order creation, not to hold a price.
+QUOTE_TTL_SECONDS = int(os.getenv("CHECKOUT_QUOTE_TTL_SECONDS", "300"))
+
+
+class QuoteError(Exception):
+    def __init__(self, message: str, code: str):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _quote_secret() -> Optional[str]:
+    # Read per call, not at import: .env is loaded after the routes are imported.
+    # There is deliberately no fallback; a quote carries prices.
+    return os.getenv("CHECKOUT_QUOTE_SECRET") or None
+
+
+def quotes_enabled() -> bool:
+    return _quote_secret() is not None
+
+
+def _sign(body: str, secret: str) -> str:
+    return _b64encode(hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest())
+
+
+def issue_quote(
+    user_id: str,
+    cart_version: int,
+    lines: List[dict],
+    totals: dict,
+    payment_method: Optional[str] = None,
+    coupon: Optional[dict] = None,
+) -> Optional[dict]:
+    """
+    Sign the outcome of a checkout preview.
+
+    `lines` are the priced cart lines and `totals` the computed amounts;
+    `coupon` is the applied coupon summary (with its id), if any.
+    Returns {"token", "expires_at"}, or None when no CHECKOUT_QUOTE_SECRET
+    is configured (orders are then priced from scratch).
+    """
+    secret = _quote_secret()
+    if secret is None:
+        return None
+
+    expires = int(time.time()) + QUOTE_TTL_SECONDS
+    payload = {
+        "uid": user_id,
+        "cv": cart_version,
+        "pm": payment_method,
+        "lines": lines,
+        "coupon": coupon,
+        "totals": totals,
+        "exp": expires,
+    }
+    body = _b64encode(json.dumps(payload, separators=(",", ":"), sort_keys=True).encode())
+
+    return {
+        "token": f"{body}.{_sign(body, secret)}",
+        "expires_at": datetime.fromtimestamp(expires, timezone.utc).isoformat(),
+    }
+
+
+def verify_quote(token: str, user_id: str) -> dict:
+    """Check signature, expiry and owner; return the quote payload."""
+    secret = _quote_secret()
+    if secret is None:
+        raise QuoteError("Checkout quotes are not enabled; place the order without one.", "QUOTE_DISABLED")
+
+    body, _, signature = (token or "").partition(".")
+    if not body or not signature or not hmac.compare_digest(signature, _sign(body, secret)):
+        raise QuoteError("Checkout quote is invalid.", "QUOTE_INVALID")
+
+    try:
+        quote = json.loads(_b64decode(body))
+    except ValueError:
+        raise QuoteError("Checkout quote is invalid.", "QUOTE_INVALID")
+
+    if quote.get("exp", 0) < time.time():
+        raise QuoteError("Checkout quote has expired. Please review your cart again.", "QUOTE_EXPIRED")
+
+    if quote.get("uid") != user_id:
+        raise QuoteError("Checkout quote is invalid.", "QUOTE_INVALID")
+
+    return quote
+
+
+def quoted_quantities(quote: dict) -> dict:
+    return {line["variant_id"]: line["quantity"] for line in quote["lines"]}
+
+
+async def _check_stock(db: AsyncIOMotorDatabase, quote: dict, check_stock_levels: bool) -> None:
+    wanted = quoted_quantities(quote)
+    variants = await db.variants.find(
+        {"id": {"$in": list(wanted)}, "is_active": True, "in_stock": True},
+        {"_id": 0, "id": 1, "stock": 1, "size": 1},
+    ).to_list(length=len(wanted))
+    found = {v["id"]: v for v in variants}
+
+    for variant_id, quantity in wanted.items():
+        variant = found.get(variant_id)
+        if not variant:
+            raise QuoteError(f"Variant {variant_id} not available", "VARIANT_UNAVAILABLE")
+        if check_stock_levels and variant.get("stock", 0) < quantity:
+            raise QuoteError(f"Insufficient stock for {variant.get('size', '')}", "INSUFFICIENT_STOCK")
+
+
+async def _check_coupon(db: AsyncIOMotorDatabase, quote: dict) -> None:
+    quoted = quote.get("coupon")
+    if not quoted:
+        return
+
+    coupon = await db.coupons.find_one({"id": quoted["coupon_id"], "active": True}, {"_id": 0})
+    if not coupon:
+        raise QuoteError("Invalid coupon code", "COUPON_INVALID")
+
+    try:
+        rule = CouponRule(coupon)
+        rule.check_available()
+        await check_user_limit(db, rule, quote["uid"])
+    except CouponRejected as exc:
+        raise QuoteError(exc.message, exc.code)
+
+
+async def revalidate_quote(db: AsyncIOMotorDatabase, quote: dict, check_stock_levels: bool = False) -> None:
+    """
+    Re-check only what can change between preview and order creation:
+    variant availability (and stock counts, if asked) and coupon limits.
+    Prices and totals are taken from the signed quote.
+    """
+    await asyncio.gather(
+        _check_stock(db, quote, check_stock_levels),
+        _check_coupon(db, quote),
+    )
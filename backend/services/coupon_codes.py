@@ -0,0 +1,128 @@
+import secrets
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Set
+from uuid import uuid4
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from models.coupon import BulkCouponCreate
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Draws that collide with existing codes are retried this many times per batch.
+MAX_COLLISION_RETRIES = 5
+
+# The code space must be this many times larger than the request, so random
+# draws rarely collide and retries stay cheap.
+MIN_CODE_SPACE_FACTOR = 100
+
+_DUPLICATE_KEY = 11000
+
+
+class CouponGenerationError(Exception):
+    pass
+
+
+def check_code_space(request: BulkCouponCreate) -> None:
+    if len(request.alphabet) ** request.length < request.count * MIN_CODE_SPACE_FACTOR:
+        raise CouponGenerationError(
+            f"{len(request.alphabet)}^{request.length} possible codes is too few for {request.count} coupons; "
+            "use a longer code or a larger alphabet"
+        )
+
+
+async def ensure_code_index(db: AsyncIOMotorDatabase) -> None:
+    """
+    Make sure coupons.code has a unique index, creating it if missing.
+    Generation relies on it to reject duplicate codes.
+    """
+    for meta in (await db.coupons.index_information()).values():
+        if meta.get("key") == [("code", 1)]:
+            if meta.get("unique"):
+                return
+            raise CouponGenerationError("The index on coupons.code is not unique; recreate it as unique before generating")
+
+    try:
+        await db.coupons.create_index("code", unique=True, name="idx_coupons_code")
+    except OperationFailure as exc:
+        if exc.code == _DUPLICATE_KEY:
+            raise CouponGenerationError("Existing coupons share a code; fix them before generating") from exc
+        raise
+
+
+def random_codes(count: int, request: BulkCouponCreate, exclude: Set[str]) -> List[str]:
+    """`count` distinct random codes not in `exclude` (which is updated)."""
+    codes = []
+    while len(codes) < count:
+        code = request.prefix + "".join(secrets.choice(request.alphabet) for _ in range(request.length))
+        if code not in exclude:
+            exclude.add(code)
+            codes.append(code)
+    return codes
+
+
+def _coupon_doc(request: BulkCouponCreate, code: str, now: str) -> dict:
+    doc = request.model_dump(exclude={"count", "prefix", "length", "alphabet"})
+    doc.update({
+        "id": str(uuid4()),
+        "code": code,
+        "used_count": 0,
+        "bulk": True,  # private codes; never advertised (services/coupon_finder.py)
+        "created_at": now,
+        "updated_at": now,
+    })
+    return doc
+
+
+async def _insert_batch(db: AsyncIOMotorDatabase, docs: List[dict]) -> List[dict]:
+    """Insert unordered; return the docs rejected as duplicate codes."""
+    try:
+        await db.coupons.insert_many(docs, ordered=False)
+        return []
+    except BulkWriteError as exc:
+        errors = exc.details.get("writeErrors", [])
+        if any(error.get("code") != _DUPLICATE_KEY for error in errors):
+            raise
+        return [docs[error["index"]] for error in errors]
+
+
+async def generate_coupons(
+    db: AsyncIOMotorDatabase,
+    request: BulkCouponCreate,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> AsyncIterator[List[dict]]:
+    """
+    Create `request.count` coupons with random codes, yielding each batch
+    of inserted coupons as it lands.
+
+    Uniqueness is enforced by the unique index on `code`, created here if
+    it is missing; no per-code pre-check queries are issued.
+    Codes that collide with existing coupons are redrawn.
+    """
+    check_code_space(request)
+    await ensure_code_index(db)
+
+    drawn: Set[str] = set()
+    remaining = request.count
+
+    while remaining:
+        now = datetime.now(timezone.utc).isoformat()
+        docs = [_coupon_doc(request, code, now) for code in random_codes(min(batch_size, remaining), request, drawn)]
+
+        for _ in range(MAX_COLLISION_RETRIES + 1):
+            rejected = await _insert_batch(db, docs)
+            rejected_ids = {doc["id"] for doc in rejected}
+            inserted = [doc for doc in docs if doc["id"] not in rejected_ids]
+
+            remaining -= len(inserted)
+            if inserted:
+                for doc in inserted:
+                    doc.pop("_id", None)
+                yield inserted
+
+            if not rejected:
+                break
+            docs = [_coupon_doc(request, code, now) for code in random_codes(len(rejected), request, drawn)]
+        else:
+            raise CouponGenerationError("Too many code collisions; use a longer code or a larger alphabet")
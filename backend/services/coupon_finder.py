@@ -0,0 +1,112 @@
+import asyncio
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.coupon_redemption import user_redemption_counts
+from services.pricing_engine import (
+    COUPON_CACHE_TTL_SECONDS,
+    CouponRejected,
+    CouponRule,
+    coupon_cache_generation,
+)
+
+DEFAULT_RESULT_LIMIT = 5
+
+# Bulk-generated coupons are private single-recipient codes and are never suggested.
+PUBLIC_COUPON_FILTER = {"active": True, "bulk": {"$ne": True}}
+
+
+class CouponIndex:
+    """Active public coupons sorted by min_order_amount."""
+
+    def __init__(self, coupons: List[dict]):
+        rules = sorted((CouponRule(coupon) for coupon in coupons), key=lambda rule: rule.min_order_amount)
+        self.rules = rules
+        self.thresholds = [rule.min_order_amount for rule in rules]
+        self.descriptions = {coupon["id"]: coupon.get("description") for coupon in coupons}
+
+    def eligible(self, subtotal: float) -> List[CouponRule]:
+        """Coupons whose minimum order the subtotal meets: a prefix of the sorted list."""
+        return self.rules[:bisect_right(self.thresholds, subtotal)]
+
+
+_index: Optional[CouponIndex] = None
+_loaded_at = 0.0
+_generation = -1
+_lock = asyncio.Lock()
+
+
+def _fresh() -> bool:
+    return (
+        _index is not None
+        and _generation == coupon_cache_generation()
+        and time.monotonic() - _loaded_at < COUPON_CACHE_TTL_SECONDS
+    )
+
+
+async def get_coupon_index(db: AsyncIOMotorDatabase) -> CouponIndex:
+    """
+    The index for this worker, rebuilt after the coupon cache TTL or as
+    soon as a coupon write invalidates the coupon cache.
+    """
+    global _index, _loaded_at, _generation
+
+    if _fresh():
+        return _index
+
+    async with _lock:
+        if _fresh():
+            return _index
+
+        generation = coupon_cache_generation()
+        now = datetime.now(timezone.utc).isoformat()
+        coupons = await db.coupons.find(
+            {**PUBLIC_COUPON_FILTER, "expiry_date": {"$gt": now}},
+            {"_id": 0},
+        ).to_list(None)
+
+        _index = CouponIndex(coupons)
+        _loaded_at = time.monotonic()
+        _generation = generation
+        return _index
+
+
+async def best_coupons(
+    db: AsyncIOMotorDatabase,
+    subtotal: float,
+    user_id: Optional[str] = None,
+    limit: int = DEFAULT_RESULT_LIMIT,
+) -> Tuple[CouponIndex, List[Tuple[CouponRule, float]]]:
+    """
+    (index, [(coupon, discount)]) for the coupons that apply to `subtotal`,
+    largest discount first. Only coupons whose minimum order is met are
+    evaluated; per-user limits for all of them are read in one query.
+    """
+    index = await get_coupon_index(db)
+    now = datetime.now(timezone.utc)
+
+    ranked = []
+    for rule in index.eligible(subtotal):
+        try:
+            rule.check_available(now)
+        except CouponRejected:
+            continue
+        discount = rule.discount(subtotal)
+        if discount > 0:
+            ranked.append((rule, discount))
+
+    ranked.sort(key=lambda offer: offer[1], reverse=True)
+
+    if user_id:
+        limited = [rule.id for rule, _ in ranked if rule.per_user_limit]
+        used: Dict[str, int] = await user_redemption_counts(db, limited, user_id)
+        ranked = [
+            (rule, discount) for rule, discount in ranked
+            if not rule.per_user_limit or used.get(rule.id, 0) < rule.per_user_limit
+        ]
+
+    return index, ranked[:limit]
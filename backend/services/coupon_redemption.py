@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# One document per (coupon_id, user_id): {"coupon_id", "user_id", "count", "last_used_at"}.
+# Unique index: scripts/create_indexes.py
+COUNTERS_COLLECTION = "coupon_user_counters"
+
+BACKFILL_BATCH_SIZE = 1000
+
+# {"_id": BACKFILL_MARKER_ID, "completed_at"} is written once the backfill has
+# run; until then a missing counter may hide redemptions in the usage log.
+COUNTERS_META_COLLECTION = "coupon_counters_meta"
+BACKFILL_MARKER_ID = "backfill"
+
+# How long a worker trusts "not backfilled yet" before reading the marker again.
+BACKFILL_RECHECK_SECONDS = 60
+
+# A coupon slot is held for an unpaid order this long, then released by the sweeper.
+RESERVATION_TTL_MINUTES = float(os.getenv("COUPON_RESERVATION_TTL_MINUTES", "30"))
+
+# Indexes (scripts/create_indexes.py): unique order_id; TTL on expires_at as a
+# backstop only -- the sweeper must release a reservation before Mongo drops it,
+# otherwise its slot is never returned to used_count.
+RESERVATIONS_COLLECTION = "coupon_reservations"
+RESERVATION_TTL_INDEX_GRACE_SECONDS = 24 * 3600
+
+
+# ============================================
+# RESERVATIONS (ORDER CREATED -> PAID / FAILED / EXPIRED)
+# ============================================
+
+async def reserve_coupon(db: AsyncIOMotorDatabase, coupon_id: str, order_id: str, user_id: str) -> bool:
+    """
+    Take one slot of a coupon for an unpaid order.
+
+    `used_count` counts reserved plus redeemed uses, and the increment is
+    guarded by `used_count < usage_limit` in the same write, so concurrent
+    orders can never oversubscribe a limited coupon. Returns False when the
+    coupon is exhausted (or gone).
+    """
+    taken = await db.coupons.find_one_and_update(
+        {
+            "id": coupon_id,
+            "$or": [
+                {"usage_limit": {"$in": [None, 0]}},
+                {"$expr": {"$lt": [{"$ifNull": ["$used_count", 0]}, "$usage_limit"]}},
+            ],
+        },
+        {"$inc": {"used_count": 1}},
+        projection={"_id": 1},
+    )
+    if not taken:
+        return False
+
+    now = datetime.now(timezone.utc)
+    try:
+        await db[RESERVATIONS_COLLECTION].insert_one({
+            "order_id": order_id,
+            "coupon_id": coupon_id,
+            "user_id": user_id,
+            "created_at": now,
+            "expires_at": now + timedelta(minutes=RESERVATION_TTL_MINUTES),
+        })
+    except Exception:
+        await _return_slot(db, coupon_id)
+        raise
+
+    return True
+
+
+async def _return_slot(db: AsyncIOMotorDatabase, coupon_id: str) -> None:
+    await db.coupons.update_one(
+        {"id": coupon_id, "used_count": {"$gt": 0}},
+        {"$inc": {"used_count": -1}},
+    )
+
+
+async def release_reservation(db: AsyncIOMotorDatabase, order_id: str) -> bool:
+    """Give an unpaid order's coupon slot back (payment failed or order abandoned)."""
+    reservation = await db[RESERVATIONS_COLLECTION].find_one_and_delete({"order_id": order_id})
+    if not reservation:
+        return False
+
+    await _return_slot(db, reservation["coupon_id"])
+    return True
+
+
+async def release_expired_reservations(
+    db: AsyncIOMotorDatabase,
+    report: Callable[[str], None] = logger.info,
+) -> int:
+    """Release every reservation past its expiry; each is claimed atomically, so sweepers may overlap."""
+    now = datetime.now(timezone.utc)
+    released = 0
+
+    while True:
+        reservation = await db[RESERVATIONS_COLLECTION].find_one_and_delete({"expires_at": {"$lt": now}})
+        if not reservation:
+            break
+        await _return_slot(db, reservation["coupon_id"])
+        released += 1
+
+    if released:
+        report(f"Released {released} expired coupon reservations")
+    return released
+
+
+async def run_reservation_sweeper(db: AsyncIOMotorDatabase, interval_seconds: float):
+    """Background loop for releasing expired reservations; cancel the task to stop it."""
+    while True:
+        try:
+            await release_expired_reservations(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.exception("Coupon reservation sweep failed: %s", exc)
+
+        await asyncio.sleep(interval_seconds)
+
+
+# ============================================
+# REDEMPTION (PAYMENT SUCCEEDED)
+# ============================================
+
+
+_backfilled = False
+_backfill_checked_at: Optional[float] = None
+
+
+async def counters_backfilled(db: AsyncIOMotorDatabase) -> bool:
+    """
+    Whether scripts/backfill_coupon_counters.py has completed. A yes is
+    kept for the life of the worker; a no is re-read every
+    BACKFILL_RECHECK_SECONDS.
+    """
+    global _backfilled, _backfill_checked_at
+
+    if _backfilled or (
+        _backfill_checked_at is not None
+        and time.monotonic() - _backfill_checked_at < BACKFILL_RECHECK_SECONDS
+    ):
+        return _backfilled
+
+    marker = await db[COUNTERS_META_COLLECTION].find_one({"_id": BACKFILL_MARKER_ID}, {"_id": 1})
+    _backfilled = marker is not None
+    _backfill_checked_at = time.monotonic()
+    return _backfilled
+
+
+async def user_redemptions(db: AsyncIOMotorDatabase, coupon_id: str, user_id: str) -> int:
+    """
+    How many times `user_id` has redeemed `coupon_id` (indexed point read).
+
+    Until the counter backfill has completed, a missing counter falls back
+    to counting the usage log; after it, a missing counter means 0.
+    """
+    counter = await db[COUNTERS_COLLECTION].find_one(
+        {"coupon_id": coupon_id, "user_id": user_id},
+        {"_id": 0, "count": 1},
+    )
+    if counter:
+        return counter.get("count", 0)
+    if await counters_backfilled(db):
+        return 0
+    return await db.coupon_usage.count_documents({"coupon_id": coupon_id, "user_id": user_id})
+
+
+async def _count_redemption(db: AsyncIOMotorDatabase, coupon_id: str, user_id: str, now: str) -> None:
+    """Bump the counter; a missing counter is seeded from the usage log (which already has this use)."""
+    query = {"coupon_id": coupon_id, "user_id": user_id}
+    result = await db[COUNTERS_COLLECTION].update_one(query, {"$inc": {"count": 1}, "$set": {"last_used_at": now}})
+    if result.matched_count:
+        return
+
+    # $max keeps concurrent first redemptions (each counting the log) from undercounting
+    count = await db.coupon_usage.count_documents(query)
+    await db[COUNTERS_COLLECTION].update_one(
+        query,
+        {"$max": {"count": count, "last_used_at": now}},
+        upsert=True,
+    )
+
+
+async def user_redemption_counts(db: AsyncIOMotorDatabase, coupon_ids: List[str], user_id: str) -> Dict[str, int]:
+    """
+    Redemptions of each of `coupon_ids` by `user_id`; coupons never used
+    are omitted. Same rule as user_redemptions: coupons without a counter
+    are counted from the usage log, in one more query, until the backfill
+    has completed.
+    """
+    if not coupon_ids:
+        return {}
+
+    cursor = db[COUNTERS_COLLECTION].find(
+        {"user_id": user_id, "coupon_id": {"$in": coupon_ids}},
+        {"_id": 0, "coupon_id": 1, "count": 1},
+    )
+    counts = {counter["coupon_id"]: counter.get("count", 0) async for counter in cursor}
+
+    uncounted = [coupon_id for coupon_id in coupon_ids if coupon_id not in counts]
+    if uncounted and not await counters_backfilled(db):
+        logged = db.coupon_usage.aggregate([
+            {"$match": {"user_id": user_id, "coupon_id": {"$in": uncounted}}},
+            {"$group": {"_id": "$coupon_id", "count": {"$sum": 1}}},
+        ])
+        counts.update({row["_id"]: row["count"] async for row in logged})
+
+    return counts
+
+
+async def record_redemption(db: AsyncIOMotorDatabase, order: dict, user_id: str) -> None:
+    """
+    Count a paid order's coupon: the usage log entry, the per-user counter
+    and, unless the order still held a reservation (which already counted
+    it), the global used_count. Call once, after payment succeeds.
+
+    A payment that lands after its reservation expired is still counted,
+    even if that takes used_count past usage_limit: the money is taken.
+    """
+    coupon = order.get("coupon_applied")
+    if not coupon:
+        return
+
+    reservation = await db[RESERVATIONS_COLLECTION].find_one_and_delete({"order_id": order["id"]})
+    now = datetime.now(timezone.utc).isoformat()
+
+    # The usage log first: a missing counter is seeded from it
+    await db.coupon_usage.insert_one({
+        "id": str(uuid.uuid4()),
+        "coupon_id": coupon["coupon_id"],
+        "coupon_code": coupon["code"],
+        "user_id": user_id,
+        "user_email": order.get("user_email", ""),
+        "order_id": order["id"],
+        "order_number": order.get("order_number"),
+        "order_amount": order.get("subtotal", order.get("total_amount")),
+        "discount_amount": coupon["discount"],
+        "used_at": now
+    })
+
+    writes = [_count_redemption(db, coupon["coupon_id"], user_id, now)]
+    if not reservation:
+        writes.append(db.coupons.update_one(
+            {"id": coupon["coupon_id"]},
+            {"$inc": {"used_count": 1}}
+        ))
+
+    await asyncio.gather(*writes)
+
+
+async def backfill_user_counters(
+    db: AsyncIOMotorDatabase,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    report: Callable[[str], None] = logger.info,
+) -> int:
+    """
+    Rebuild every counter from the coupon_usage log, then record that it
+    completed so limit checks stop falling back to the log. Counts are set,
+    not incremented, so the backfill is safe to re-run.
+    """
+    pipeline = [
+        {
+            "$group": {
+                "_id": {"coupon_id": "$coupon_id", "user_id": "$user_id"},
+                "count": {"$sum": 1},
+                "last_used_at": {"$max": "$used_at"},
+            }
+        },
+    ]
+
+    started = time.perf_counter()
+    written = 0
+    batch = []
+
+    async def flush():
+        nonlocal written
+        await db[COUNTERS_COLLECTION].bulk_write(batch, ordered=False)
+        written += len(batch)
+        batch.clear()
+        elapsed = time.perf_counter() - started
+        report(f"Wrote {written} coupon/user counters ({written / elapsed if elapsed > 0 else 0:.0f}/s)")
+
+    async for row in db.coupon_usage.aggregate(pipeline, allowDiskUse=True):
+        batch.append(UpdateOne(
+            row["_id"],
+            {"$set": {"count": row["count"], "last_used_at": row["last_used_at"]}},
+            upsert=True,
+        ))
+        if len(batch) >= batch_size:
+            await flush()
+
+    if batch:
+        await flush()
+
+    await db[COUNTERS_META_COLLECTION].update_one(
+        {"_id": BACKFILL_MARKER_ID},
+        {"$set": {"completed_at": datetime.now(timezone.utc).isoformat(), "counters": written}},
+        upsert=True,
+    )
+    return written
@@ -1,54 +1,363 @@
-from datetime import datetime
-from typing import List, Optional
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from models.settings import GlobalSettings
+from services.coupon_redemption import user_redemptions
+from services.settings_provider import get_global_settings
+
+# How long a worker trusts a cached coupon (or a cached "no such code").
+# Admin writes through this process invalidate immediately; other workers,
+# and used_count changes, are picked up within this window.
+COUPON_CACHE_TTL_SECONDS = float(os.getenv("COUPON_CACHE_TTL_SECONDS", "60"))
+
+# Cap on remembered unknown codes, so guessing random codes cannot grow the cache.
+NEGATIVE_CACHE_SIZE = 10000
+
 
 class PricingError(Exception):
+    def __init__(self, message: str, code: str = "PRICING_ERROR"):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class CouponRejected(PricingError):
     pass
 
 
-async def calculate_checkout(
+def _parse_expiry(value: str) -> datetime:
+    expiry = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry
+
+
+# ============================================
+# COMPILED RULES
+# ============================================
+
+class CouponRule:
+    """A coupon document compiled once: expiry parsed, limits and caps extracted."""
+
+    __slots__ = (
+        "id", "code", "type", "value", "max_discount", "min_order_amount",
+        "usage_limit", "used_count", "per_user_limit", "expires_at", "expires_ts",
+    )
+
+    def __init__(self, coupon: dict):
+        self.id = coupon.get("id")
+        self.code = coupon["code"]
+        self.type = coupon["type"]
+        self.value = coupon["value"]
+        self.max_discount = coupon.get("max_discount")
+        self.min_order_amount = coupon.get("min_order_amount") or 0
+        self.usage_limit = coupon.get("usage_limit")
+        self.used_count = coupon.get("used_count", 0)
+        self.per_user_limit = coupon.get("per_user_limit")
+        self.expires_at = _parse_expiry(coupon["expiry_date"])
+        self.expires_ts = self.expires_at.timestamp()
+
+    def check_available(self, now: Optional[datetime] = None) -> None:
+        """Expiry and global usage limit; independent of the cart."""
+        if self.expires_ts <= (now.timestamp() if now else time.time()):
+            raise CouponRejected("Coupon has expired", "COUPON_EXPIRED")
+
+        if self.usage_limit and self.used_count >= self.usage_limit:
+            raise CouponRejected("Coupon usage limit exceeded", "COUPON_LIMIT_REACHED")
+
+    def check(self, subtotal: float, now: Optional[datetime] = None) -> None:
+        self.check_available(now)
+
+        if subtotal < self.min_order_amount:
+            raise CouponRejected(
+                f"Minimum order amount ₹{self.min_order_amount} required",
+                "COUPON_MIN_ORDER",
+            )
+
+    def discount(self, subtotal: float) -> float:
+        if self.type == "percentage":
+            discount = subtotal * (self.value / 100)
+        else:
+            discount = self.value
+
+        if self.max_discount:
+            discount = min(discount, self.max_discount)
+
+        # Never discount more than the order is worth
+        return round(min(discount, subtotal), 2)
+
+    def summary(self, discount: float) -> dict:
+        return {
+            "coupon_id": self.id,
+            "code": self.code,
+            "type": self.type,
+            "value": self.value,
+            "discount": discount,
+        }
+
+
+class PricingRules:
+    """Shipping and payment-method rules compiled from GlobalSettings."""
+
+    def __init__(self, settings: GlobalSettings):
+        self.settings = settings
+        self.shipping_threshold = settings.shipping_threshold
+        self.shipping_fee = settings.shipping_fee
+        self.cod_fee = settings.cod_fee
+        self.prepaid_percent = settings.prepaid_discount_1 / 100
+        self.high_value_percent = settings.prepaid_discount_2 / 100
+        self.high_value_threshold = settings.prepaid_threshold_2
+
+    def shipping(self, subtotal: float) -> float:
+        return 0 if subtotal >= self.shipping_threshold else self.shipping_fee
+
+    def price(
+        self,
+        subtotal: float,
+        payment_method: Optional[str] = None,
+        coupon: Optional[CouponRule] = None,
+        now: Optional[datetime] = None,
+    ) -> dict:
+        """
+        Price a cart subtotal. Raises CouponRejected if `coupon` does not
+        apply; per-user coupon limits are checked separately
+        (`check_user_limit`) since they need the database.
+        """
+        subtotal = round(subtotal, 2)
+
+        coupon_discount = 0
+        coupon_data = None
+        if coupon is not None:
+            coupon.check(subtotal, now)
+            coupon_discount = coupon.discount(subtotal)
+            coupon_data = coupon.summary(coupon_discount)
+
+        prepaid_discount = 0
+        high_value_discount = 0
+        cod_charge = 0
+
+        if payment_method == "PREPAID":
+            prepaid_discount = round(subtotal * self.prepaid_percent, 2)
+            if subtotal >= self.high_value_threshold:
+                high_value_discount = round(subtotal * self.high_value_percent, 2)
+        elif payment_method == "COD":
+            cod_charge = self.cod_fee
+
+        shipping = self.shipping(subtotal)
+        total_discount = round(coupon_discount + prepaid_discount + high_value_discount, 2)
+        grand_total = max(0, round(subtotal - total_discount + shipping + cod_charge, 2))
+
+        return {
+            "subtotal": subtotal,
+            "coupon_discount": coupon_discount,
+            "prepaid_discount": prepaid_discount,
+            "high_value_discount": high_value_discount,
+            "total_discount": total_discount,
+            "shipping": shipping,
+            "cod_fee": cod_charge,
+            "grand_total": grand_total,
+            "remaining_for_free_shipping": round(max(0, self.shipping_threshold - subtotal), 2),
+            "remaining_for_high_value_discount": round(max(0, self.high_value_threshold - subtotal), 2),
+            "coupon": coupon_data,
+        }
+
+
+_rules: Optional[PricingRules] = None
+
+
+async def get_pricing_rules(db: AsyncIOMotorDatabase) -> PricingRules:
+    """Rules for the current settings; recompiled only when the settings reload."""
+    global _rules
+
+    settings = await get_global_settings(db)
+    if _rules is None or _rules.settings is not settings:
+        _rules = PricingRules(settings)
+    return _rules
+
+
+class CouponCache:
+    """
+    Compiled coupons keyed by normalized code, including negative entries
+    (None) for codes that do not exist. Entries live for the TTL; a live
+    coupon also drops out the moment its expiry passes, tracked with a
+    min-heap of expiry timestamps.
+    """
+
+    def __init__(self, ttl_seconds: float = COUPON_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[Optional[CouponRule], float]] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        # Expiry each code was last pushed with, so a TTL reload does not push it again
+        self._heap_expiry: Dict[str, float] = {}
+        self._negatives = 0
+        # Bumped on every clear, so derived caches can tell they are stale
+        self.generation = 0
+
+    def _drop_expired(self, now: float) -> None:
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_ts, code = heapq.heappop(heap)
+            if self._heap_expiry.get(code) == expires_ts:
+                del self._heap_expiry[code]
+            entry = self._entries.get(code)
+            if entry and entry[0] is not None and entry[0].expires_ts == expires_ts:
+                del self._entries[code]
+
+    def get(self, code: str) -> Tuple[bool, Optional[CouponRule]]:
+        """(hit, rule); a hit with rule None means the code is known not to exist."""
+        self._drop_expired(time.time())
+
+        entry = self._entries.get(code)
+        if entry is None:
+            return False, None
+
+        rule, loaded_at = entry
+        if time.monotonic() - loaded_at >= self.ttl_seconds:
+            self._remove(code)
+            return False, None
+        return True, rule
+
+    def put(self, code: str, rule: Optional[CouponRule]) -> None:
+        self._remove(code)
+
+        if rule is None:
+            if self._negatives >= NEGATIVE_CACHE_SIZE:
+                self._clear_negatives()
+            self._negatives += 1
+        elif rule.expires_ts > time.time():
+            # Coupons loaded already expired stay until the TTL so callers can say "expired"
+            if self._heap_expiry.get(code) != rule.expires_ts:
+                heapq.heappush(self._expiry_heap, (rule.expires_ts, code))
+                self._heap_expiry[code] = rule.expires_ts
+
+        self._entries[code] = (rule, time.monotonic())
+
+        # Entries that changed expiry or left by TTL leave stale heap items behind
+        if len(self._expiry_heap) > 2 * len(self._entries):
+            self._rebuild_heap()
+
+    def _rebuild_heap(self) -> None:
+        now = time.time()
+        self._heap_expiry = {
+            code: rule.expires_ts
+            for code, (rule, _) in self._entries.items()
+            if rule is not None and rule.expires_ts > now
+        }
+        self._expiry_heap = [(expires_ts, code) for code, expires_ts in self._heap_expiry.items()]
+        heapq.heapify(self._expiry_heap)
+
+    def _remove(self, code: str) -> None:
+        entry = self._entries.pop(code, None)
+        if entry and entry[0] is None:
+            self._negatives -= 1
+
+    def _clear_negatives(self) -> None:
+        self._entries = {code: entry for code, entry in self._entries.items() if entry[0] is not None}
+        self._negatives = 0
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._expiry_heap.clear()
+        self._heap_expiry.clear()
+        self._negatives = 0
+        self.generation += 1
+
+
+_coupon_cache = CouponCache()
+
+
+def invalidate_coupon_cache() -> None:
+    """Forget every cached coupon; call after any coupon write."""
+    _coupon_cache.clear()
+
+
+def coupon_cache_generation() -> int:
+    return _coupon_cache.generation
+
+
+async def load_coupon_rule(db: AsyncIOMotorDatabase, code: Optional[str]) -> Optional[CouponRule]:
+    """The active coupon with this code, compiled; None if there is no such coupon."""
+    code = (code or "").strip().upper()
+    if not code:
+        return None
+
+    hit, rule = _coupon_cache.get(code)
+    if hit:
+        return rule
+
+    coupon = await db.coupons.find_one({"code": code, "active": True}, {"_id": 0})
+    rule = CouponRule(coupon) if coupon else None
+    _coupon_cache.put(code, rule)
+    return rule
+
+
+async def check_user_limit(db: AsyncIOMotorDatabase, coupon: CouponRule, user_id: Optional[str]) -> None:
+    if not user_id or not coupon.per_user_limit:
+        return
+
+    if await user_redemptions(db, coupon.id, user_id) >= coupon.per_user_limit:
+        raise CouponRejected("You have already used this coupon", "COUPON_LIMIT_REACHED")
+
+
+# ============================================
+# CHECKOUT (RESOLVE + COMPUTE)
+# ============================================
+
+async def resolve_pricing_inputs(
     db: AsyncIOMotorDatabase,
-    user_id: Optional[str],
     cart_items: List[dict],
+    coupon_code: Optional[str] = None,
+) -> Tuple[PricingRules, Dict[str, dict], Optional[CouponRule]]:
+    """
+    Fetch everything pricing depends on, concurrently:
+    (compiled rules, available variants by id, active coupon).
+    Rules usually come from the in-process settings cache.
+    """
+
+    async def fetch_variants():
+        variant_ids = list({item["variant_id"] for item in cart_items})
+        docs = await db.variants.find(
+            {
+                "id": {"$in": variant_ids},
+                "is_active": True,
+                "in_stock": True
+            },
+            {"_id": 0}
+        ).to_list(length=len(variant_ids))
+        return {v["id"]: v for v in docs}
+
+    return await asyncio.gather(
+        get_pricing_rules(db),
+        fetch_variants(),
+        load_coupon_rule(db, coupon_code),
+    )
+
+
+def compute_checkout(
+    cart_items: List[dict],
+    rules: PricingRules,
+    variants: Dict[str, dict],
+    coupon: Optional[CouponRule] = None,
     payment_method: Optional[str] = None,
     coupon_code: Optional[str] = None,
+    now: Optional[datetime] = None,
 ):
     """
-    cart_items format:
-    [
-        {
-            "variant_id": str,
-            "quantity": int
-        }
-    ]
+    Pure pricing over already-resolved inputs (no I/O).
+    `variants` holds only active, in-stock variants keyed by id;
+    `now` is a timezone-aware datetime (defaults to the current time).
     """
 
     if not cart_items:
         raise PricingError("Cart is empty")
 
     # ============================================
-    # 1️⃣ FETCH GLOBAL SETTINGS (SAFE FALLBACK)
-    # ============================================
-    settings = await db.settings.find_one({"_id": "GLOBAL"})
-
-    shipping_threshold = 599
-    shipping_fee = 129
-    cod_fee = 149
-    prepaid_discount_1 = 5
-    prepaid_discount_2 = 5
-    prepaid_threshold_2 = 1199
-
-    if settings:
-        shipping_threshold = settings.get("shipping_threshold", 599)
-        shipping_fee = settings.get("shipping_fee", 129)
-        cod_fee = settings.get("cod_fee", 149)
-        prepaid_discount_1 = settings.get("prepaid_discount_1", 5)
-        prepaid_discount_2 = settings.get("prepaid_discount_2", 5)
-        prepaid_threshold_2 = settings.get("prepaid_threshold_2", 1199)
-
-    # ============================================
-    # 2️⃣ CALCULATE SUBTOTAL
+    # 1️⃣ CALCULATE SUBTOTAL
     # ============================================
     subtotal = 0
     total_mrp = 0
@@ -56,14 +365,7 @@ async def calculate_checkout(
     detailed_items = []
 
     for item in cart_items:
-        variant = await db.variants.find_one(
-            {
-                "id": item["variant_id"],
-                "is_active": True,
-                "in_stock": True
-            },
-            {"_id": 0}
-        )
+        variant = variants.get(item["variant_id"])
 
         if not variant:
             raise PricingError("One of the items is unavailable")
@@ -81,108 +383,70 @@ async def calculate_checkout(
         })
 
     # ============================================
-    # 3️⃣ SHIPPING LOGIC
-    # ============================================
-    shipping_charge = 0 if subtotal >= shipping_threshold else shipping_fee
-
-    # ============================================
-    # 4️⃣ PREPAID / COD LOGIC
-    # ============================================
-    prepaid_discount = 0
-    cod_charge = 0
-    high_value_discount = 0
-
-    if payment_method == "PREPAID":
-        prepaid_discount = subtotal * (prepaid_discount_1 / 100)
-
-        if subtotal >= prepaid_threshold_2:
-            high_value_discount = subtotal * (prepaid_discount_2 / 100)
-
-    if payment_method == "COD":
-        cod_charge = cod_fee
-
-    # ============================================
-    # 5️⃣ COUPON LOGIC
+    # 2️⃣ SHIPPING, PAYMENT METHOD, COUPON
     # ============================================
-    coupon_discount = 0
-    coupon_data = None
-
-    if coupon_code:
-        coupon = await db.coupons.find_one(
-            {
-                "code": coupon_code,
-                "active": True
-            },
-            {"_id": 0}
-        )
-
-        if not coupon:
-            raise PricingError("Invalid coupon code")
+    if coupon_code and coupon is None:
+        raise CouponRejected("Invalid coupon code", "COUPON_INVALID")
 
-        expiry = datetime.fromisoformat(coupon["expiry_date"])
-
-        if expiry < datetime.utcnow():
-            raise PricingError("Coupon expired")
-
-        if subtotal < coupon.get("min_order_amount", 0):
-            raise PricingError("Minimum order amount not met")
-
-        if coupon["type"] == "percentage":
-            coupon_discount = subtotal * (coupon["value"] / 100)
-        else:
-            coupon_discount = coupon["value"]
-
-        if coupon.get("max_discount"):
-            coupon_discount = min(coupon_discount, coupon["max_discount"])
-
-        coupon_data = {
-            "code": coupon["code"],
-            "discount": round(coupon_discount, 2)
-        }
+    pricing = rules.price(subtotal, payment_method, coupon, now)
 
     # ============================================
-    # 6️⃣ TOTAL CALCULATION
-    # ============================================
-    total_discount = prepaid_discount + high_value_discount + coupon_discount
-
-    grand_total = (
-        subtotal
-        - total_discount
-        + shipping_charge
-        + cod_charge
-    )
-
-    if grand_total < 0:
-        grand_total = 0
-
-    # ============================================
-    # 7️⃣ PROGRESS INDICATORS
-    # ============================================
-    remaining_for_free_shipping = max(0, shipping_threshold - subtotal)
-    remaining_for_high_value = max(0, prepaid_threshold_2 - subtotal)
-
-    # ============================================
-    # 8️⃣ RESPONSE STRUCTURE (FRONTEND READY)
+    # 3️⃣ RESPONSE STRUCTURE (FRONTEND READY)
     # ============================================
     return {
         "items": detailed_items,
-        "subtotal": round(subtotal, 2),
+        "subtotal": pricing["subtotal"],
         "mrp_total": round(total_mrp, 2),
         "discounts": {
-            "prepaid_discount": round(prepaid_discount, 2),
-            "high_value_discount": round(high_value_discount, 2),
-            "coupon_discount": round(coupon_discount, 2),
-            "total_discount": round(total_discount, 2)
+            "prepaid_discount": pricing["prepaid_discount"],
+            "high_value_discount": pricing["high_value_discount"],
+            "coupon_discount": pricing["coupon_discount"],
+            "total_discount": pricing["total_discount"]
         },
         "charges": {
-            "shipping": round(shipping_charge, 2),
-            "cod_fee": round(cod_charge, 2)
+            "shipping": pricing["shipping"],
+            "cod_fee": pricing["cod_fee"]
         },
-        "grand_total": round(grand_total, 2),
+        "grand_total": pricing["grand_total"],
         "progress": {
-            "remaining_for_free_shipping": round(remaining_for_free_shipping, 2),
-            "remaining_for_high_value_discount": round(remaining_for_high_value, 2)
+            "remaining_for_free_shipping": pricing["remaining_for_free_shipping"],
+            "remaining_for_high_value_discount": pricing["remaining_for_high_value_discount"]
         },
-        "coupon": coupon_data,
+        "coupon": pricing["coupon"],
         "tax_note": "Inclusive of all taxes"
     }
+
+
+async def calculate_checkout(
+    db: AsyncIOMotorDatabase,
+    user_id: Optional[str],
+    cart_items: List[dict],
+    payment_method: Optional[str] = None,
+    coupon_code: Optional[str] = None,
+):
+    """
+    cart_items format:
+    [
+        {
+            "variant_id": str,
+            "quantity": int
+        }
+    ]
+    """
+
+    if not cart_items:
+        raise PricingError("Cart is empty")
+
+    rules, variants, coupon = await resolve_pricing_inputs(db, cart_items, coupon_code)
+
+    if coupon is not None:
+        await check_user_limit(db, coupon, user_id)
+
+    return compute_checkout(
+        cart_items,
+        rules,
+        variants,
+        coupon,
+        payment_method=payment_method,
+        coupon_code=coupon_code,
+    )
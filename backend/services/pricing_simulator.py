@@ -0,0 +1,256 @@
+import itertools
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models.settings import GlobalSettings
+
+# Settings a scenario may vary, plus a multiplier on every coupon's value.
+SCENARIO_FIELDS = (
+    "shipping_threshold",
+    "shipping_fee",
+    "cod_fee",
+    "prepaid_discount_1",
+    "prepaid_discount_2",
+    "prepaid_threshold_2",
+    "coupon_value_scale",
+)
+
+MAX_SCENARIOS = 20000
+
+_METHOD_OTHER, _METHOD_PREPAID, _METHOD_COD = 0, 1, 2
+_COUPON_NONE, _COUPON_PERCENTAGE, _COUPON_FLAT = 0, 1, 2
+
+# Orders paid through a gateway were priced as PREPAID: /orders/initiate stores
+# "PREPAID", /orders/create "gokwik" and older orders "razorpay".
+PREPAID_METHODS = {"PREPAID", "GOKWIK", "RAZORPAY"}
+
+# COD orders get no payment callback, so their payment_status stays PENDING;
+# they count unless the order itself was cancelled or failed.
+REVENUE_ORDER_FILTER = {
+    "order_status": {"$nin": ["cancelled", "CANCELLED", "payment_failed"]},
+    "$or": [
+        {"payment_status": {"$in": ["success", "SUCCESS"]}},
+        {"payment_method": {"$in": ["COD", "cod"]}},
+    ],
+}
+
+
+class OrderColumns:
+    """Historical orders as parallel NumPy arrays, one entry per order."""
+
+    def __init__(self, orders: List[dict], coupons: Dict[str, dict]):
+        n = len(orders)
+        self.count = n
+        self.subtotal = np.zeros(n)
+        self.recorded_total = np.zeros(n)
+        self.method = np.zeros(n, dtype=np.int8)
+        self.coupon_type = np.zeros(n, dtype=np.int8)
+        self.coupon_value = np.zeros(n)
+        self.coupon_max = np.full(n, np.inf)
+        self.coupon_min = np.zeros(n)
+
+        for i, order in enumerate(orders):
+            subtotal = order.get("subtotal")
+            if subtotal is None:
+                subtotal = sum(item.get("total", 0) for item in order.get("items", []))
+            self.subtotal[i] = subtotal
+            self.recorded_total[i] = order.get("total", order.get("total_amount", 0)) or 0
+
+            method = str(order.get("payment_method") or "").upper()
+            self.method[i] = _METHOD_PREPAID if method in PREPAID_METHODS else _METHOD_COD if method == "COD" else _METHOD_OTHER
+
+            applied = order.get("coupon_applied") or {}
+            code = applied.get("code") or order.get("coupon_code")
+            if not code:
+                continue
+
+            # Current coupon definition where it still exists, else what the order recorded
+            coupon = {**applied, **coupons.get(code.upper(), {})}
+            if coupon.get("type") not in ("percentage", "flat"):
+                continue
+
+            self.coupon_type[i] = _COUPON_PERCENTAGE if coupon["type"] == "percentage" else _COUPON_FLAT
+            self.coupon_value[i] = coupon.get("value") or 0
+            self.coupon_max[i] = coupon.get("max_discount") or np.inf
+            self.coupon_min[i] = coupon.get("min_order_amount") or 0
+
+        # Sorted subtotals and prefix sums turn threshold rules into binary searches
+        self.subtotal_sum = float(self.subtotal.sum())
+        self.sorted_subtotal = np.sort(self.subtotal)
+        self.prepaid_subtotal = np.sort(self.subtotal[self.method == _METHOD_PREPAID])
+        self.prepaid_prefix = np.concatenate(([0.0], np.cumsum(self.prepaid_subtotal)))
+        self.cod_count = int((self.method == _METHOD_COD).sum())
+
+    def coupon_discounts(self, scale: float) -> np.ndarray:
+        """Per-order coupon discount with every coupon's value multiplied by `scale`."""
+        value = self.coupon_value * scale
+        discount = np.where(self.coupon_type == _COUPON_PERCENTAGE, self.subtotal * value / 100, value)
+        discount = np.minimum(np.minimum(discount, self.coupon_max), self.subtotal)
+        applies = (self.coupon_type != _COUPON_NONE) & (self.subtotal >= self.coupon_min)
+        return np.where(applies, discount, 0.0)
+
+
+async def load_order_columns(db: AsyncIOMotorDatabase, days: int) -> OrderColumns:
+    """Paid (or COD), non-cancelled orders from the last `days` days, plus their coupons in one `$in`."""
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    orders = await db.orders.find(
+        {**REVENUE_ORDER_FILTER, "created_at": {"$gte": since}},
+        {
+            "_id": 0, "subtotal": 1, "items.total": 1, "total": 1, "total_amount": 1,
+            "payment_method": 1, "coupon_applied": 1, "coupon_code": 1,
+        },
+    ).to_list(None)
+
+    codes = set()
+    for order in orders:
+        code = (order.get("coupon_applied") or {}).get("code") or order.get("coupon_code")
+        if code:
+            codes.add(code.upper())
+
+    coupons = {}
+    if codes:
+        async for coupon in db.coupons.find(
+            {"code": {"$in": list(codes)}},
+            {"_id": 0, "code": 1, "type": 1, "value": 1, "max_discount": 1, "min_order_amount": 1},
+        ):
+            coupons[coupon["code"]] = coupon
+
+    return OrderColumns(orders, coupons)
+
+
+def build_scenarios(base: GlobalSettings, grid: Dict[str, Optional[List[float]]]) -> Dict[str, np.ndarray]:
+    """
+    Cartesian product of the candidate values in `grid`; fields without
+    candidates keep their current value. Returns one column per field.
+    """
+    axes = []
+    for field in SCENARIO_FIELDS:
+        current = 1.0 if field == "coupon_value_scale" else float(getattr(base, field))
+        axes.append(sorted(set(grid.get(field) or [current])))
+
+    total = 1
+    for axis in axes:
+        total *= len(axis)
+    if total > MAX_SCENARIOS:
+        raise ValueError(f"{total} scenarios requested; the limit is {MAX_SCENARIOS}")
+
+    rows = np.array(list(itertools.product(*axes)), dtype=float).reshape(total, len(SCENARIO_FIELDS))
+    return {field: rows[:, i] for i, field in enumerate(SCENARIO_FIELDS)}
+
+
+def _unclipped_totals(sub, prepaid, cod, coupon, s) -> np.ndarray:
+    """Grand totals before the zero floor, as a (scenarios x orders) grid."""
+    shipping = np.where(sub >= s["shipping_threshold"], 0.0, s["shipping_fee"])
+    prepaid_discount = np.where(prepaid, sub * s["prepaid_discount_1"] / 100, 0.0)
+    high_value_discount = np.where(prepaid & (sub >= s["prepaid_threshold_2"]), sub * s["prepaid_discount_2"] / 100, 0.0)
+    cod_charge = np.where(cod, s["cod_fee"], 0.0)
+    return sub - coupon - prepaid_discount - high_value_discount + shipping + cod_charge
+
+
+def evaluate_scenarios(columns: OrderColumns, scenarios: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Per-scenario sums of the PricingRules.price arithmetic over all orders.
+
+    Every rule is a threshold or a percentage of the subtotal, so its sum
+    over orders is a binary search into sorted subtotals plus a prefix-sum
+    lookup: O(scenarios x log orders). Coupon sums are computed once per
+    distinct coupon scale. The only non-linear step, the zero floor on the
+    grand total, is evaluated exactly on the few orders that could reach it.
+    Per-order rounding to paise is not modelled.
+    """
+    threshold = scenarios["shipping_threshold"]
+    scale = scenarios["coupon_value_scale"]
+
+    charged = np.searchsorted(columns.sorted_subtotal, threshold, side="left")
+    shipping = scenarios["shipping_fee"] * charged
+
+    prepaid_total = columns.prepaid_prefix[-1]
+    prepaid = scenarios["prepaid_discount_1"] / 100 * prepaid_total
+    high_from = np.searchsorted(columns.prepaid_subtotal, scenarios["prepaid_threshold_2"], side="left")
+    high_value = scenarios["prepaid_discount_2"] / 100 * (prepaid_total - columns.prepaid_prefix[high_from])
+
+    cod = scenarios["cod_fee"] * columns.cod_count
+
+    coupon = np.zeros(len(threshold))
+    floor_correction = np.zeros(len(threshold))
+    is_prepaid = columns.method == _METHOD_PREPAID
+    max_percent = (scenarios["prepaid_discount_1"].max() + scenarios["prepaid_discount_2"].max()) / 100
+
+    for value in np.unique(scale):
+        rows = scale == value
+        discounts = columns.coupon_discounts(value)
+        coupon[rows] = discounts.sum()
+
+        # Charges are >= 0, so only orders whose discounts alone can exceed the subtotal may hit the floor
+        at_risk = columns.subtotal - discounts - np.where(is_prepaid, columns.subtotal * max_percent, 0.0) < 0
+        if at_risk.any():
+            totals = _unclipped_totals(
+                columns.subtotal[at_risk][None, :],
+                is_prepaid[at_risk][None, :],
+                (columns.method == _METHOD_COD)[at_risk][None, :],
+                discounts[at_risk][None, :],
+                {field: column[rows][:, None] for field, column in scenarios.items()},
+            )
+            floor_correction[rows] = np.maximum(0.0, -totals).sum(axis=1)
+
+    discounts = coupon + prepaid + high_value
+    return {
+        "revenue": columns.subtotal_sum - discounts + shipping + cod + floor_correction,
+        "shipping_revenue": shipping,
+        "cod_revenue": cod,
+        "discounts": discounts,
+        "free_shipping_orders": columns.count - charged,
+    }
+
+
+def simulate(
+    columns: OrderColumns,
+    base: GlobalSettings,
+    grid: Dict[str, Optional[List[float]]],
+    top: int = 50,
+) -> dict:
+    """
+    Re-price historical orders under every scenario in `grid` and report
+    aggregate deltas against the current settings (re-priced the same way,
+    so deltas reflect rule changes only). CPU-bound; run off the event loop.
+    """
+    started = time.perf_counter()
+
+    baseline_settings = build_scenarios(base, {})
+    scenarios = build_scenarios(base, grid)
+
+    baseline = {k: float(v[0]) for k, v in evaluate_scenarios(columns, baseline_settings).items()}
+    results = evaluate_scenarios(columns, scenarios)
+
+    delta = results["revenue"] - baseline["revenue"]
+    ranked = np.argsort(-delta, kind="stable")[:top]
+
+    def _row(i: int) -> dict:
+        revenue = float(results["revenue"][i])
+        return {
+            "settings": {field: float(scenarios[field][i]) for field in SCENARIO_FIELDS},
+            "revenue": round(revenue, 2),
+            "revenue_delta": round(float(delta[i]), 2),
+            "revenue_delta_percent": round(float(delta[i]) / baseline["revenue"] * 100, 2) if baseline["revenue"] else None,
+            "shipping_revenue": round(float(results["shipping_revenue"][i]), 2),
+            "cod_revenue": round(float(results["cod_revenue"][i]), 2),
+            "discounts": round(float(results["discounts"][i]), 2),
+            "free_shipping_share": round(float(results["free_shipping_orders"][i]) / columns.count, 4) if columns.count else 0,
+            "average_order_value": round(revenue / columns.count, 2) if columns.count else 0,
+        }
+
+    return {
+        "orders": columns.count,
+        "recorded_revenue": round(float(columns.recorded_total.sum()), 2),
+        "baseline": {
+            "settings": {field: float(baseline_settings[field][0]) for field in SCENARIO_FIELDS},
+            **{k: round(v, 2) for k, v in baseline.items()},
+        },
+        "scenario_count": int(len(delta)),
+        "scenarios": [_row(int(i)) for i in ranked],
+        "seconds": round(time.perf_counter() - started, 3),
+    }
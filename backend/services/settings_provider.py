@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+
+from models.settings import GlobalSettings
+
+logger = logging.getLogger(__name__)
+
+# How long a worker serves the cached GLOBAL settings before re-reading them.
+# Admin writes made through this process invalidate immediately; other
+# workers pick them up within this window.
+SETTINGS_TTL_SECONDS = float(os.getenv("SETTINGS_TTL_SECONDS", "30"))
+
+GLOBAL_SETTINGS_ID = "GLOBAL"
+
+_document: Optional[dict] = None
+_settings: Optional[GlobalSettings] = None
+_loaded_at = 0.0
+_lock = asyncio.Lock()
+
+
+def _parse(document: dict) -> GlobalSettings:
+    try:
+        return GlobalSettings.model_validate(document)
+    except ValidationError as exc:
+        logger.error("Invalid GLOBAL settings document, using defaults: %s", exc)
+        return GlobalSettings()
+
+
+async def _load(db: AsyncIOMotorDatabase) -> dict:
+    global _document, _settings, _loaded_at
+
+    if _document is not None and time.monotonic() - _loaded_at < SETTINGS_TTL_SECONDS:
+        return _document
+
+    async with _lock:
+        if _document is not None and time.monotonic() - _loaded_at < SETTINGS_TTL_SECONDS:
+            return _document
+
+        document = await db.settings.find_one({"_id": GLOBAL_SETTINGS_ID}, {"_id": 0}) or {}
+        _settings = _parse(document)
+        _document = document
+        _loaded_at = time.monotonic()
+        return _document
+
+
+async def get_global_settings(db: AsyncIOMotorDatabase) -> GlobalSettings:
+    """Typed GLOBAL settings, served from memory within the TTL."""
+    await _load(db)
+    return _settings
+
+
+def invalidate_settings() -> None:
+    """Drop the cached settings so the next read goes to the database."""
+    global _document, _settings, _loaded_at
+
+    _document = None
+    _settings = None
+    _loaded_at = 0.0
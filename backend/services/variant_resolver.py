@@ -0,0 +1,60 @@
+from typing import Dict, Iterable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+
+def variant_lookup_pipeline(variant_ids: list) -> list:
+    """Variants by id with a summary of their parent product joined in."""
+    return [
+        {"$match": {"id": {"$in": variant_ids}}},
+        {
+            "$lookup": {
+                "from": "products",
+                "localField": "product_id",
+                "foreignField": "id",
+                "pipeline": [
+                    {"$project": {"_id": 0, "id": 1, "name": 1, "slug": 1, "image_urls": 1, "is_active": 1}},
+                ],
+                "as": "product",
+            }
+        },
+        {"$unwind": {"path": "$product", "preserveNullAndEmptyArrays": True}},
+        {"$project": {"_id": 0}},
+    ]
+
+
+def is_available(variant: Optional[dict]) -> bool:
+    """Same rule as the `is_active: True, in_stock: True` query filters."""
+    return bool(variant) and variant.get("is_active") is True and variant.get("in_stock") is True
+
+
+class VariantResolver:
+    """
+    Bulk variant lookup: every id not seen yet is fetched with one `$in`
+    aggregation (variant plus parent product summary under "product").
+    Results, including misses, are memoized for the lifetime of the
+    instance, so one resolver per request never asks twice.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self._db = db
+        self._memo: Dict[str, Optional[dict]] = {}
+
+    async def resolve(self, variant_ids: Iterable[str]) -> Dict[str, dict]:
+        """Map of variant id -> variant document for the ids that exist."""
+        wanted = [vid for vid in dict.fromkeys(variant_ids) if vid]
+        missing = [vid for vid in wanted if vid not in self._memo]
+
+        if missing:
+            docs = await self._db.variants.aggregate(variant_lookup_pipeline(missing)).to_list(None)
+            for doc in docs:
+                self._memo[doc["id"]] = doc
+            for vid in missing:
+                self._memo.setdefault(vid, None)
+
+        return {vid: self._memo[vid] for vid in wanted if self._memo[vid] is not None}
+
+    async def resolve_available(self, variant_ids: Iterable[str]) -> Dict[str, dict]:
+        """Like `resolve`, keeping only active, in-stock variants."""
+        variants = await self.resolve(variant_ids)
+        return {vid: v for vid, v in variants.items() if is_available(v)}
@@ -0,0 +1,82 @@
+import gzip
+import hashlib
+import json
+from typing import Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+
+def weak_etag(*parts) -> str:
+    """Build a weak ETag from any values that together identify a representation."""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def payload_etag(payload) -> str:
+    """Weak ETag from a content hash of a JSON-serializable payload."""
+    return weak_etag(json.dumps(payload, sort_keys=True, default=str))
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison of `etag` against the request's If-None-Match header."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+
+    if header.strip() == "*":
+        return True
+
+    target = _opaque(etag)
+    return any(_opaque(tag) == target for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+class EncodedPayload:
+    """A JSON body serialized once and kept in every supported Content-Encoding."""
+
+    def __init__(self, payload):
+        self.identity = json.dumps(payload, separators=(",", ":"), default=str).encode()
+        self.gzip = gzip.compress(self.identity, compresslevel=9)
+        self.br: Optional[bytes] = brotli.compress(self.identity, quality=11) if brotli else None
+
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def encoded_response(request: Request, payload: EncodedPayload, etag: Optional[str] = None) -> Response:
+    """Send a pre-encoded payload in the best encoding the client accepts."""
+    accepted = _accepted_encodings(request)
+    headers = {"Vary": "Accept-Encoding"}
+    if etag:
+        headers["ETag"] = etag
+
+    if payload.br is not None and "br" in accepted:
+        headers["Content-Encoding"] = "br"
+        body = payload.br
+    elif "gzip" in accepted:
+        headers["Content-Encoding"] = "gzip"
+        body = payload.gzip
+    else:
+        body = payload.identity
+
+    return Response(content=body, media_type="application/json", headers=headers)
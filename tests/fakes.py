@@ -0,0 +1,588 @@
+"""
+In-memory stand-ins for the Motor collections the routes and services use.
+
+Covers the query, update (including update pipelines and positional
+`$`), projection and aggregation shapes found in the backend; each
+call yields to the event loop first, so concurrent requests interleave
+the way they would against a real server while every single write
+stays atomic.
+"""
+import asyncio
+import copy
+import itertools
+from types import SimpleNamespace
+
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+
+# Increasing ids, so `_id` ordering and `$gt` paging behave as with ObjectIds.
+_ids = itertools.count(1)
+
+
+# =========================
+# PATHS
+# =========================
+
+def _get_path(doc, path):
+    """Value at a dotted path; arrays fan out like `items.variant_id` does in Mongo."""
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list):
+            if part.isdigit():
+                index = int(part)
+                value = value[index] if index < len(value) else _MISSING
+            else:
+                value = [v[part] for v in value if isinstance(v, dict) and part in v]
+        elif isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set_path(doc, path, value, position=None):
+    parts = [str(position) if part == "$" else part for part in path.split(".")]
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            target = target.setdefault(part, {})
+    if isinstance(target, list):
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+
+def _unset_path(doc, path):
+    parts = path.split(".")
+    target = _get_path(doc, ".".join(parts[:-1])) if len(parts) > 1 else doc
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+
+
+# =========================
+# QUERIES
+# =========================
+
+def _candidates(value):
+    if value is _MISSING:
+        return [None]
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+
+def _compare(op, left, right):
+    if left is None or right is None:
+        return False
+    try:
+        return {"$gt": left > right, "$gte": left >= right, "$lt": left < right, "$lte": left <= right}[op]
+    except TypeError:
+        return False
+
+
+def _match_op(value, op, arg):
+    candidates = _candidates(value)
+    if op == "$in":
+        return any(c in arg for c in candidates)
+    if op == "$nin":
+        return not any(c in arg for c in candidates)
+    if op == "$ne":
+        return not any(c == arg for c in candidates)
+    if op == "$eq":
+        return any(c == arg for c in candidates)
+    if op == "$exists":
+        return (value is not _MISSING) == bool(arg)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        return any(_compare(op, c, arg) for c in candidates)
+    if op == "$elemMatch":
+        return isinstance(value, list) and any(matches(v, arg) for v in value)
+    raise NotImplementedError(f"query operator {op}")
+
+
+def _match_value(value, condition):
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        return all(_match_op(value, op, arg) for op, arg in condition.items())
+    return any(c == condition for c in _candidates(value))
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == "$expr":
+            if not evaluate(condition, doc):
+                return False
+        elif not _match_value(_get_path(doc, key), condition):
+            return False
+    return True
+
+
+def _positional_index(doc, query):
+    """Index of the first array element matched by a dotted query key (for `$`)."""
+    for key, condition in (query or {}).items():
+        if "." not in key:
+            continue
+        head, rest = key.split(".", 1)
+        array = doc.get(head)
+        if isinstance(array, list):
+            for index, element in enumerate(array):
+                if _match_value(_get_path(element, rest), condition):
+                    return index
+    return None
+
+
+# =========================
+# AGGREGATION EXPRESSIONS
+# =========================
+
+def _group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = evaluate(spec["_id"], doc)
+        group = groups.setdefault(repr(key), {"_id": key})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, expr), = accumulator.items()
+            value = evaluate(expr, doc)
+            if op == "$sum":
+                group[field] = group.get(field, 0) + (value or 0)
+            elif op in ("$max", "$min"):
+                pick = max if op == "$max" else min
+                group[field] = value if field not in group else pick(group[field], value)
+            else:
+                raise NotImplementedError(f"$group accumulator {op}")
+    return list(groups.values())
+
+
+def evaluate(expr, doc, variables=None):
+    variables = variables or {}
+
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, path = expr[2:].partition(".")
+        value = variables.get(name, _MISSING)
+        if path and value is not _MISSING:
+            value = _get_path(value, path)
+        return None if value is _MISSING else value
+
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get_path(doc, expr[1:])
+        return None if value is _MISSING else value
+
+    if isinstance(expr, list):
+        return [evaluate(e, doc, variables) for e in expr]
+
+    if not isinstance(expr, dict):
+        return expr
+
+    if len(expr) != 1 or not next(iter(expr)).startswith("$"):
+        return {k: evaluate(v, doc, variables) for k, v in expr.items()}
+
+    op, arg = next(iter(expr.items()))
+
+    def ev(e, extra=None):
+        return evaluate(e, doc, {**variables, **(extra or {})})
+
+    if op == "$literal":
+        return arg
+    if op == "$ifNull":
+        for e in arg:
+            value = ev(e)
+            if value is not None:
+                return value
+        return None
+    if op == "$cond":
+        if isinstance(arg, dict):
+            arg = [arg["if"], arg["then"], arg["else"]]
+        return ev(arg[1]) if ev(arg[0]) else ev(arg[2])
+    if op == "$in":
+        return ev(arg[0]) in (ev(arg[1]) or [])
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        left, right = ev(arg[0]), ev(arg[1])
+        if op == "$eq":
+            return left == right
+        if op == "$ne":
+            return left != right
+        return _compare(op, left, right)
+    if op == "$add":
+        return sum(ev(e) or 0 for e in arg)
+    if op == "$and":
+        return all(ev(e) for e in arg)
+    if op == "$or":
+        return any(ev(e) for e in arg)
+    if op == "$not":
+        return not ev(arg[0] if isinstance(arg, list) else arg)
+    if op == "$size":
+        return len(ev(arg) or [])
+    if op == "$concatArrays":
+        result = []
+        for e in arg:
+            result.extend(ev(e) or [])
+        return result
+    if op == "$mergeObjects":
+        result = {}
+        for e in arg:
+            result.update(ev(e) or {})
+        return result
+    if op == "$map":
+        name = arg.get("as", "this")
+        return [ev(arg["in"], {name: item}) for item in ev(arg["input"]) or []]
+    if op == "$filter":
+        name = arg.get("as", "this")
+        return [item for item in ev(arg["input"]) or [] if ev(arg["cond"], {name: item})]
+    raise NotImplementedError(f"expression operator {op}")
+
+
+# =========================
+# UPDATES AND PROJECTIONS
+# =========================
+
+def _apply_update(doc, update, query=None, inserting=False):
+    if isinstance(update, list):
+        for stage in update:
+            (name, fields), = stage.items()
+            if name in ("$set", "$addFields"):
+                values = {k: evaluate(v, doc) for k, v in fields.items()}
+                for path, value in values.items():
+                    _set_path(doc, path, copy.deepcopy(value))
+            elif name == "$unset":
+                for path in [fields] if isinstance(fields, str) else fields:
+                    _unset_path(doc, path)
+            else:
+                raise NotImplementedError(f"update stage {name}")
+        return
+
+    position = _positional_index(doc, query)
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            if op in ("$set", "$setOnInsert"):
+                _set_path(doc, path, copy.deepcopy(value), position)
+            elif op == "$inc":
+                current = _get_path(doc, path)
+                _set_path(doc, path, (0 if current is _MISSING else current) + value, position)
+            elif op in ("$max", "$min"):
+                current = _get_path(doc, path)
+                if current is _MISSING or (value > current if op == "$max" else value < current):
+                    _set_path(doc, path, value, position)
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$push":
+                current = _get_path(doc, path)
+                _set_path(doc, path, ([] if current is _MISSING else current) + [copy.deepcopy(value)])
+            elif op == "$pull":
+                current = _get_path(doc, path)
+                if isinstance(current, list):
+                    keep = [
+                        item for item in current
+                        if not (matches(item, value) if isinstance(value, dict) else item == value)
+                    ]
+                    _set_path(doc, path, keep)
+            else:
+                raise NotImplementedError(f"update operator {op}")
+
+
+def _seed_from_query(query):
+    """The fields an upsert copies from its filter: plain equality conditions."""
+    doc = {}
+    for key, condition in (query or {}).items():
+        if key.startswith("$") or "." in key:
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                doc[key] = condition["$eq"]
+            continue
+        doc[key] = copy.deepcopy(condition)
+    return doc
+
+
+def project(doc, projection):
+    if doc is None:
+        return None
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        result = {}
+        for key in included:
+            head = key.split(".", 1)[0]
+            if head in doc:
+                result[head] = doc[head]
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+
+    for key, value in projection.items():
+        if not value:
+            doc.pop(key, None)
+    return doc
+
+
+# =========================
+# COLLECTIONS
+# =========================
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = list(docs)
+
+    def sort(self, key, direction=1):
+        keys = list(key.items()) if isinstance(key, dict) else [(key, direction)] if isinstance(key, str) else key
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: (d.get(field) is None, d.get(field)), reverse=order < 0)
+        return self
+
+    def skip(self, count):
+        self._docs = self._docs[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(0)
+        return list(self._docs if length is None else self._docs[:length])
+
+    def __aiter__(self):
+        async def iterate():
+            for doc in self._docs:
+                yield doc
+        return iterate()
+
+
+class FakeCollection:
+    def __init__(self, db=None, docs=None):
+        self.db = db
+        self.docs = docs if docs is not None else []
+        self.indexes = {}
+
+    # ---- indexes ----
+
+    def _unique_keys(self):
+        return [[k for k, _ in meta["key"]] for meta in self.indexes.values() if meta.get("unique")]
+
+    def _check_unique(self, candidate, ignore=None):
+        for fields in self._unique_keys():
+            key = tuple(candidate.get(f) for f in fields)
+            for doc in self.docs:
+                if doc is not ignore and tuple(doc.get(f) for f in fields) == key:
+                    raise DuplicateKeyError(f"duplicate key {dict(zip(fields, key))}", 11000)
+
+    async def create_index(self, keys, unique=False, name=None, **options):
+        await asyncio.sleep(0)
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(f"{k}_{d}" for k, d in keys)
+        self.indexes[name] = {"key": keys, "unique": unique, **options}
+        return name
+
+    async def index_information(self):
+        await asyncio.sleep(0)
+        return {"_id_": {"key": [("_id", 1)]}, **copy.deepcopy(self.indexes)}
+
+    # ---- reads ----
+
+    def _matching(self, query):
+        return [doc for doc in self.docs if matches(doc, query)]
+
+    def _remove(self, removed):
+        self.docs = [doc for doc in self.docs if not any(doc is r for r in removed)]
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        await asyncio.sleep(0)
+        found = self._matching(query)
+        return project(found[0], projection) if found else None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(project(doc, projection) for doc in self._matching(query))
+
+    async def distinct(self, field, query=None):
+        await asyncio.sleep(0)
+        values = []
+        for doc in self._matching(query):
+            value = _get_path(doc, field)
+            if value is _MISSING:
+                continue
+            for item in value if isinstance(value, list) else [value]:
+                if item not in values:
+                    values.append(item)
+        return values
+
+    async def count_documents(self, query):
+        await asyncio.sleep(0)
+        return len(self._matching(query))
+
+    def aggregate(self, pipeline, **kwargs):
+        docs = [copy.deepcopy(doc) for doc in self.docs]
+        for stage in pipeline:
+            (name, arg), = stage.items()
+            if name == "$match":
+                docs = [doc for doc in docs if matches(doc, arg)]
+            elif name == "$lookup":
+                foreign = self.db[arg["from"]]
+                for doc in docs:
+                    joined = foreign._matching({arg["foreignField"]: doc.get(arg["localField"])})
+                    for sub in arg.get("pipeline", []):
+                        (sub_name, sub_arg), = sub.items()
+                        if sub_name != "$project":
+                            raise NotImplementedError(f"$lookup stage {sub_name}")
+                        joined = [project(j, sub_arg) for j in joined]
+                    doc[arg["as"]] = [copy.deepcopy(j) for j in joined]
+            elif name == "$unwind":
+                spec = {"path": arg} if isinstance(arg, str) else arg
+                field = spec["path"][1:]
+                unwound = []
+                for doc in docs:
+                    values = doc.get(field) or []
+                    if not values and spec.get("preserveNullAndEmptyArrays"):
+                        unwound.append({k: v for k, v in doc.items() if k != field})
+                    for value in values:
+                        unwound.append({**doc, field: value})
+                docs = unwound
+            elif name == "$project":
+                docs = [project(doc, arg) for doc in docs]
+            elif name == "$sort":
+                docs = FakeCursor(docs).sort(arg)._docs
+            elif name == "$limit":
+                docs = docs[:arg]
+            elif name == "$group":
+                docs = _group(docs, arg)
+            else:
+                raise NotImplementedError(f"aggregation stage {name}")
+        return FakeCursor(docs)
+
+    # ---- writes ----
+
+    async def insert_one(self, doc):
+        await asyncio.sleep(0)
+        self._check_unique(doc)
+        doc.setdefault("_id", next(_ids))
+        self.docs.append(copy.deepcopy(doc))
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        from pymongo.errors import BulkWriteError
+
+        await asyncio.sleep(0)
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                self._check_unique(doc)
+            except DuplicateKeyError as exc:
+                errors.append({"index": index, "code": 11000, "errmsg": str(exc)})
+                if ordered:
+                    break
+                continue
+            doc.setdefault("_id", next(_ids))
+            self.docs.append(copy.deepcopy(doc))
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return SimpleNamespace(inserted_ids=[doc.get("_id") for doc in docs])
+
+    def _upsert(self, query, update):
+        doc = _seed_from_query(query)
+        _apply_update(doc, update, query, inserting=True)
+        self._check_unique(doc)
+        doc.setdefault("_id", next(_ids))
+        self.docs.append(doc)
+        return doc
+
+    def _update(self, doc, query, update):
+        updated = copy.deepcopy(doc)
+        _apply_update(updated, update, query)
+        self._check_unique(updated, ignore=doc)
+        doc.clear()
+        doc.update(updated)
+
+    async def update_one(self, query, update, upsert=False):
+        await asyncio.sleep(0)
+        found = self._matching(query)
+        if found:
+            self._update(found[0], query, update)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = self._upsert(query, update)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query, update, upsert=False):
+        await asyncio.sleep(0)
+        found = self._matching(query)
+        for doc in found:
+            self._update(doc, query, update)
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found), upserted_id=None)
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False, **kwargs):
+        await asyncio.sleep(0)
+        found = self._matching(query)
+        if found:
+            before = copy.deepcopy(found[0])
+            self._update(found[0], query, update)
+            return project(found[0] if return_document else before, projection)
+        if upsert:
+            doc = self._upsert(query, update)
+            return project(doc, projection) if return_document else None
+        return None
+
+    async def find_one_and_delete(self, query, projection=None, **kwargs):
+        await asyncio.sleep(0)
+        found = self._matching(query)
+        if not found:
+            return None
+        self._remove(found[:1])
+        return project(found[0], projection)
+
+    async def bulk_write(self, requests, ordered=True):
+        """pymongo UpdateOne requests only."""
+        await asyncio.sleep(0)
+        matched = 0
+        for request in requests:
+            result = await self.update_one(request._filter, request._doc, upsert=request._upsert)
+            matched += result.matched_count
+        return SimpleNamespace(matched_count=matched, modified_count=matched)
+
+    async def delete_one(self, query):
+        await asyncio.sleep(0)
+        found = self._matching(query)
+        self._remove(found[:1])
+        return SimpleNamespace(deleted_count=len(found[:1]))
+
+    async def delete_many(self, query):
+        await asyncio.sleep(0)
+        found = self._matching(query)
+        self._remove(found)
+        return SimpleNamespace(deleted_count=len(found))
+
+
+class FakeDB:
+    """Collections are created on first access, by attribute or by item."""
+
+    def __init__(self, **collections):
+        self._collections = {}
+        for name, docs in collections.items():
+            for doc in docs:
+                doc.setdefault("_id", next(_ids))
+            self[name].docs = docs
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
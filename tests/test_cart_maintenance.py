@@ -0,0 +1,76 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+import services.cart_store as cart_store  # noqa: E402
+from models.cart import CartOperation  # noqa: E402
+from services.cart_maintenance import compact_carts, expire_stale_carts  # noqa: E402
+from services.cart_store import MongoCartStore  # noqa: E402
+from tests.fakes import FakeDB  # noqa: E402
+
+LINE = {"variant_id": "variant-1", "product_id": "product-1", "quantity": 1}
+
+
+def days_ago(days):
+    return (datetime.utcnow() - timedelta(days=days)).isoformat()
+
+
+def test_expired_and_long_empty_carts_are_deleted():
+    db = FakeDB(carts=[
+        {"user_id": "stale", "items": [LINE], "coupon_code": "SAVE", "version": 7, "updated_at": days_ago(40)},
+        {"user_id": "fresh", "items": [LINE], "version": 2, "updated_at": days_ago(1)},
+        {"user_id": "empty", "items": [], "version": 3, "updated_at": days_ago(90)},
+        {"user_id": "just-cleared", "items": [], "version": 4, "updated_at": days_ago(1)},
+    ])
+
+    expired = asyncio.run(expire_stale_carts(db, max_age_days=30, batch_size=1, report=lambda _: None))
+
+    assert expired == 2
+    assert sorted(cart["user_id"] for cart in db.carts.docs) == ["fresh", "just-cleared"]
+
+
+def test_a_cart_created_again_after_expiry_never_repeats_a_version(monkeypatch):
+    clock = [1_700_000_000.0]
+    monkeypatch.setattr(cart_store, "time", SimpleNamespace(time=lambda: clock[0]))
+
+    async def scenario():
+        db = FakeDB()
+        store = MongoCartStore(db)
+        add = [CartOperation(op="add", variant_id="variant-1", product_id="product-1", quantity=1)]
+
+        versions = [await store.apply("user-1", add) for _ in range(3)]
+        db.carts.docs[0]["updated_at"] = days_ago(40)
+        clock[0] += 40 * 86400
+        await expire_stale_carts(db, max_age_days=30, report=lambda _: None)
+        assert db.carts.docs == []
+
+        versions.append(await store.apply("user-1", add))
+        return versions
+
+    versions = asyncio.run(scenario())
+
+    assert versions[:3] == [1_700_000_000_001, 1_700_000_000_002, 1_700_000_000_003]
+    assert versions[3] > versions[2]
+
+
+def test_compaction_skips_carts_held_in_memory():
+    dead = {"variant_id": "variant-gone", "product_id": "product-1", "quantity": 1}
+    db = FakeDB(
+        carts=[
+            {"user_id": "held", "items": [LINE, dead], "version": 1, "updated_at": days_ago(40)},
+            {"user_id": "other", "items": [LINE, dead], "version": 1, "updated_at": days_ago(1)},
+        ],
+        variants=[{"id": "variant-1", "is_active": True}],
+    )
+
+    stats = asyncio.run(compact_carts(db, max_age_days=30, report=lambda _: None, held_user_ids=["held"]))
+
+    assert stats["expired"] == 0
+    assert stats["lines_removed"] == 1
+    carts = {cart["user_id"]: cart for cart in db.carts.docs}
+    assert carts["held"]["items"] == [LINE, dead] and carts["held"]["version"] == 1
+    assert carts["other"]["items"] == [LINE] and carts["other"]["version"] == 2
@@ -1,54 +1,46 @@
+import asyncio
 import sys
 from pathlib import Path
 
+import httpx
+
 import pytest
 from fastapi import FastAPI, HTTPException
 from fastapi.testclient import TestClient
 
 sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
 
+import services.cart_store as cart_store  # noqa: E402
 from routes.cart import get_current_user, get_db, router  # noqa: E402
+from services.cart_store import _cart_filter  # noqa: E402
+from tests.fakes import FakeDB  # noqa: E402
 
 
-class FakeCollection:
-    def __init__(self, docs=None):
-        self.docs = docs or []
-
-    async def find_one(self, query, projection=None):
-        for doc in self.docs:
-            if all(doc.get(k) == v for k, v in query.items()):
-                return {k: v for k, v in doc.items()}
-        return None
-
-    async def update_one(self, query, update, upsert=False):
-        existing = await self.find_one(query)
-        if existing:
-            for doc in self.docs:
-                if all(doc.get(k) == v for k, v in query.items()):
-                    doc.update(update.get("$set", {}))
-                    return
-        if upsert:
-            payload = {**query, **update.get("$set", {})}
-            self.docs.append(payload)
-
-    async def delete_one(self, query):
-        self.docs = [doc for doc in self.docs if not all(doc.get(k) == v for k, v in query.items())]
-
-
-class FakeDB:
-    def __init__(self):
-        self.carts = FakeCollection()
-        self.variants = FakeCollection(
-            docs=[
-                {"id": "variant-1", "is_active": True, "in_stock": True, "selling_price": 10},
-                {"id": "variant-2", "is_active": True, "in_stock": True, "selling_price": 20},
-            ]
-        )
+def make_fake_db():
+    db = FakeDB(
+        variants=[
+            {"id": "variant-1", "product_id": "product-1", "is_active": True, "in_stock": True, "selling_price": 10},
+            {"id": "variant-2", "product_id": "product-1", "is_active": True, "in_stock": True, "selling_price": 20},
+        ],
+        products=[{"id": "product-1", "name": "Turmeric", "is_active": True}],
+    )
+    # Created at startup by server.py; the store relies on it when a cart is created concurrently.
+    asyncio.run(db.carts.create_index("user_id", unique=True, name="idx_carts_user_id"))
+    return db
+
+
+# New carts count up from the clock; pinned so versions are predictable
+START = 1_700_000_000_000
+
+
+@pytest.fixture(autouse=True)
+def pinned_start_version(monkeypatch):
+    monkeypatch.setattr(cart_store, "_initial_version", lambda: START)
 
 
 @pytest.fixture
 def fake_db():
-    return FakeDB()
+    return make_fake_db()
 
 
 @pytest.fixture
@@ -86,7 +78,7 @@ def test_cart_isolated_per_authenticated_user(app, fake_db):
     app.dependency_overrides[get_current_user] = user_2
     response = client.get("/cart/")
     assert response.status_code == 200
-    assert response.json() == {"items": [], "total": 0.0, "coupon_code": None}
+    assert response.json() == {"items": [], "total": 0.0, "coupon_code": None, "version": 0}
 
     assert len(fake_db.carts.docs) == 1
     assert fake_db.carts.docs[0]["user_id"] == "user-1"
@@ -154,3 +146,260 @@ def test_add_to_cart_rejects_invalid_quantity(app):
 
     assert response.status_code == 400
     assert response.json()["detail"]["code"] == "INVALID_QUANTITY"
+
+
+async def user_1():
+    return {"id": "user-1", "email": "user1@example.com"}
+
+
+def run_concurrently(app, requests):
+    """Send every (method, url, kwargs) request at once and return the responses in order."""
+
+    async def send_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.request(method, url, **kwargs) for method, url, kwargs in requests))
+
+    return asyncio.run(send_all())
+
+
+def test_concurrent_adds_are_all_counted(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+
+    responses = run_concurrently(app, [
+        ("POST", "/cart/add", {"json": {"variant_id": "variant-1", "product_id": "product-1", "quantity": 1}})
+        for _ in range(10)
+    ])
+
+    assert [r.status_code for r in responses] == [200] * 10
+    assert sorted(r.json()["version"] for r in responses) == list(range(START + 1, START + 11))
+
+    assert len(fake_db.carts.docs) == 1
+    cart = fake_db.carts.docs[0]
+    assert cart["items"] == [
+        {"variant_id": "variant-1", "product_id": "product-1", "quantity": 10, "added_at": cart["items"][0]["added_at"]}
+    ]
+    assert cart["version"] == START + 10
+
+
+def test_concurrent_adds_of_different_variants_keep_every_line(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+
+    responses = run_concurrently(app, [
+        ("POST", "/cart/add", {"json": {"variant_id": variant_id, "product_id": "product-1", "quantity": 2}})
+        for variant_id in ("variant-1", "variant-2", "variant-1", "variant-2")
+    ])
+
+    assert [r.status_code for r in responses] == [200] * 4
+    quantities = {item["variant_id"]: item["quantity"] for item in fake_db.carts.docs[0]["items"]}
+    assert quantities == {"variant-1": 4, "variant-2": 4}
+
+
+def test_concurrent_update_and_add_touch_only_their_own_lines(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    fake_db.carts.docs.append({
+        "user_id": "user-1",
+        "items": [
+            {"variant_id": "variant-1", "product_id": "product-1", "quantity": 1},
+            {"variant_id": "variant-2", "product_id": "product-1", "quantity": 1},
+        ],
+        "version": 3,
+    })
+
+    responses = run_concurrently(app, [
+        ("PUT", "/cart/update", {"json": {"variant_id": "variant-1", "product_id": "product-1", "quantity": 7}}),
+        ("POST", "/cart/add", {"json": {"variant_id": "variant-2", "product_id": "product-1", "quantity": 2}}),
+    ])
+
+    assert [r.status_code for r in responses] == [200] * 2
+    cart = fake_db.carts.docs[0]
+    assert [(item["variant_id"], item["quantity"]) for item in cart["items"]] == [("variant-1", 7), ("variant-2", 3)]
+    assert cart["version"] == 5
+
+
+def test_if_match_on_current_version_applies_the_change(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    client = TestClient(app)
+
+    response = client.post(
+        "/cart/add",
+        json={"variant_id": "variant-1", "product_id": "product-1", "quantity": 1},
+    )
+    version = response.json()["version"]
+
+    response = client.put(
+        "/cart/update",
+        json={"variant_id": "variant-1", "product_id": "product-1", "quantity": 5},
+        headers={"If-Match": f'W/"{version}"'},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"success": True, "version": version + 1}
+    assert fake_db.carts.docs[0]["items"][0]["quantity"] == 5
+
+
+def test_if_match_on_stale_version_is_rejected(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    fake_db.carts.docs.append({
+        "user_id": "user-1",
+        "items": [{"variant_id": "variant-1", "product_id": "product-1", "quantity": 1}],
+        "version": 4,
+    })
+    client = TestClient(app)
+
+    response = client.put(
+        "/cart/update",
+        json={"variant_id": "variant-1", "product_id": "product-1", "quantity": 5},
+        headers={"If-Match": "3"},
+    )
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == {
+        "message": "Cart was modified by another request.",
+        "code": "CART_VERSION_CONFLICT",
+        "expected_version": 3,
+        "current_version": 4,
+        "user_id": "user-1",
+    }
+    assert fake_db.carts.docs[0]["items"][0]["quantity"] == 1
+    assert fake_db.carts.docs[0]["version"] == 4
+
+
+def test_cart_filter_treats_a_missing_version_as_zero():
+    assert _cart_filter("user-1") == {"user_id": "user-1"}
+    assert _cart_filter("user-1", 0) == {"user_id": "user-1", "version": {"$in": [0, None]}}
+    assert _cart_filter("user-1", 2, **{"items.variant_id": "v"}) == {
+        "user_id": "user-1",
+        "version": 2,
+        "items.variant_id": "v",
+    }
+
+
+def test_if_match_zero_creates_a_missing_cart(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    client = TestClient(app)
+
+    response = client.post(
+        "/cart/add",
+        json={"variant_id": "variant-1", "product_id": "product-1", "quantity": 1},
+        headers={"If-Match": "0"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["version"] == START + 1
+    assert fake_db.carts.docs[0]["user_id"] == "user-1"
+
+
+def test_if_match_zero_matches_a_cart_written_before_versioning(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    fake_db.carts.docs.append({
+        "user_id": "user-1",
+        "items": [{"variant_id": "variant-1", "product_id": "product-1", "quantity": 1}],
+    })
+    client = TestClient(app)
+
+    response = client.post(
+        "/cart/add",
+        json={"variant_id": "variant-1", "product_id": "product-1", "quantity": 1},
+        headers={"If-Match": "0"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["version"] == START + 1
+    assert len(fake_db.carts.docs) == 1
+    assert fake_db.carts.docs[0]["items"][0]["quantity"] == 2
+
+
+def test_if_match_zero_does_not_upsert_over_an_existing_cart(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    fake_db.carts.docs.append({"user_id": "user-1", "items": [], "version": 2})
+    client = TestClient(app)
+
+    response = client.post(
+        "/cart/add",
+        json={"variant_id": "variant-1", "product_id": "product-1", "quantity": 1},
+        headers={"If-Match": "0"},
+    )
+
+    assert response.status_code == 409
+    assert response.json()["detail"]["current_version"] == 2
+    assert fake_db.carts.docs == [{"user_id": "user-1", "items": [], "version": 2}]
+
+
+def test_bulk_applies_every_operation_in_one_version(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    fake_db.carts.docs.append({
+        "user_id": "user-1",
+        "items": [
+            {"variant_id": "variant-1", "product_id": "product-1", "quantity": 1},
+            {"variant_id": "variant-2", "product_id": "product-1", "quantity": 1},
+        ],
+        "version": 2,
+    })
+    client = TestClient(app)
+
+    response = client.post(
+        "/cart/bulk",
+        json={"operations": [
+            {"op": "add", "variant_id": "variant-1", "quantity": 2},
+            {"op": "remove", "variant_id": "variant-2"},
+            {"op": "set", "variant_id": "variant-2", "quantity": 5},
+        ]},
+        headers={"If-Match": "2"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"success": True, "applied": 3, "version": 3}
+
+    items = fake_db.carts.docs[0]["items"]
+    assert [(i["variant_id"], i["product_id"], i["quantity"]) for i in items] == [
+        ("variant-1", "product-1", 3),
+        ("variant-2", "product-1", 5),
+    ]
+
+
+def test_bulk_rejects_the_whole_batch_when_a_variant_is_unavailable(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    fake_db.variants.docs.append(
+        {"id": "variant-3", "product_id": "product-1", "is_active": True, "in_stock": False, "selling_price": 5}
+    )
+    client = TestClient(app)
+
+    response = client.post(
+        "/cart/bulk",
+        json={"operations": [
+            {"op": "add", "variant_id": "variant-1", "quantity": 1},
+            {"op": "add", "variant_id": "variant-3", "quantity": 1},
+            {"op": "set", "variant_id": "missing", "quantity": 1},
+        ]},
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["code"] == "VARIANT_UNAVAILABLE"
+    assert response.json()["detail"]["variant_ids"] == ["variant-3", "missing"]
+    assert fake_db.carts.docs == []
+
+
+def test_bulk_rejects_missing_quantities(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    client = TestClient(app)
+
+    response = client.post("/cart/bulk", json={"operations": [{"op": "set", "variant_id": "variant-1"}]})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == {
+        "message": "Quantity must be at least 1.",
+        "code": "INVALID_QUANTITY",
+        "variant_ids": ["variant-1"],
+    }
+
+
+def test_bulk_of_removes_does_not_create_a_cart(app, fake_db):
+    app.dependency_overrides[get_current_user] = user_1
+    client = TestClient(app)
+
+    response = client.post("/cart/bulk", json={"operations": [{"op": "remove", "variant_id": "variant-1"}]})
+
+    assert response.status_code == 200
+    assert response.json()["version"] == 0
+    assert fake_db.carts.docs == []
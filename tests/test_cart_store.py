@@ -0,0 +1,161 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+import services.cart_store as cart_store  # noqa: E402
+from models.cart import CartOperation  # noqa: E402
+from services.cart_store import WriteBehindCartStore  # noqa: E402
+from tests.fakes import FakeDB  # noqa: E402
+
+
+# New carts count up from the clock; pinned so versions are predictable
+START = 1_700_000_000_000
+
+
+@pytest.fixture(autouse=True)
+def pinned_start_version(monkeypatch):
+    monkeypatch.setattr(cart_store, "_initial_version", lambda: START)
+
+
+def add(variant_id, quantity=1):
+    return [CartOperation(op="add", variant_id=variant_id, product_id="product-1", quantity=quantity)]
+
+
+class RecordingDB(FakeDB):
+    """Counts cart writes; `fail_writes` makes the next N of them raise, `write_delay` slows them down."""
+
+    def __init__(self, **collections):
+        super().__init__(**collections)
+        self.cart_writes = []
+        self.fail_writes = 0
+        self.write_delay = 0
+        carts = self.carts
+        update_one = carts.update_one
+
+        async def recording_update_one(query, update, upsert=False):
+            await asyncio.sleep(self.write_delay)
+            if self.fail_writes:
+                self.fail_writes -= 1
+                raise ConnectionError("mongo unavailable")
+            self.cart_writes.append(query["user_id"])
+            return await update_one(query, update, upsert=upsert)
+
+        carts.update_one = recording_update_one
+
+    def cart(self, user_id):
+        return next((doc for doc in self.carts.docs if doc["user_id"] == user_id), None)
+
+
+def quantities(cart):
+    return {item["variant_id"]: item["quantity"] for item in cart["items"]}
+
+
+def test_a_burst_of_changes_is_written_once_after_the_delay():
+    async def scenario():
+        db = RecordingDB()
+        store = WriteBehindCartStore(db, capacity=10, flush_delay=0.01)
+
+        for _ in range(5):
+            await store.apply("user-1", add("variant-1"))
+        assert db.cart_writes == []
+
+        await asyncio.sleep(0.05)
+        return db
+
+    db = asyncio.run(scenario())
+
+    assert db.cart_writes == ["user-1"]
+    assert quantities(db.cart("user-1")) == {"variant-1": 5}
+    assert db.cart("user-1")["version"] == START + 5
+
+
+def test_evicted_dirty_cart_is_written_back_and_reloaded():
+    async def scenario():
+        db = RecordingDB()
+        store = WriteBehindCartStore(db, capacity=1, flush_delay=60)
+
+        await store.apply("user-1", add("variant-1", 2))
+        await store.apply("user-2", add("variant-2"))  # evicts user-1
+        reloaded = await store.get("user-1")
+        return db, reloaded
+
+    db, reloaded = asyncio.run(scenario())
+
+    assert db.cart_writes[0] == "user-1"
+    assert quantities(db.cart("user-1")) == {"variant-1": 2}
+    assert quantities(reloaded) == {"variant-1": 2} and reloaded["version"] == START + 1
+
+
+def test_flush_persists_one_cart_immediately():
+    async def scenario():
+        db = RecordingDB()
+        store = WriteBehindCartStore(db, capacity=10, flush_delay=60)
+
+        await store.apply("user-1", add("variant-1"))
+        await store.apply("user-2", add("variant-1"))
+        await store.flush("user-1")  # as checkout does before reading Mongo
+        return db
+
+    db = asyncio.run(scenario())
+
+    assert db.cart_writes == ["user-1"]
+    assert db.cart("user-1")["version"] == START + 1
+    assert db.cart("user-2") is None
+
+
+def test_failed_write_is_retried():
+    async def scenario():
+        db = RecordingDB()
+        db.fail_writes = 1
+        store = WriteBehindCartStore(db, capacity=10, flush_delay=0.01)
+
+        await store.apply("user-1", add("variant-1"))
+        await asyncio.sleep(0.05)
+        return db
+
+    db = asyncio.run(scenario())
+
+    assert db.cart_writes == ["user-1"]
+    assert quantities(db.cart("user-1")) == {"variant-1": 1}
+
+
+def test_failed_write_of_an_evicted_cart_is_kept_and_retried():
+    async def scenario():
+        db = RecordingDB()
+        db.fail_writes = 1
+        store = WriteBehindCartStore(db, capacity=1, flush_delay=0.01)
+
+        await store.apply("user-1", add("variant-1", 3))
+        await store.apply("user-2", add("variant-2"))  # evicts user-1; its write fails
+        await asyncio.sleep(0.05)
+        return db
+
+    db = asyncio.run(scenario())
+
+    assert quantities(db.cart("user-1")) == {"variant-1": 3}
+    assert quantities(db.cart("user-2")) == {"variant-2": 1}
+
+
+def test_close_persists_dirty_carts_and_waits_for_writes_in_flight():
+    async def scenario():
+        db = RecordingDB()
+        db.write_delay = 0.05
+        store = WriteBehindCartStore(db, capacity=10, flush_delay=0.01)
+
+        await store.apply("user-1", add("variant-1"))
+        await asyncio.sleep(0.02)  # user-1's timer write is now in flight
+        db.write_delay = 0
+        await store.apply("user-2", add("variant-2"))  # still only dirty in memory
+
+        await store.close()
+        return db
+
+    db = asyncio.run(scenario())
+
+    assert sorted(db.cart_writes) == ["user-1", "user-2"]
+    assert quantities(db.cart("user-1")) == {"variant-1": 1}
+    assert quantities(db.cart("user-2")) == {"variant-2": 1}
@@ -0,0 +1,170 @@
+import base64
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+import routes.products as product_routes  # noqa: E402
+from models.product import VariantResponse  # noqa: E402
+from services.catalog import CatalogSnapshot, encode_cursor  # noqa: E402
+
+
+def variant(product_id, size):
+    return {
+        "id": f"{product_id}-{size}",
+        "product_id": product_id,
+        "size": size,
+        "mrp": 120,
+        "selling_price": 100,
+        "sku": f"SKU-{product_id}-{size}",
+        "cost_price": 40,  # internal; not part of the response model
+    }
+
+
+def product(index, name, category="Ground Spices", created_at=None):
+    product_id = f"p-{index:02d}"
+    return {
+        "id": product_id,
+        "name": name,
+        "slug": product_id,
+        "description": f"{name}, stone ground.",
+        "category": category,
+        "created_at": created_at or f"2025-01-{index:02d}T00:00:00",
+        "updated_at": "2025-02-01T00:00:00",
+        "supplier": "internal",  # likewise never served
+        "variants": [variant(product_id, "100g"), variant(product_id, "250g")],
+    }
+
+
+def make_products():
+    # Sorted by LISTING_SORT as the snapshot pipeline returns them; p-05..p-07 share a created_at
+    products = [product(i, f"Masala {i}", "Blends" if i % 3 == 0 else "Ground Spices") for i in range(1, 5)]
+    products += [product(i, f"Chilli {i}", created_at="2025-01-05T00:00:00") for i in range(5, 8)]
+    products += [product(i, f"Masala Chilli {i}") for i in range(8, 12)]
+    return products
+
+
+@pytest.fixture
+def catalog():
+    return CatalogSnapshot(1, make_products())
+
+
+def page_through(catalog, **filters):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page, cursor = catalog.page(cursor=cursor, limit=3, **filters)
+        ids += [p["id"] for p in page]
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+
+def test_listing_pages_reach_the_end_without_gaps_or_repeats(catalog):
+    ids, pages = page_through(catalog)
+
+    assert ids == [p["id"] for p in catalog.products]
+    assert pages == 4
+
+
+def test_category_listing_pages_stay_in_the_category(catalog):
+    ids, _ = page_through(catalog, category="Ground Spices")
+
+    assert ids == [p["id"] for p in catalog.by_category["Ground Spices"]]
+
+
+def test_search_pages_keep_relevance_order(catalog):
+    ids, pages = page_through(catalog, search="chilli")
+
+    assert ids == catalog.search_index.search("chilli")
+    assert len(ids) == 7 and pages == 3
+
+
+def test_listing_resumes_after_the_cursor_key_within_a_created_at_tie(catalog):
+    cursor = encode_cursor("2025-01-05T00:00:00", "p-06")
+
+    page, _ = catalog.page(cursor=cursor, limit=3)
+
+    assert [p["id"] for p in page] == ["p-07", "p-08", "p-09"]
+
+
+@pytest.mark.parametrize("cursor, search", [
+    ("not a cursor!", None),
+    (base64.urlsafe_b64encode(b'{"id": "p-01"}').decode(), None),
+    (encode_cursor("p-01"), None),  # a search cursor on a listing
+    (encode_cursor("2025-01-01T00:00:00", "p-01"), "chilli"),  # a listing cursor on a search
+])
+def test_malformed_cursors_are_rejected(catalog, cursor, search):
+    with pytest.raises(ValueError):
+        catalog.page(cursor=cursor, search=search)
+
+
+@pytest.fixture
+def client(catalog, monkeypatch):
+    # The Mongo fake cannot run the $lookup snapshot pipeline; serve the snapshot directly
+    async def snapshot(db):
+        return catalog
+
+    async def no_db():
+        return None
+
+    monkeypatch.setattr(product_routes, "get_catalog", snapshot)
+    app = FastAPI()
+    app.include_router(product_routes.router)
+    app.dependency_overrides[product_routes.get_db] = no_db
+    return TestClient(app)
+
+
+def test_unfiltered_listing_is_served_pre_encoded_with_an_etag(client, catalog):
+    response = client.get("/products")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [p["id"] for p in body] == [p["id"] for p in make_products()]
+    assert "supplier" not in body[0] and "cost_price" not in body[0]["variants"][0]
+    assert "X-Next-Cursor" not in response.headers
+
+    cached = client.get("/products", headers={"If-None-Match": response.headers["ETag"]})
+    assert cached.status_code == 304
+    assert None in catalog._encoded  # encoded once, then reused
+
+
+def test_next_cursor_header_walks_a_limited_listing(client):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": 4, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/products", params=params)
+        assert response.status_code == 200
+        ids += [p["id"] for p in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert ids == [p["id"] for p in make_products()]
+
+
+def test_invalid_cursor_is_a_400(client):
+    response = client.get("/products", params={"cursor": "garbage"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["code"] == "INVALID_CURSOR"
+
+
+def test_sparse_fields_go_through_the_response_model(client):
+    response = client.get("/products", params={"fields": "variants", "search": "chilli", "limit": 2})
+
+    assert response.status_code == 200
+    assert response.headers["X-Next-Cursor"]
+    body = response.json()
+    assert [set(p) for p in body] == [{"id", "variants"}] * 2
+    assert set(body[0]["variants"][0]) == set(VariantResponse.model_fields)
+
+
+def test_unknown_fields_are_a_400(client):
+    response = client.get("/products", params={"fields": "name,supplier"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["fields"] == ["supplier"]
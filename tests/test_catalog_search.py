@@ -0,0 +1,77 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+from services.catalog_search import SearchIndex, SuggestIndex  # noqa: E402
+
+PRODUCTS = [
+    {
+        "id": "p-masala",
+        "name": "Garam Masala",
+        "slug": "garam-masala",
+        "category": "Blends",
+        "description": "Warm blend with red chilli and cardamom.",
+        "benefits": ["Aids digestion"],
+    },
+    {
+        "id": "p-chilli",
+        "name": "Red Chilli Powder",
+        "slug": "red-chilli-powder",
+        "category": "Ground Spices",
+        "description": "Sun-dried chillies, stone ground.",
+        "benefits": [],
+    },
+    {
+        "id": "p-turmeric",
+        "name": "Turmeric Powder",
+        "slug": "turmeric-powder",
+        "category": "Ground Spices",
+        "description": "High curcumin turmeric.",
+        "benefits": ["Anti-inflammatory", "Supports digestion"],
+    },
+]
+
+
+def test_name_hits_outrank_description_hits():
+    index = SearchIndex(PRODUCTS)
+
+    assert index.search("chilli") == ["p-chilli", "p-masala"]
+
+
+def test_every_token_must_match():
+    index = SearchIndex(PRODUCTS)
+
+    assert index.search("red powder") == ["p-chilli"]
+    assert index.search("turmeric chilli") == []
+
+
+def test_prefix_matches_score_below_exact_matches():
+    index = SearchIndex([
+        {"id": "p-whole", "name": "Whole Chillies"},
+        {"id": "p-flakes", "name": "Chilli Flakes"},
+    ])
+
+    assert index.search("chilli") == ["p-flakes", "p-whole"]
+    assert index.search("chil") == ["p-whole", "p-flakes"]
+
+
+def test_ties_keep_catalog_order_and_empty_queries_match_nothing():
+    index = SearchIndex(PRODUCTS)
+
+    assert index.search("ground spices") == ["p-chilli", "p-turmeric"]
+    assert index.search("  !! ") == []
+    assert index.search("saffron") == []
+
+
+def test_suggestions_rank_name_prefixes_before_categories_and_later_words():
+    index = SuggestIndex(PRODUCTS)
+
+    texts = [s["text"] for s in index.suggest("g")]
+    assert texts == ["Garam Masala", "Ground Spices"]
+
+    powder = index.suggest("powd")
+    assert [s["slug"] for s in powder] == ["red-chilli-powder", "turmeric-powder"]
+    assert index.suggest("tur", limit=1) == [
+        {"type": "product", "text": "Turmeric Powder", "slug": "turmeric-powder", "category": "Ground Spices"}
+    ]
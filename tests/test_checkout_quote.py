@@ -0,0 +1,98 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+from services import checkout_quote  # noqa: E402
+from services.checkout_quote import QuoteError, issue_quote, revalidate_quote, verify_quote  # noqa: E402
+from tests.fakes import FakeDB  # noqa: E402
+
+LINES = [{"variant_id": "v-1", "product_id": "p-1", "mrp": 120, "price": 100, "quantity": 2}]
+TOTALS = {"subtotal": 200, "grand_total": 329}
+
+
+@pytest.fixture(autouse=True)
+def quote_secret(monkeypatch):
+    monkeypatch.setenv("CHECKOUT_QUOTE_SECRET", "test-quote-secret")
+
+
+def issue(**overrides):
+    kwargs = {"user_id": "user-1", "cart_version": 3, "lines": LINES, "totals": TOTALS, "payment_method": "COD"}
+    kwargs.update(overrides)
+    return issue_quote(**kwargs)["token"]
+
+
+def test_issued_quote_round_trips():
+    quote = verify_quote(issue(), "user-1")
+
+    assert quote["uid"] == "user-1"
+    assert quote["cv"] == 3
+    assert quote["pm"] == "COD"
+    assert quote["lines"] == LINES
+    assert quote["totals"] == TOTALS
+
+
+def test_tampered_quote_is_rejected():
+    body, _, signature = issue().partition(".")
+    forged = issue(totals={"subtotal": 200, "grand_total": 1}).partition(".")[0]
+
+    with pytest.raises(QuoteError) as exc:
+        verify_quote(f"{forged}.{signature}", "user-1")
+    assert exc.value.code == "QUOTE_INVALID"
+
+    with pytest.raises(QuoteError):
+        verify_quote(body, "user-1")
+
+
+def test_quote_signed_with_another_secret_is_rejected(monkeypatch):
+    monkeypatch.setenv("CHECKOUT_QUOTE_SECRET", "someone-elses-secret")
+    token = issue()
+    monkeypatch.setenv("CHECKOUT_QUOTE_SECRET", "test-quote-secret")
+
+    with pytest.raises(QuoteError) as exc:
+        verify_quote(token, "user-1")
+    assert exc.value.code == "QUOTE_INVALID"
+
+
+def test_quote_belongs_to_its_user():
+    with pytest.raises(QuoteError) as exc:
+        verify_quote(issue(), "user-2")
+    assert exc.value.code == "QUOTE_INVALID"
+
+
+def test_expired_quote_is_rejected(monkeypatch):
+    monkeypatch.setattr(checkout_quote, "QUOTE_TTL_SECONDS", -1)
+
+    with pytest.raises(QuoteError) as exc:
+        verify_quote(issue(), "user-1")
+    assert exc.value.code == "QUOTE_EXPIRED"
+
+
+def test_without_a_secret_quotes_are_neither_issued_nor_accepted(monkeypatch):
+    token = issue()
+    monkeypatch.delenv("CHECKOUT_QUOTE_SECRET")
+    monkeypatch.setenv("JWT_SECRET_KEY", "jwt-secret")
+
+    assert issue_quote("user-1", 3, LINES, TOTALS) is None
+    with pytest.raises(QuoteError) as exc:
+        verify_quote(token, "user-1")
+    assert exc.value.code == "QUOTE_DISABLED"
+
+
+def test_revalidation_rechecks_stock_and_coupon():
+    db = FakeDB(
+        variants=[{"id": "v-1", "is_active": True, "in_stock": True, "stock": 1, "size": "100g"}],
+        coupons=[],
+    )
+    quote = verify_quote(issue(coupon={"coupon_id": "c-1", "code": "SAVE"}), "user-1")
+
+    with pytest.raises(QuoteError) as exc:
+        asyncio.run(revalidate_quote(db, {**quote, "coupon": None}, check_stock_levels=True))
+    assert exc.value.code == "INSUFFICIENT_STOCK"
+
+    with pytest.raises(QuoteError) as exc:
+        asyncio.run(revalidate_quote(db, quote))
+    assert exc.value.code == "COUPON_INVALID"
@@ -0,0 +1,109 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+import routes.coupons as coupon_routes  # noqa: E402
+import services.coupon_codes as coupon_codes  # noqa: E402
+from models.coupon import BulkCouponCreate  # noqa: E402
+from services.coupon_codes import CouponGenerationError, generate_coupons  # noqa: E402
+from tests.fakes import FakeDB  # noqa: E402
+
+
+def bulk_request(**overrides):
+    fields = {"count": 25, "type": "flat", "value": 50, "expiry_date": "2030-01-01T00:00:00Z", "prefix": "vip"}
+    fields.update(overrides)
+    return BulkCouponCreate(**fields)
+
+
+def generate(db, request, batch_size=10):
+    async def collect():
+        return [batch async for batch in generate_coupons(db, request, batch_size=batch_size)]
+
+    return asyncio.run(collect())
+
+
+def test_generation_creates_the_unique_code_index_and_streams_batches():
+    db = FakeDB()
+
+    batches = generate(db, bulk_request())
+
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    codes = [doc["code"] for doc in db.coupons.docs]
+    assert len(set(codes)) == 25 and all(code.startswith("VIP") for code in codes)
+    assert all(doc["bulk"] and "_id" not in doc for batch in batches for doc in batch)
+    assert db.coupons.indexes["idx_coupons_code"] == {"key": [("code", 1)], "unique": True}
+
+
+def test_codes_that_collide_with_existing_coupons_are_redrawn(monkeypatch):
+    db = FakeDB(coupons=[{"id": "existing", "code": "VIPTAKEN"}])
+    draw = coupon_codes.random_codes
+    draws = iter([["VIPTAKEN", "VIPFRESH"]])
+
+    def colliding_first(count, request, exclude):
+        return next(draws, None) or draw(count, request, exclude)
+
+    monkeypatch.setattr(coupon_codes, "random_codes", colliding_first)
+
+    batches = generate(db, bulk_request(count=2))
+
+    assert [doc["code"] for doc in batches[0]] == ["VIPFRESH"]
+    assert len(batches[1]) == 1
+    assert [doc["code"] for doc in db.coupons.docs].count("VIPTAKEN") == 1
+    assert len(db.coupons.docs) == 3
+
+
+def test_generation_refuses_a_non_unique_code_index():
+    db = FakeDB()
+    asyncio.run(db.coupons.create_index("code", name="code_1"))
+
+    with pytest.raises(CouponGenerationError):
+        generate(db, bulk_request())
+
+    assert db.coupons.docs == []
+
+
+@pytest.fixture
+def client():
+    db = FakeDB()
+    app = FastAPI()
+    app.include_router(coupon_routes.router)
+
+    async def override_db():
+        return db
+
+    async def admin():
+        return {"id": "admin-1", "role": "admin"}
+
+    app.dependency_overrides[coupon_routes.get_db] = override_db
+    app.dependency_overrides[coupon_routes.require_admin_user] = admin
+    return TestClient(app)
+
+
+def test_bulk_endpoint_streams_code_id_rows(client):
+    response = client.post("/coupons/admin/bulk", json=bulk_request(count=3).model_dump())
+
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0] == "code,id" and len(lines) == 4
+
+
+def test_bulk_endpoint_ends_the_csv_with_an_error_row_when_generation_fails(client, monkeypatch):
+    async def failing_generation(db, request):
+        yield [{"code": "VIPAAAA", "id": "c-1"}]
+        raise ConnectionError("mongo unavailable")
+
+    monkeypatch.setattr(coupon_routes, "generate_coupons", failing_generation)
+
+    response = client.post("/coupons/admin/bulk", json=bulk_request(count=3).model_dump())
+
+    assert response.text.splitlines() == [
+        "code,id",
+        "VIPAAAA,c-1",
+        "# error: generation stopped after 1 of 3 coupons: mongo unavailable",
+    ]
@@ -0,0 +1,157 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+import routes.coupons as coupon_routes  # noqa: E402
+import services.coupon_redemption as coupon_redemption  # noqa: E402
+from services.coupon_finder import CouponIndex, best_coupons, get_coupon_index  # noqa: E402
+from services.coupon_redemption import COUNTERS_COLLECTION, COUNTERS_META_COLLECTION  # noqa: E402
+from services.pricing_engine import invalidate_coupon_cache  # noqa: E402
+from tests.fakes import FakeDB  # noqa: E402
+
+TOMORROW = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+
+
+def coupon(code, **overrides):
+    doc = {
+        "id": f"id-{code}",
+        "code": code,
+        "type": "flat",
+        "value": 50,
+        "min_order_amount": 0,
+        "expiry_date": TOMORROW,
+        "active": True,
+    }
+    doc.update(overrides)
+    return doc
+
+
+COUPONS = [
+    coupon("FLAT50", value=50, min_order_amount=300),
+    coupon("PCT20", type="percentage", value=20, max_discount=150, min_order_amount=500),
+    coupon("FLAT100", value=100, min_order_amount=1000),
+    coupon("WELCOME", value=80, per_user_limit=1),
+]
+
+
+@pytest.fixture(autouse=True)
+def fresh_index(monkeypatch):
+    invalidate_coupon_cache()  # the finder rebuilds its index when the cache generation moves
+    monkeypatch.setattr(coupon_redemption, "_backfilled", False)
+    monkeypatch.setattr(coupon_redemption, "_backfill_checked_at", None)
+    yield
+    invalidate_coupon_cache()
+
+
+def codes(ranked):
+    return [rule.code for rule, _ in ranked]
+
+
+def test_eligible_is_the_prefix_whose_minimum_order_is_met():
+    index = CouponIndex(COUPONS)
+
+    assert [rule.code for rule in index.eligible(299)] == ["WELCOME"]
+    assert {rule.code for rule in index.eligible(500)} == {"WELCOME", "FLAT50", "PCT20"}
+    assert len(index.eligible(10_000)) == 4
+
+
+def test_offers_are_ranked_by_discount():
+    db = FakeDB(coupons=COUPONS)
+
+    _, ranked = asyncio.run(best_coupons(db, 600))
+
+    assert [(rule.code, discount) for rule, discount in ranked] == [("PCT20", 120), ("WELCOME", 80), ("FLAT50", 50)]
+
+    _, top = asyncio.run(best_coupons(db, 2000, limit=2))
+    assert codes(top) == ["PCT20", "FLAT100"]
+
+
+def test_inactive_expired_exhausted_and_bulk_coupons_are_not_offered():
+    db = FakeDB(coupons=[
+        coupon("LIVE"),
+        coupon("OFF", active=False),
+        coupon("OLD", expiry_date=(datetime.now(timezone.utc) - timedelta(days=1)).isoformat()),
+        coupon("USEDUP", usage_limit=10, used_count=10),
+        coupon("VIPX7Q2", bulk=True),
+    ])
+
+    _, ranked = asyncio.run(best_coupons(db, 500))
+
+    assert codes(ranked) == ["LIVE"]
+
+
+def test_coupons_the_user_has_used_up_are_dropped():
+    db = FakeDB(coupons=COUPONS)
+    db[COUNTERS_COLLECTION].docs.append({"coupon_id": "id-WELCOME", "user_id": "user-1", "count": 1})
+
+    _, for_user_1 = asyncio.run(best_coupons(db, 600, "user-1"))
+    _, for_user_2 = asyncio.run(best_coupons(db, 600, "user-2"))
+
+    assert codes(for_user_1) == ["PCT20", "FLAT50"]
+    assert codes(for_user_2) == ["PCT20", "WELCOME", "FLAT50"]
+
+
+def test_before_the_backfill_used_up_coupons_are_found_in_the_usage_log():
+    db = FakeDB(coupons=COUPONS, coupon_usage=[{"coupon_id": "id-WELCOME", "user_id": "user-1"}])
+
+    _, ranked = asyncio.run(best_coupons(db, 600, "user-1"))
+
+    assert codes(ranked) == ["PCT20", "FLAT50"]
+
+
+def test_after_the_backfill_only_counters_are_read():
+    db = FakeDB(
+        coupons=COUPONS,
+        coupon_usage=[{"coupon_id": "id-WELCOME", "user_id": "user-1"}],
+        **{COUNTERS_META_COLLECTION: [{"_id": "backfill"}]},
+    )
+
+    def no_log_reads(pipeline, **kwargs):
+        raise AssertionError("usage log read after the backfill")
+
+    db.coupon_usage.aggregate = no_log_reads
+
+    _, ranked = asyncio.run(best_coupons(db, 600, "user-1"))
+
+    assert codes(ranked) == ["PCT20", "WELCOME", "FLAT50"]
+
+
+def test_index_is_reused_until_a_coupon_write_invalidates_it():
+    db = FakeDB(coupons=[coupon("FLAT50")])
+
+    first = asyncio.run(get_coupon_index(db))
+    db.coupons.docs.append(coupon("NEW100", value=100))
+    assert asyncio.run(get_coupon_index(db)) is first
+
+    invalidate_coupon_cache()
+
+    rebuilt = asyncio.run(get_coupon_index(db))
+    assert rebuilt is not first
+    assert {rule.code for rule in rebuilt.rules} == {"FLAT50", "NEW100"}
+
+
+def test_best_endpoint_describes_each_offer():
+    db = FakeDB(coupons=[coupon("FLAT50", description="Rs 50 off"), *COUPONS[1:2]])
+    app = FastAPI()
+    app.include_router(coupon_routes.router)
+
+    async def override_db():
+        return db
+
+    app.dependency_overrides[coupon_routes.get_db] = override_db
+
+    response = TestClient(app).post("/coupons/best", json={"cart_subtotal": 400})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["cart_subtotal"] == 400
+    assert [(offer["code"], offer["discount"], offer["description"]) for offer in body["coupons"]] == [
+        ("FLAT50", 50, "Rs 50 off"),
+    ]
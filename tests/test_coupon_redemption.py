@@ -0,0 +1,173 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+import services.coupon_redemption as coupon_redemption  # noqa: E402
+from services.coupon_redemption import (  # noqa: E402
+    COUNTERS_COLLECTION,
+    COUNTERS_META_COLLECTION,
+    RESERVATIONS_COLLECTION,
+    backfill_user_counters,
+    record_redemption,
+    release_expired_reservations,
+    release_reservation,
+    reserve_coupon,
+    user_redemptions,
+)
+from tests.fakes import FakeDB  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def backfill_not_seen(monkeypatch):
+    # Whether the backfill has completed is cached per worker
+    monkeypatch.setattr(coupon_redemption, "_backfilled", False)
+    monkeypatch.setattr(coupon_redemption, "_backfill_checked_at", None)
+
+
+def paid_order(order_id="order-1", coupon_id="c-1"):
+    return {
+        "id": order_id,
+        "subtotal": 500,
+        "coupon_applied": {"coupon_id": coupon_id, "code": "SAVE", "discount": 50},
+    }
+
+
+def usage(coupon_id="c-1", user_id="user-1"):
+    return {"coupon_id": coupon_id, "user_id": user_id, "used_at": "2025-01-01T00:00:00+00:00"}
+
+
+def test_without_a_counter_the_usage_log_is_counted():
+    db = FakeDB(coupon_usage=[usage(), usage(), usage(user_id="user-2")])
+
+    assert asyncio.run(user_redemptions(db, "c-1", "user-1")) == 2
+    assert asyncio.run(user_redemptions(db, "c-2", "user-1")) == 0
+
+
+def test_counter_takes_precedence_over_the_log():
+    db = FakeDB(
+        coupon_usage=[usage()],
+        **{COUNTERS_COLLECTION: [{"coupon_id": "c-1", "user_id": "user-1", "count": 4}]},
+    )
+
+    assert asyncio.run(user_redemptions(db, "c-1", "user-1")) == 4
+
+
+def test_after_the_backfill_a_missing_counter_means_zero_without_reading_the_log():
+    db = FakeDB(coupon_usage=[usage(), usage(), usage(user_id="user-2")])
+
+    written = asyncio.run(backfill_user_counters(db, batch_size=1, report=lambda _: None))
+
+    assert written == 2
+    assert db[COUNTERS_META_COLLECTION].docs[0]["_id"] == "backfill"
+
+    async def no_log_reads(query):
+        raise AssertionError("usage log counted after the backfill")
+
+    db.coupon_usage.count_documents = no_log_reads
+    assert asyncio.run(user_redemptions(db, "c-1", "user-1")) == 2
+    assert asyncio.run(user_redemptions(db, "c-1", "user-3")) == 0
+
+
+def test_workers_recheck_the_backfill_marker_after_a_while(monkeypatch):
+    db = FakeDB(coupon_usage=[usage()])
+
+    assert asyncio.run(user_redemptions(db, "c-1", "user-1")) == 1
+    db[COUNTERS_META_COLLECTION].docs.append({"_id": "backfill"})
+    assert asyncio.run(user_redemptions(db, "c-1", "user-1")) == 1  # "not yet" is still cached
+
+    monkeypatch.setattr(coupon_redemption, "BACKFILL_RECHECK_SECONDS", 0)
+
+    assert asyncio.run(user_redemptions(db, "c-1", "user-1")) == 0
+
+
+def test_first_redemption_after_deploy_seeds_the_counter_from_history():
+    db = FakeDB(coupons=[{"id": "c-1", "used_count": 2}], coupon_usage=[usage(), usage()])
+
+    asyncio.run(record_redemption(db, paid_order(), "user-1"))
+
+    assert asyncio.run(user_redemptions(db, "c-1", "user-1")) == 3
+    assert db.coupons.docs[0]["used_count"] == 3
+
+
+def test_concurrent_first_redemptions_are_both_counted():
+    db = FakeDB(coupons=[{"id": "c-1", "used_count": 0}])
+
+    async def redeem_twice():
+        await asyncio.gather(
+            record_redemption(db, paid_order("order-1"), "user-1"),
+            record_redemption(db, paid_order("order-2"), "user-1"),
+        )
+
+    asyncio.run(redeem_twice())
+
+    assert db[COUNTERS_COLLECTION].docs[0]["count"] == 2
+    assert len(db[COUNTERS_COLLECTION].docs) == 1
+
+
+def limited_coupon_db(usage_limit, used_count=0):
+    return FakeDB(coupons=[{"id": "c-1", "usage_limit": usage_limit, "used_count": used_count}])
+
+
+def test_concurrent_reservations_never_oversubscribe_a_limited_coupon():
+    db = limited_coupon_db(usage_limit=3)
+
+    async def reserve_all():
+        return await asyncio.gather(*(reserve_coupon(db, "c-1", f"order-{i}", f"user-{i}") for i in range(10)))
+
+    taken = asyncio.run(reserve_all())
+
+    assert taken.count(True) == 3
+    assert db.coupons.docs[0]["used_count"] == 3
+    assert len(db[RESERVATIONS_COLLECTION].docs) == 3
+
+
+def test_unlimited_coupons_always_reserve():
+    db = FakeDB(coupons=[{"id": "c-1", "usage_limit": None}, {"id": "c-2", "usage_limit": 0}])
+
+    assert asyncio.run(reserve_coupon(db, "c-1", "order-1", "user-1"))
+    assert asyncio.run(reserve_coupon(db, "c-2", "order-2", "user-1"))
+    assert not asyncio.run(reserve_coupon(db, "missing", "order-3", "user-1"))
+
+
+def test_released_reservation_returns_its_slot_once():
+    db = limited_coupon_db(usage_limit=1)
+
+    assert asyncio.run(reserve_coupon(db, "c-1", "order-1", "user-1"))
+    assert not asyncio.run(reserve_coupon(db, "c-1", "order-2", "user-2"))
+
+    assert asyncio.run(release_reservation(db, "order-1"))
+    assert not asyncio.run(release_reservation(db, "order-1"))
+    assert db.coupons.docs[0]["used_count"] == 0
+
+    assert asyncio.run(reserve_coupon(db, "c-1", "order-2", "user-2"))
+
+
+def test_sweeper_releases_only_expired_reservations():
+    db = limited_coupon_db(usage_limit=5, used_count=2)
+    now = datetime.now(timezone.utc)
+    db[RESERVATIONS_COLLECTION].docs.extend([
+        {"order_id": "old", "coupon_id": "c-1", "user_id": "user-1", "expires_at": now - timedelta(minutes=1)},
+        {"order_id": "new", "coupon_id": "c-1", "user_id": "user-2", "expires_at": now + timedelta(minutes=10)},
+    ])
+
+    released = asyncio.run(release_expired_reservations(db, report=lambda _: None))
+
+    assert released == 1
+    assert [r["order_id"] for r in db[RESERVATIONS_COLLECTION].docs] == ["new"]
+    assert db.coupons.docs[0]["used_count"] == 1
+
+
+def test_paying_a_reserved_order_does_not_count_the_coupon_twice():
+    db = limited_coupon_db(usage_limit=5)
+
+    asyncio.run(reserve_coupon(db, "c-1", "order-1", "user-1"))
+    asyncio.run(record_redemption(db, paid_order("order-1"), "user-1"))
+
+    assert db.coupons.docs[0]["used_count"] == 1
+    assert db[RESERVATIONS_COLLECTION].docs == []
+    assert asyncio.run(user_redemptions(db, "c-1", "user-1")) == 1
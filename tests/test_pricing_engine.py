@@ -0,0 +1,228 @@
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+import services.pricing_engine as pricing_engine  # noqa: E402
+from models.settings import GlobalSettings  # noqa: E402
+from services.pricing_engine import (  # noqa: E402
+    CouponCache,
+    CouponRejected,
+    CouponRule,
+    PricingError,
+    PricingRules,
+    compute_checkout,
+    coupon_cache_generation,
+    invalidate_coupon_cache,
+    load_coupon_rule,
+    resolve_pricing_inputs,
+)
+from services.settings_provider import GLOBAL_SETTINGS_ID, invalidate_settings  # noqa: E402
+from tests.fakes import FakeDB  # noqa: E402
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+RULES = PricingRules(GlobalSettings(
+    shipping_threshold=599,
+    shipping_fee=129,
+    cod_fee=149,
+    prepaid_discount_1=5,
+    prepaid_discount_2=5,
+    prepaid_threshold_2=1199,
+))
+
+VARIANTS = {
+    "v-small": {"id": "v-small", "mrp": 120, "selling_price": 100},
+    "v-large": {"id": "v-large", "mrp": 700, "selling_price": 600},
+}
+
+
+def coupon(**overrides):
+    doc = {
+        "id": "c-1",
+        "code": "SAVE10",
+        "type": "percentage",
+        "value": 10,
+        "max_discount": 50,
+        "min_order_amount": 300,
+        "expiry_date": (NOW + timedelta(days=1)).isoformat(),
+        "active": True,
+    }
+    doc.update(overrides)
+    return doc
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    invalidate_settings()
+    invalidate_coupon_cache()
+    yield
+    invalidate_settings()
+    invalidate_coupon_cache()
+
+
+def test_cod_order_below_free_shipping_pays_shipping_and_cod_fee():
+    result = compute_checkout([{"variant_id": "v-small", "quantity": 2}], RULES, VARIANTS, payment_method="COD", now=NOW)
+
+    assert result["subtotal"] == 200
+    assert result["mrp_total"] == 240
+    assert result["charges"] == {"shipping": 129, "cod_fee": 149}
+    assert result["discounts"]["total_discount"] == 0
+    assert result["grand_total"] == 478
+    assert result["progress"]["remaining_for_free_shipping"] == 399
+
+
+def test_prepaid_high_value_order_gets_both_discounts_and_free_shipping():
+    items = [{"variant_id": "v-large", "quantity": 2}]
+
+    result = compute_checkout(items, RULES, VARIANTS, payment_method="PREPAID", now=NOW)
+
+    assert result["subtotal"] == 1200
+    assert result["discounts"]["prepaid_discount"] == 60
+    assert result["discounts"]["high_value_discount"] == 60
+    assert result["charges"] == {"shipping": 0, "cod_fee": 0}
+    assert result["grand_total"] == 1080
+
+
+def test_coupon_discount_is_capped_and_summarized():
+    items = [{"variant_id": "v-large", "quantity": 1}]
+
+    result = compute_checkout(items, RULES, VARIANTS, CouponRule(coupon()), coupon_code="SAVE10", now=NOW)
+
+    assert result["discounts"]["coupon_discount"] == 50
+    assert result["coupon"] == {"coupon_id": "c-1", "code": "SAVE10", "type": "percentage", "value": 10, "discount": 50}
+    assert result["grand_total"] == 550
+
+
+def test_coupon_below_minimum_order_is_rejected():
+    items = [{"variant_id": "v-small", "quantity": 1}]
+
+    with pytest.raises(CouponRejected) as exc:
+        compute_checkout(items, RULES, VARIANTS, CouponRule(coupon()), coupon_code="SAVE10", now=NOW)
+
+    assert exc.value.code == "COUPON_MIN_ORDER"
+
+
+def test_expired_coupon_is_rejected():
+    items = [{"variant_id": "v-large", "quantity": 1}]
+    expired = CouponRule(coupon(expiry_date=(NOW - timedelta(minutes=1)).isoformat()))
+
+    with pytest.raises(CouponRejected) as exc:
+        compute_checkout(items, RULES, VARIANTS, expired, coupon_code="SAVE10", now=NOW)
+
+    assert exc.value.code == "COUPON_EXPIRED"
+
+
+def test_unknown_coupon_code_and_unavailable_items_are_errors():
+    with pytest.raises(CouponRejected) as exc:
+        compute_checkout([{"variant_id": "v-small", "quantity": 1}], RULES, VARIANTS, None, coupon_code="NOPE", now=NOW)
+    assert exc.value.code == "COUPON_INVALID"
+
+    with pytest.raises(PricingError):
+        compute_checkout([{"variant_id": "v-gone", "quantity": 1}], RULES, VARIANTS, now=NOW)
+
+    with pytest.raises(PricingError):
+        compute_checkout([], RULES, VARIANTS, now=NOW)
+
+
+def test_resolved_inputs_feed_the_pure_phase():
+    db = FakeDB(
+        settings=[{"_id": GLOBAL_SETTINGS_ID, "free_shipping_threshold": 1000, "shipping_fee": 50}],
+        variants=[
+            {**VARIANTS["v-small"], "is_active": True, "in_stock": True},
+            {**VARIANTS["v-large"], "is_active": True, "in_stock": False},
+        ],
+        coupons=[coupon(expiry_date=(datetime.now(timezone.utc) + timedelta(days=1)).isoformat())],
+    )
+    items = [{"variant_id": "v-small", "quantity": 4}]
+
+    rules, variants, rule = asyncio.run(resolve_pricing_inputs(db, items, " save10 "))
+
+    assert rules.shipping_threshold == 1000 and rules.shipping_fee == 50
+    assert set(variants) == {"v-small"}
+    assert rule.code == "SAVE10"
+
+    result = compute_checkout(items, rules, variants, rule, payment_method="COD", coupon_code="SAVE10")
+    assert result["discounts"]["coupon_discount"] == 40
+    assert result["grand_total"] == 400 - 40 + 50 + 149
+
+
+def expiring_in(seconds, **overrides):
+    return CouponRule(coupon(expiry_date=datetime.fromtimestamp(time.time() + seconds, timezone.utc).isoformat(), **overrides))
+
+
+def test_reloading_a_coupon_every_ttl_keeps_the_expiry_heap_bounded():
+    cache = CouponCache()
+    rule = expiring_in(3600)
+
+    for _ in range(10000):
+        cache.put("SAVE10", rule)
+
+    assert cache.get("SAVE10") == (True, rule)
+    assert len(cache._expiry_heap) == 1
+
+
+def test_coupons_whose_expiry_keeps_changing_do_not_grow_the_heap():
+    cache = CouponCache()
+
+    for i in range(1000):
+        cache.put("SAVE10", expiring_in(3600 + i))
+
+    assert len(cache._expiry_heap) <= 2
+    assert cache.get("SAVE10")[1].expires_ts == pytest.approx(time.time() + 4599, abs=5)
+
+
+def test_coupon_drops_out_when_its_expiry_passes():
+    cache = CouponCache()
+    cache.put("SOON", expiring_in(0.05))
+    cache.put("LATER", expiring_in(3600))
+
+    time.sleep(0.1)
+
+    assert cache.get("SOON") == (False, None)
+    assert cache.get("LATER")[0]
+
+
+def test_entries_expire_after_the_ttl():
+    cache = CouponCache(ttl_seconds=0)
+    cache.put("SAVE10", expiring_in(3600))
+    cache.put("NOPE", None)
+
+    assert cache.get("SAVE10") == (False, None)
+    assert cache.get("NOPE") == (False, None)
+
+
+def test_unknown_codes_are_remembered_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(pricing_engine, "NEGATIVE_CACHE_SIZE", 3)
+    cache = CouponCache()
+    cache.put("SAVE10", expiring_in(3600))
+
+    for code in ("A", "B", "C"):
+        cache.put(code, None)
+    assert cache.get("A") == (True, None)
+
+    cache.put("D", None)  # over the cap: earlier negatives are forgotten, real coupons kept
+
+    assert cache.get("A") == (False, None)
+    assert cache.get("D") == (True, None)
+    assert cache.get("SAVE10")[0]
+
+
+def test_invalidation_forgets_coupons_and_bumps_the_generation():
+    db = FakeDB(coupons=[coupon(expiry_date=(datetime.now(timezone.utc) + timedelta(days=1)).isoformat())])
+    generation = coupon_cache_generation()
+
+    assert asyncio.run(load_coupon_rule(db, "save10")).value == 10
+    db.coupons.docs[0]["value"] = 20
+    assert asyncio.run(load_coupon_rule(db, "SAVE10")).value == 10  # cached
+
+    invalidate_coupon_cache()
+
+    assert coupon_cache_generation() == generation + 1
+    assert asyncio.run(load_coupon_rule(db, "SAVE10")).value == 20
+    assert asyncio.run(load_coupon_rule(db, "MISSING")) is None
@@ -0,0 +1,126 @@
+import asyncio
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+from models.settings import GlobalSettings  # noqa: E402
+from services.pricing_engine import CouponRule, PricingRules  # noqa: E402
+from services.pricing_simulator import (  # noqa: E402
+    SCENARIO_FIELDS,
+    OrderColumns,
+    build_scenarios,
+    evaluate_scenarios,
+    load_order_columns,
+)
+from tests.fakes import FakeDB  # noqa: E402
+
+BASE = GlobalSettings(
+    shipping_threshold=599,
+    shipping_fee=129,
+    cod_fee=149,
+    prepaid_discount_1=5,
+    prepaid_discount_2=5,
+    prepaid_threshold_2=1199,
+)
+
+FAR_FUTURE = "2099-01-01T00:00:00+00:00"
+
+COUPONS = {
+    "PCT10": {"id": "c-pct", "code": "PCT10", "type": "percentage", "value": 10, "max_discount": 200, "min_order_amount": 300},
+    "FLAT150": {"id": "c-flat", "code": "FLAT150", "type": "flat", "value": 150, "min_order_amount": 0},
+}
+
+GRID = {
+    "shipping_threshold": [499, 599, 999],
+    "shipping_fee": [99, 129],
+    "cod_fee": [0, 149],
+    "prepaid_discount_1": [0, 5],
+    "prepaid_discount_2": [5, 10],
+    "prepaid_threshold_2": [999, 1199],
+    "coupon_value_scale": [0.5, 1, 3],
+}
+
+
+def random_orders(count, seed=7):
+    rng = random.Random(seed)
+    orders = []
+    for _ in range(count):
+        order = {
+            "subtotal": round(rng.uniform(50, 2500), 2),
+            "payment_method": rng.choice(["PREPAID", "COD", "gokwik", "razorpay"]),
+        }
+        code = rng.choice([None, None, "PCT10", "FLAT150"])
+        if code:
+            order["coupon_applied"] = {"code": code}
+        orders.append(order)
+    return orders
+
+
+def replay(orders, settings):
+    """Revenue of `orders` priced one by one through PricingRules.price."""
+    rules = PricingRules(GlobalSettings(**{f: int(settings[f]) for f in SCENARIO_FIELDS if f != "coupon_value_scale"}))
+    revenue = 0.0
+    for order in orders:
+        method = "PREPAID" if order["payment_method"].upper() != "COD" else "COD"
+        coupon = None
+        code = (order.get("coupon_applied") or {}).get("code")
+        if code:
+            doc = COUPONS[code]
+            if order["subtotal"] >= doc["min_order_amount"]:
+                coupon = CouponRule({**doc, "value": doc["value"] * settings["coupon_value_scale"], "expiry_date": FAR_FUTURE})
+        revenue += rules.price(order["subtotal"], method, coupon)["grand_total"]
+    return revenue
+
+
+def test_scenario_revenue_matches_replaying_every_order_through_price():
+    orders = random_orders(400)
+    columns = OrderColumns(orders, COUPONS)
+    scenarios = build_scenarios(BASE, GRID)
+
+    revenue = evaluate_scenarios(columns, scenarios)["revenue"]
+
+    for i in range(len(revenue)):
+        settings = {field: float(scenarios[field][i]) for field in SCENARIO_FIELDS}
+        # The simulator does not round each order to paise
+        assert revenue[i] == pytest.approx(replay(orders, settings), abs=0.01 * len(orders))
+
+
+def test_gateway_orders_are_prepaid_and_cod_orders_pay_the_fee():
+    columns = OrderColumns(
+        [
+            {"subtotal": 1000, "payment_method": "gokwik"},
+            {"subtotal": 1000, "payment_method": "razorpay"},
+            {"subtotal": 1000, "payment_method": "COD"},
+        ],
+        {},
+    )
+
+    assert columns.cod_count == 1
+    assert list(columns.prepaid_subtotal) == [1000, 1000]
+
+
+def test_cod_orders_are_loaded_although_their_payment_stays_pending():
+    created_at = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+
+    def order(**fields):
+        return {"subtotal": 800, "created_at": created_at, **fields}
+
+    db = FakeDB(orders=[
+        order(payment_method="COD", payment_status="PENDING", order_status="CREATED"),
+        order(payment_method="COD", payment_status="PENDING", order_status="cancelled"),
+        order(payment_method="PREPAID", payment_status="SUCCESS", order_status="PLACED"),
+        order(payment_method="PREPAID", payment_status="PENDING", order_status="CREATED"),
+        order(payment_method="gokwik", payment_status="success", order_status="processing"),
+        order(payment_method="gokwik", payment_status="failed", order_status="payment_failed"),
+    ])
+
+    columns = asyncio.run(load_order_columns(db, days=30))
+
+    assert columns.count == 3
+    assert columns.cod_count == 1
+    assert len(columns.prepaid_subtotal) == 2
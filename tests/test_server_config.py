@@ -0,0 +1,25 @@
+import ast
+from pathlib import Path
+
+SERVER = Path(__file__).resolve().parents[1] / "backend" / "server.py"
+
+# Top-level packages of the app itself; importing any of them reads settings from the environment
+APP_PACKAGES = {"db", "routes", "services", "middleware", "models", "utils"}
+
+
+def test_env_file_is_loaded_before_any_app_module_is_imported():
+    # server.py cannot be imported here (routes.orders needs `requests`), so check its statement order
+    statements = ast.parse(SERVER.read_text()).body
+
+    load_dotenv_at = next(
+        i for i, node in enumerate(statements)
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call)
+        and getattr(node.value.func, "id", None) == "load_dotenv"
+    )
+    app_imports = [
+        i for i, node in enumerate(statements)
+        if isinstance(node, ast.ImportFrom) and node.module.split(".")[0] in APP_PACKAGES
+        or isinstance(node, ast.Import) and any(alias.name.split(".")[0] in APP_PACKAGES for alias in node.names)
+    ]
+
+    assert app_imports and min(app_imports) > load_dotenv_at